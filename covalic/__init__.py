@@ -17,15 +17,14 @@
 #  limitations under the License.
 ###############################################################################
 
+import cherrypy
 import os
-import posixpath
 
 from girder import events
 from girder.api.rest import getCurrentUser
 from girder.api.v1 import resource
-from girder.constants import AccessType, STATIC_ROOT_DIR
+from girder.constants import STATIC_ROOT_DIR
 from girder.models.model_base import ValidationException
-from girder.models.folder import Folder
 from girder.models.user import User
 from girder.plugin import getPlugin, GirderPlugin, loadedPlugins, registerPluginWebroot
 from girder.utility import mail_utils
@@ -34,15 +33,27 @@ from girder.utility.webroot import WebrootBase
 from girder_jobs.constants import JobStatus
 from girder_jobs.models.job import Job
 
-from covalic.constants import PluginSettings, JOB_LOG_PREFIX
+from covalic import stats
+from covalic.constants import PluginSettings, FOLDER_ACCESS_JOB_THRESHOLD, JOB_LOG_PREFIX
+from covalic.jobs import jobMonitor, scheduleSyncFolderAccess
 from covalic.models.challenge import Challenge
+from covalic.models.leaderboard import Leaderboard
+from covalic.models.manifest import GroundTruthManifest
+from covalic.models.notification import Notification
 from covalic.models.phase import Phase
+from covalic.models.phase_lock import PhaseLock
+from covalic.models.scheduler_lease import SchedulerLease
+from covalic.models.score_cache import ScoreCache
+from covalic.models.stats_member import StatsMember
 from covalic.models.submission import Submission
+from covalic.notifications import notificationDispatcher, notifySubmissionError
 from covalic.rest.challenge import ChallengeResource
 from covalic.rest.phase import PhaseResource
 from covalic.rest.submission import SubmissionResource
-from covalic.utility import getAssetsFolder
-from covalic.utility.user_emails import getPhaseUserEmails
+from covalic.scheduler import scoringScheduler
+from covalic.timeframe import phaseActivationScheduler, statusSweeper
+from covalic.utility import syncAssetsFolderAccess
+from covalic.utility.cache import leaderboardCache, userEmailCache
 
 _HERE = os.path.abspath(os.path.dirname(__file__))
 
@@ -55,6 +66,18 @@ def validateSettings(event):
         User().load(
             event.info['value'], force=True, exc=True)
         event.preventDefault().stopPropagation()
+    elif event.info['key'] in (PluginSettings.SCORING_MAX_CONCURRENT,
+                               PluginSettings.SCORING_PHASE_MAX_CONCURRENT,
+                               PluginSettings.SCORING_USER_MAX_CONCURRENT):
+        try:
+            event.info['value'] = int(event.info['value'])
+        except (ValueError, TypeError):
+            raise ValidationException(
+                'Maximum concurrent scoring jobs must be an integer.', 'value')
+        if event.info['value'] < 1:
+            raise ValidationException(
+                'Maximum concurrent scoring jobs must be positive.', 'value')
+        event.preventDefault().stopPropagation()
 
 
 def challengeSaved(event):
@@ -62,12 +85,10 @@ def challengeSaved(event):
     Event handler for challenge save.
 
     After a challenge is saved, we want to update the Assets folder permissions
-    to be the same as the challenge.
+    to be the same as the challenge. Nothing is done unless the challenge
+    access policies changed.
     """
-    challenge = event.info
-    folder = getAssetsFolder(challenge, getCurrentUser(), False)
-    Folder().copyAccessPolicies(
-        challenge, folder, save=True)
+    syncAssetsFolderAccess(event.info, getCurrentUser())
 
 
 def onPhaseSave(event):
@@ -75,11 +96,39 @@ def onPhaseSave(event):
     Event handler for phase save.
 
     Hook into phase save event to synchronize access control between the phase
-    and submission folders for the phase.
+    and submission folders for the phase. Nothing is done unless the phase
+    admins changed, and large phases are synchronized in a background job.
     """
     phase = event.info
-    submissions = Submission().getAllSubmissions(phase)
-    Submission().updateFolderAccess(phase, submissions)
+    if not Submission().folderAccessChanged(phase):
+        return
+
+    count = Submission().collection.count_documents(
+        {'phaseId': phase['_id']}, limit=FOLDER_ACCESS_JOB_THRESHOLD + 1)
+    if count > FOLDER_ACCESS_JOB_THRESHOLD:
+        scheduleSyncFolderAccess(phase, getCurrentUser())
+    else:
+        Submission().syncFolderAccess(phase)
+
+
+def onPhaseTimeframeSave(event):
+    """Schedule the next start or end of a phase, on phase save."""
+    phaseActivationScheduler.schedule(event.info)
+
+
+def invalidateLeaderboardCache(event):
+    """Drop cached submission listings of a phase when it or one of its submissions changes."""
+    doc = event.info
+    leaderboardCache.invalidate(doc.get('phaseId', doc['_id']))
+
+
+def invalidateGroundTruthManifest(event):
+    """Mark the ground truth manifests affected by a change to an item or its files as stale."""
+    doc = event.info
+    if 'itemId' in doc:
+        GroundTruthManifest().invalidate(itemId=doc['itemId'])
+    elif 'folderId' in doc:
+        GroundTruthManifest().invalidate(folderId=doc['folderId'], itemId=doc['_id'])
 
 
 def onJobUpdate(event):
@@ -95,8 +144,6 @@ def onJobUpdate(event):
         pass
 
     if (event.info['job']['type'] == 'covalic_score' and isErrorStatus):
-        covalicHost = posixpath.dirname(mail_utils.getEmailUrlPrefix())
-
         # Create minimal log that contains only Covalic errors.
         # Use full log if no Covalic-specific errors are found.
         # Fetch log from model, because log in event may not be up-to-date.
@@ -117,41 +164,55 @@ def onJobUpdate(event):
             event.info['job']['covalicSubmissionId'])
         phase = Phase().load(
             submission['phaseId'], force=True)
-        challenge = Challenge().load(
-            phase['challengeId'], force=True)
         user = User().load(
             event.info['job']['userId'], force=True)
 
         rescoring = job.get('rescoring', False)
 
-        # Mail admins, include full log
-        emails = sorted(getPhaseUserEmails(
-            phase, AccessType.WRITE, includeChallengeUsers=True))
-        html = mail_utils.renderTemplate('covalic.submissionErrorAdmin.mako', {
-            'submission': submission,
-            'challenge': challenge,
-            'phase': phase,
-            'user': user,
-            'host': covalicHost,
-            'log': log
-        })
-        mail_utils.sendMail('Submission processing error', html, emails)
+        # Mail admins with the full log, and the user with the minimal log
+        notifySubmissionError(submission, phase, user, log, minimalLog, rescoring)
+
+
+def onScoringJobUpdate(event):
+    """Release the scheduler slot of a scoring job once it has finished."""
+    try:
+        status = int(event.info['params'].get('status'))
+    except (ValueError, TypeError):
+        return
+
+    if event.info['job']['type'] == 'covalic_score' and \
+            status in (JobStatus.SUCCESS, JobStatus.ERROR, JobStatus.CANCELED):
+        scoringScheduler.jobFinished(event.info['job'])
+
+
+def onUserGroupsSave(event):
+    """Update the participant counts of phases and challenges when a user joins or leaves groups."""
+    user = event.info
+    if '_id' not in user:
+        return
+    stored = User().collection.find_one({'_id': user['_id']}, projection=['groups']) or {}
+    previous = set(stored.get('groups') or ())
+    groups = set(user.get('groups') or ())
+    if previous != groups:
+        stats.groupsChanged(user['_id'], added=groups - previous, removed=previous - groups)
+
 
-        # Mail user, include minimal log
-        if not rescoring:
-            html = mail_utils.renderTemplate('covalic.submissionErrorUser.mako', {
-                'submission': submission,
-                'challenge': challenge,
-                'phase': phase,
-                'host': covalicHost,
-                'log': minimalLog
-            })
-            mail_utils.sendMail('Submission processing error', html, [user['email']])
+def onUserRemove(event):
+    """Stop counting a removed user as a participant."""
+    stats.groupsChanged(event.info['_id'], removed=event.info.get('groups') or ())
 
 
 def onUserSave(event):
-    """Update the user's name in their submissions, on user save."""
+    """Update the user's name in their submissions, when a saved user's identity changed."""
     user = event.info
+    if '_id' not in user:
+        return
+    fields = ('email', 'firstName', 'lastName', 'login')
+    stored = User().collection.find_one({'_id': user['_id']}, projection=fields) or {}
+    if all(stored.get(field) == user.get(field) for field in fields):
+        return
+
+    userEmailCache.invalidate()
     userName = Submission().getUserName(user)
 
     query = {
@@ -163,6 +224,9 @@ def onUserSave(event):
         }
     }
     Submission().update(query, update)
+    Leaderboard().update(query, update)
+    for phaseId in Submission().collection.distinct('phaseId', query):
+        Phase().bumpVersion(phaseId)
 
 
 class CovalicPlugin(GirderPlugin):
@@ -184,6 +248,14 @@ class CovalicPlugin(GirderPlugin):
         ModelImporter.registerModel('challenge', Challenge, 'covalic')
         ModelImporter.registerModel('phase', Phase, 'covalic')
         ModelImporter.registerModel('submission', Submission, 'covalic')
+        ModelImporter.registerModel('leaderboard', Leaderboard, 'covalic')
+        ModelImporter.registerModel('ground_truth_manifest', GroundTruthManifest, 'covalic')
+        ModelImporter.registerModel('notification', Notification, 'covalic')
+        ModelImporter.registerModel('phase_lock', PhaseLock, 'covalic')
+        ModelImporter.registerModel('scheduler_lease', SchedulerLease, 'covalic')
+        ModelImporter.registerModel('score_cache', ScoreCache, 'covalic')
+        ModelImporter.registerModel('stats_member', StatsMember, 'covalic')
+        scoringScheduler.ensureIndices()
 
         resource.allowedSearchTypes.add('challenge.covalic')
 
@@ -207,9 +279,30 @@ class CovalicPlugin(GirderPlugin):
         registerPluginWebroot(webroot, 'covalic')
 
         events.bind('jobs.job.update', 'covalic', onJobUpdate)
+        events.bind('jobs.job.update', 'covalic_scoring_scheduler', onScoringJobUpdate)
         events.bind('model.setting.validate', 'covalic', validateSettings)
         events.bind('model.challenge_challenge.save.after', 'covalic',
                     challengeSaved)
         events.bind('model.challenge_phase.save.after', 'covalic',
                     onPhaseSave)
-        events.bind('model.user.save.after', 'covalic', onUserSave)
+        events.bind('model.challenge_phase.save.after', 'covalic_phase_activation',
+                    onPhaseTimeframeSave)
+        events.bind('model.user.save', 'covalic', onUserSave)
+        events.bind('model.user.save', 'covalic_stats', onUserGroupsSave)
+        events.bind('model.user.remove', 'covalic_stats', onUserRemove)
+        for event in ('model.covalic_submission.save.after', 'model.covalic_submission.remove',
+                      'model.challenge_phase.save.after'):
+            events.bind(event, 'covalic_leaderboard_cache', invalidateLeaderboardCache)
+        for event in ('model.item.save.after', 'model.item.remove',
+                      'model.file.save.after', 'model.file.remove'):
+            events.bind(event, 'covalic_ground_truth_manifest', invalidateGroundTruthManifest)
+
+        cherrypy.engine.subscribe('start', jobMonitor.start)
+        cherrypy.engine.subscribe('stop', jobMonitor.stop)
+        cherrypy.engine.subscribe('start', scoringScheduler.dispatch)
+        cherrypy.engine.subscribe('start', notificationDispatcher.start)
+        cherrypy.engine.subscribe('stop', notificationDispatcher.stop)
+        cherrypy.engine.subscribe('start', statusSweeper.start)
+        cherrypy.engine.subscribe('stop', statusSweeper.stop)
+        cherrypy.engine.subscribe('start', phaseActivationScheduler.start)
+        cherrypy.engine.subscribe('stop', phaseActivationScheduler.stop)
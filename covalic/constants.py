@@ -21,6 +21,100 @@
 # Prefix for Covalic-specific error messages in job log.
 JOB_LOG_PREFIX = 'covalic.error:'
 
+# Maximum number of submission listing pages kept in the process-local cache,
+# and the number of seconds each page is kept.
+LEADERBOARD_CACHE_SIZE = 512
+LEADERBOARD_CACHE_TTL = 60
+
+# Maximum number of resolved access list email sets kept in the process-local
+# cache, and the number of seconds each one is kept.
+USER_EMAIL_CACHE_SIZE = 256
+USER_EMAIL_CACHE_TTL = 30
+
+# Number of submissions read from the database and written to the response
+# per chunk when exporting the submissions of a phase.
+EXPORT_BATCH_SIZE = 500
+
+# Phases with more submissions than this synchronize their submission folder
+# ACLs in a background job when their admins change.
+FOLDER_ACCESS_JOB_THRESHOLD = 1000
+
+# Number of submissions removed per batch when deleting phases, and the
+# number of threads removing their folders in parallel.
+DELETE_BATCH_SIZE = 500
+DELETE_FOLDER_WORKERS = 4
+
+# Number of seconds after which the claim to build the ground truth archive
+# of a phase expires, and the number of seconds between checks for the
+# archive by callers waiting for another one to build it.
+GROUND_TRUTH_ARCHIVE_BUILD_TIMEOUT = 3600
+GROUND_TRUTH_ARCHIVE_POLL_INTERVAL = 1
+
+# Number of seconds after which a phase lock held by a process that died is
+# released, and the number of seconds between attempts to take a held lock.
+PHASE_LOCK_TIMEOUT = 60
+PHASE_LOCK_POLL_INTERVAL = 0.05
+
+# Number of threads sending queued notifications, and the number of seconds
+# they wait between polls when no notification is due.
+NOTIFICATION_WORKERS = 2
+NOTIFICATION_POLL_INTERVAL = 5
+
+# Number of seconds a digest collects scored submissions before it is sent,
+# and the maximum number of submissions listed in a digest.
+NOTIFICATION_DIGEST_INTERVAL = 300
+NOTIFICATION_DIGEST_MAX_LISTED = 50
+
+# Number of seconds after which a claimed notification that was not sent is
+# considered abandoned, and the number of times sending is attempted.
+NOTIFICATION_CLAIM_TIMEOUT = 600
+NOTIFICATION_MAX_ATTEMPTS = 5
+
+# Number of seconds between heartbeats of the local jobs owned by a server
+# process, and the number of seconds without a heartbeat after which another
+# process resumes an unfinished local job.
+JOB_HEARTBEAT_INTERVAL = 30
+JOB_HEARTBEAT_TIMEOUT = 120
+
+# Default number of scoring jobs created at a time when rescoring a phase.
+# While waiting for its scoring jobs, the rescoring job checks for finished
+# ones every RESCORE_POLL_INTERVAL seconds.
+RESCORE_CHUNK_SIZE = 100
+RESCORE_POLL_INTERVAL = 10
+
+# Default maximum number of unfinished scoring jobs dispatched to the workers,
+# in total, per phase and per user. Further scoring jobs wait in a queue. The
+# plugin settings of the same names override these.
+SCORING_MAX_CONCURRENT = 20
+SCORING_PHASE_MAX_CONCURRENT = 10
+SCORING_USER_MAX_CONCURRENT = 2
+
+# Number of seconds without an update after which a dispatched scoring job is
+# considered lost with its worker and fails, releasing its slot.
+SCORING_JOB_TIMEOUT = 6 * 60 * 60
+
+# Number of seconds after which the dispatch lease of a process that died
+# while dispatching scoring jobs is released.
+SCORING_DISPATCH_TIMEOUT = 60
+
+
+# Number of seconds between sweeps that update the timeframe status of
+# challenges and phases whose start or end date has passed.
+STATUS_SWEEP_INTERVAL = 60
+
+# Number of seconds between reloads of the upcoming phase start and end dates
+# by the scheduler that opens and closes phases.
+PHASE_SCHEDULE_RELOAD_INTERVAL = 300
+
+
+class TimeframeStatus():
+    UPCOMING = 'upcoming'
+    ACTIVE = 'active'
+    CLOSED = 'closed'
+
 
 class PluginSettings():
     SCORING_USER_ID = 'covalic.scoring_user_id'
+    SCORING_MAX_CONCURRENT = 'covalic.scoring_max_concurrent'
+    SCORING_PHASE_MAX_CONCURRENT = 'covalic.scoring_phase_max_concurrent'
+    SCORING_USER_MAX_CONCURRENT = 'covalic.scoring_user_max_concurrent'
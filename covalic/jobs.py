@@ -0,0 +1,480 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+
+import datetime
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+
+from girder import logger
+from girder.models.user import User
+from girder.utility.progress import ProgressContext
+from girder_jobs.constants import JobStatus
+from girder_jobs.models.job import Job
+from pymongo import ReturnDocument
+
+from covalic.constants import JOB_HEARTBEAT_INTERVAL, JOB_HEARTBEAT_TIMEOUT, \
+    RESCORE_POLL_INTERVAL
+from covalic.models.challenge import Challenge
+from covalic.models.phase import Phase
+from covalic.models.submission import Submission
+
+
+_UNFINISHED = [JobStatus.INACTIVE, JobStatus.QUEUED, JobStatus.RUNNING]
+
+# Identifies this server process as the owner of the local jobs it runs. The
+# token tells this process apart from an earlier one with the same pid.
+_owner = {'host': socket.gethostname(), 'pid': os.getpid(), 'token': uuid.uuid4().hex}
+
+
+class JobCanceledError(Exception):
+    """Raised from a job checkpoint when the job has been canceled."""
+
+
+def _requireNotCanceled(job):
+    job = Job().load(job['_id'], force=True, includeLog=False)
+    if job['status'] in (JobStatus.CANCELED, JobStatus.CANCELING):
+        raise JobCanceledError()
+    return job
+
+
+def _ownerFields():
+    return {'covalicOwner': _owner, 'covalicHeartbeat': datetime.datetime.utcnow()}
+
+
+def _scheduleLocalJob(job):
+    # Record this process as the owner, so other processes do not resume the job
+    fields = _ownerFields()
+    Job().update({'_id': job['_id']}, {'$set': fields})
+    job.update(fields)
+    Job().scheduleJob(job)
+
+
+def _processExists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _isOrphaned(job):
+    owner = job.get('covalicOwner')
+    if owner is not None:
+        if owner['token'] == _owner['token']:
+            return False
+        if owner['host'] == _owner['host'] and (
+                owner['pid'] == _owner['pid'] or not _processExists(owner['pid'])):
+            return True
+    # Jobs scheduled before owners were recorded only have their update time
+    heartbeat = job.get('covalicHeartbeat') or job.get('updated')
+    return heartbeat is None or heartbeat < datetime.datetime.utcnow() - datetime.timedelta(
+        seconds=JOB_HEARTBEAT_TIMEOUT)
+
+
+def heartbeatJobs():
+    """
+    Mark the unfinished local jobs owned by this server process as alive.
+
+    :returns: The number of jobs.
+    """
+    return Job().collection.update_many({
+        'covalicOwner.token': _owner['token'],
+        'status': {'$in': _UNFINISHED}
+    }, {'$set': {'covalicHeartbeat': datetime.datetime.utcnow()}}).modified_count
+
+
+def resumeInterruptedJobs():
+    """
+    Run again the local jobs of this plugin whose server process is gone.
+
+    These jobs checkpoint their progress or are safe to repeat, so running
+    an interrupted job again finishes its work. A job is only resumed if its
+    owner was a process on this host that no longer exists, or if its owner
+    has not sent a heartbeat for ``JOB_HEARTBEAT_TIMEOUT`` seconds, so jobs
+    running on other servers are left alone.
+
+    :returns: The number of resumed jobs.
+    """
+    count = 0
+    for job in Job().collection.find({
+        'handler': 'local',
+        'module': 'covalic.jobs',
+        'status': {'$in': _UNFINISHED}
+    }, projection={'log': False}):
+        if not _isOrphaned(job):
+            continue
+        # Local jobs start from the inactive state. Matching the heartbeat
+        # ensures only one process takes over the job.
+        fields = _ownerFields()
+        fields['status'] = JobStatus.INACTIVE
+        job = Job().collection.find_one_and_update({
+            '_id': job['_id'],
+            'status': job['status'],
+            'covalicHeartbeat': job.get('covalicHeartbeat')
+        }, {'$set': fields}, return_document=ReturnDocument.AFTER)
+        if job is None:
+            continue
+        job = Job().updateJob(job, log='Resuming after its server process stopped.\n')
+        Job().scheduleJob(job)
+        count += 1
+    return count
+
+
+class JobMonitor(object):
+    """
+    A daemon thread that sends heartbeats for the local jobs of this process.
+
+    It also resumes the local jobs whose process is gone.
+
+    :param interval: The number of seconds between heartbeats.
+    :type interval: float
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='covalic-job-monitor')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                heartbeatJobs()
+                resumeInterruptedJobs()
+            except Exception:  # noqa: B902
+                logger.exception('Failed to monitor the local jobs.')
+            self._stop.wait(self.interval)
+
+
+jobMonitor = JobMonitor(JOB_HEARTBEAT_INTERVAL)
+
+
+def scheduleRecomputeOverallScores(phase, user):
+    """
+    Schedule a local job that recomputes the overall scores of a phase.
+
+    Any recomputation of the same phase that has not finished yet is canceled,
+    since it would be using outdated metric weights.
+
+    :param phase: The phase to recompute all submissions on.
+    :param user: The user who owns the job.
+    :returns: The job document.
+    """
+    unfinished = Job().find({
+        'type': 'covalic_recompute_overall_scores',
+        'covalicPhaseId': phase['_id'],
+        'status': {'$in': _UNFINISHED}
+    })
+    for job in unfinished:
+        Job().cancelJob(job)
+
+    job = Job().createLocalJob(
+        module='covalic.jobs', function='recomputeOverallScores',
+        title='%s: overall score recomputation' % phase['name'],
+        type='covalic_recompute_overall_scores', user=user, asynchronous=True,
+        kwargs={'phaseId': str(phase['_id'])},
+        otherFields={'covalicPhaseId': phase['_id']})
+    _scheduleLocalJob(job)
+    return job
+
+
+def recomputeOverallScores(job):
+    """
+    Recompute the overall scores of a phase's submissions.
+
+    Progress is checkpointed on the job after each batch as the ID of the last
+    processed submission, so running the same job again resumes where it left
+    off instead of starting over. Interrupted jobs are run again by
+    :py:func:`resumeInterruptedJobs` when the server starts.
+
+    :param job: The job document.
+    """
+    job = Job().updateJob(job, status=JobStatus.RUNNING)
+
+    try:
+        phase = Phase().load(job['kwargs']['phaseId'], force=True, exc=True)
+        user = User().load(job['userId'], force=True)
+        startId = job.get('covalicLastId')
+        done = job.get('covalicProcessed', 0)
+        total = done + Submission().countScoredSubmissions(phase, startId)
+        job = Job().updateJob(
+            job, progressTotal=total, progressCurrent=done,
+            log='Recomputing %d overall scores for phase %s.\n' % (total - done, phase['name']))
+
+        def checkpoint(lastId, count):
+            _requireNotCanceled(job)
+            Job().updateJob(
+                job, progressTotal=total, progressCurrent=done + count,
+                otherFields={'covalicLastId': lastId, 'covalicProcessed': done + count})
+
+        with ProgressContext(True, user=user, title=job['title'], total=total,
+                             current=done) as ctx:
+            Submission().recomputeOverallScores(
+                phase, startId=startId, progress=ctx, checkpoint=checkpoint)
+    except JobCanceledError:
+        return
+    except Exception:  # noqa: B902
+        Job().updateJob(job, status=JobStatus.ERROR, log=traceback.format_exc())
+        raise
+
+    Job().updateJob(job, status=JobStatus.SUCCESS, log='Finished.\n')
+
+
+def scheduleSyncFolderAccess(phase, user):
+    """
+    Schedule a local job that synchronizes the submission folder ACLs of a phase.
+
+    :param phase: The phase.
+    :param user: The user who owns the job.
+    :returns: The job document.
+    """
+    job = Job().createLocalJob(
+        module='covalic.jobs', function='syncFolderAccess',
+        title='%s: submission folder access update' % phase['name'],
+        type='covalic_sync_folder_access', user=user, asynchronous=True,
+        kwargs={'phaseId': str(phase['_id'])},
+        otherFields={'covalicPhaseId': phase['_id']})
+    _scheduleLocalJob(job)
+    return job
+
+
+def syncFolderAccess(job):
+    """
+    Synchronize the submission folder ACLs of a phase with its admins.
+
+    :param job: The job document.
+    """
+    job = Job().updateJob(job, status=JobStatus.RUNNING)
+
+    try:
+        phase = Phase().load(job['kwargs']['phaseId'], force=True, exc=True)
+        Submission().syncFolderAccess(phase)
+    except Exception:  # noqa: B902
+        Job().updateJob(job, status=JobStatus.ERROR, log=traceback.format_exc())
+        raise
+
+    Job().updateJob(job, status=JobStatus.SUCCESS, log='Finished.\n')
+
+
+def scheduleRescorePhase(phase, user, apiUrl, chunkSize, maxConcurrent, force=False):
+    """
+    Schedule a local job that re-scores the latest submissions of a phase.
+
+    :param phase: The phase.
+    :param user: The user who owns the job.
+    :param apiUrl: The API URL the scoring jobs post the scores to.
+    :param chunkSize: The number of scoring jobs to create at a time.
+    :type chunkSize: int
+    :param maxConcurrent: The maximum number of unfinished scoring jobs.
+    :type maxConcurrent: int
+    :param force: Whether to run the scoring jobs even if scores are cached.
+    :type force: bool
+    :returns: The job document.
+    """
+    job = Job().createLocalJob(
+        module='covalic.jobs', function='rescorePhase',
+        title='%s: rescoring' % phase['name'],
+        type='covalic_rescore_phase', user=user, asynchronous=True,
+        kwargs={
+            'phaseId': str(phase['_id']),
+            'apiUrl': apiUrl,
+            'chunkSize': chunkSize,
+            'maxConcurrent': maxConcurrent,
+            'force': force
+        },
+        otherFields={'covalicPhaseId': phase['_id']})
+    _scheduleLocalJob(job)
+    return job
+
+
+def _unfinishedJobIds(jobIds):
+    return [doc['_id'] for doc in Job().collection.find({
+        '_id': {'$in': jobIds},
+        'status': {'$in': _UNFINISHED}
+    }, projection=['_id'])]
+
+
+def rescorePhase(job):
+    """
+    Re-score the latest submissions of a phase.
+
+    The scoring context is looked up once for the whole phase. Scoring jobs
+    are created in chunks, and no new chunk is started while that would
+    leave more than ``maxConcurrent`` scoring jobs unfinished. Progress is
+    checkpointed after each chunk, so running the same job again resumes
+    where it left off. The job only succeeds once all of its scoring jobs
+    have finished, whether or not they succeeded.
+
+    :param job: The job document.
+    """
+    job = Job().updateJob(job, status=JobStatus.RUNNING)
+
+    try:
+        phase = Phase().load(job['kwargs']['phaseId'], force=True, exc=True)
+        apiUrl = job['kwargs']['apiUrl']
+        chunkSize = job['kwargs']['chunkSize']
+        maxConcurrent = job['kwargs']['maxConcurrent']
+        force = job['kwargs'].get('force', False)
+
+        query = {'phaseId': phase['_id'], 'latest': True}
+        lastId = job.get('covalicLastId')
+        if lastId is not None:
+            query['_id'] = {'$gt': lastId}
+        done = job.get('covalicProcessed', 0)
+        total = done + Submission().collection.count_documents(query)
+        job = Job().updateJob(
+            job, progressTotal=total, progressCurrent=done,
+            log='Rescoring %d submissions for phase %s.\n' % (total - done, phase['name']))
+
+        context = Submission().getScoringContext(phase)
+        started = done
+        jobCount = 0
+        # Scoring jobs created before this job was interrupted are still waited for
+        pending = _unfinishedJobIds([doc['_id'] for doc in Job().collection.find(
+            {'covalicParentJobId': job['_id']}, projection=['_id'])])
+
+        def waitFor(limit):
+            while True:
+                _requireNotCanceled(job)
+                pending[:] = _unfinishedJobIds(pending)
+                if len(pending) <= limit:
+                    return
+                time.sleep(RESCORE_POLL_INTERVAL)
+
+        while True:
+            # Each chunk is queried separately, since a cursor held while
+            # waiting for scoring jobs would time out on the server
+            if lastId is not None:
+                query['_id'] = {'$gt': lastId}
+            chunk = list(Submission().collection.find(query, projection=[
+                'phaseId', 'folderId', 'creatorId', 'overallScore'
+            ], sort=[('_id', 1)], limit=chunkSize))
+            if not chunk:
+                break
+
+            waitFor(max(maxConcurrent - len(chunk), 0))
+            jobIds = Submission().scoreSubmissions(
+                chunk, context, apiUrl, otherFields={'covalicParentJobId': job['_id']},
+                force=force)
+            jobCount += len(jobIds)
+            pending.extend(jobIds)
+            lastId = chunk[-1]['_id']
+            done += len(chunk)
+            Job().updateJob(
+                job, progressTotal=total, progressCurrent=done,
+                otherFields={'covalicLastId': lastId, 'covalicProcessed': done})
+
+        waitFor(0)
+    except JobCanceledError:
+        return
+    except Exception:  # noqa: B902
+        Job().updateJob(job, status=JobStatus.ERROR, log=traceback.format_exc())
+        raise
+
+    failed = Job().collection.count_documents(
+        {'covalicParentJobId': job['_id'], 'status': JobStatus.ERROR})
+    Job().updateJob(
+        job, status=JobStatus.SUCCESS,
+        log='Rescored %d submissions with %d new scoring jobs, %d of which failed.\n' % (
+            done - started, jobCount, failed))
+
+
+def scheduleCascadeDelete(user, challenge=None, phase=None, progress=False):
+    """
+    Schedule a local job that removes a challenge or a phase and everything under it.
+
+    :param user: The user who owns the job.
+    :param challenge: The challenge to remove.
+    :param phase: The phase to remove, if no challenge is given.
+    :param progress: Whether to record progress notifications for the user.
+    :type progress: bool
+    :returns: The job document.
+    """
+    if challenge is not None:
+        name = 'challenge %s' % challenge['name']
+    else:
+        name = 'phase %s' % phase['name']
+
+    job = Job().createLocalJob(
+        module='covalic.jobs', function='cascadeDelete',
+        title='Deleting %s' % name, type='covalic_delete', user=user, asynchronous=True,
+        kwargs={
+            'challengeId': str(challenge['_id']) if challenge is not None else None,
+            'phaseId': str(phase['_id']) if challenge is None else None,
+            'progress': progress
+        })
+    _scheduleLocalJob(job)
+    return job
+
+
+def cascadeDelete(job):
+    """
+    Remove a challenge or a phase, along with its submissions and their folders.
+
+    The challenge or phase document is removed last, so if the job fails it
+    is still listed and removing it again finishes the removal.
+
+    :param job: The job document.
+    """
+    job = Job().updateJob(job, status=JobStatus.RUNNING)
+
+    try:
+        user = User().load(job['userId'], force=True)
+        kwargs = job['kwargs']
+        if kwargs['challengeId']:
+            model = Challenge()
+            doc = model.load(kwargs['challengeId'], force=True)
+        else:
+            model = Phase()
+            doc = model.load(kwargs['phaseId'], force=True)
+
+        total = model.subtreeCount(doc) if doc is not None else 0
+        job = Job().updateJob(
+            job, progressTotal=total, progressCurrent=0,
+            log='Deleting %d documents.\n' % total)
+
+        if doc is not None:
+            with ProgressContext(kwargs['progress'], user=user, title=job['title'],
+                                 total=total) as ctx:
+                model.remove(doc, progress=ctx)
+    except Exception:  # noqa: B902
+        Job().updateJob(job, status=JobStatus.ERROR, log=traceback.format_exc())
+        raise
+
+    Job().updateJob(job, status=JobStatus.SUCCESS, progressCurrent=total, log='Finished.\n')
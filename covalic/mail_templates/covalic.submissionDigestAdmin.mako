@@ -0,0 +1,28 @@
+<%include file="_header.mako"/>
+
+<div style="font-size: 18px; font-weight: bold; color: #009933; margin-bottom: 12px;">
+${count} submissions have been scored successfully.
+</div>
+
+<p>
+The following submissions to the challenge
+<b>${challenge['name']} (${phase['name']})</b> have finished processing:
+</p>
+
+<ul>
+% for submission in submissions:
+<li>
+<a href="${host}#submission/${submission['_id']}">${submission['title']}</a>
+from <b>${submission['creatorName']}</b>
+</li>
+% endfor
+</ul>
+
+% if count > len(submissions):
+<p>
+${count - len(submissions)} more submissions are not listed. You can view all
+results <a href="${host}#phase/${phase['_id']}">here</a>.
+</p>
+% endif
+
+<%include file="_footer.mako"/>
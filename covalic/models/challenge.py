@@ -25,13 +25,16 @@ from girder.models.model_base import AccessControlledModel, ValidationException
 from girder.utility.progress import noProgress
 
 from covalic.models.phase import Phase
-from covalic.utility import validateDate
+from covalic.models.stats_member import StatsMember
+from covalic.utility import accessQuery, timeframeStatus, validateDate
 
 
 class Challenge(AccessControlledModel):
     def initialize(self):
         self.name = 'challenge_challenge'
-        self.ensureIndices(('collectionId', 'name', 'startDate', 'endDate'))
+        self.ensureIndices((
+            'collectionId', 'name', 'startDate', 'endDate', 'public', 'access.users.id',
+            'access.groups.id', 'nextTransition', ([('status', 1), ('name', 1)], {})))
         self.ensureTextIndex({
             'name': 10,
             'description': 1
@@ -39,34 +42,42 @@ class Challenge(AccessControlledModel):
 
         self.exposeFields(level=AccessType.READ, fields={
             '_id', 'creatorId', 'collectionId', 'name', 'description',
-            'instructions', 'organizers', 'startDate', 'endDate', 'public',
+            'instructions', 'organizers', 'startDate', 'endDate', 'status', 'public',
             'thumbnails', 'thumbnailSourceId'})
 
-    def list(self, user=None, limit=50, offset=0, sort=None, filters=None):
-        """List a page of challenges."""
-        cursor = self.find(filters or {}, limit=0, sort=sort)
+    def save(self, document, *args, **kwargs):
+        # The statistics and the Assets folder state are written with atomic
+        # updates, so do not let a stale copy of the document overwrite them.
+        if '_id' in document:
+            fields = ('assetsFolderId', 'assetsFolderAccess', 'stats')
+            stored = self.collection.find_one(
+                {'_id': document['_id']}, projection=fields) or {}
+            for field in fields:
+                if field in stored:
+                    document[field] = stored[field]
+                else:
+                    document.pop(field, None)
+
+        return super(Challenge, self).save(document, *args, **kwargs)
 
-        for r in self.filterResultsByPermission(cursor=cursor, user=user,
-                                                level=AccessType.READ,
-                                                limit=limit, offset=offset):
-            yield r
+    def list(self, user=None, limit=50, offset=0, sort=None, filters=None):
+        """List a page of challenges the user can read."""
+        query = filters or {}
+        access = accessQuery(user, AccessType.READ)
+        if access is not None:
+            query = {'$and': [query, access]}
+        return self.find(query, limit=limit, offset=offset, sort=sort)
 
     def subtreeCount(self, challenge):
         """
         Count up the recursive size of the challenge.
 
-        This sums the size of
-        each individual phase, then adds 1 for the challenge itself.
+        This is the number of submissions to all of its phases, plus one record
+        for each phase and one for the challenge itself.
         """
-        count = 1
-
-        phases = Phase().find({
-            'challengeId': challenge['_id']
-        }, fields=(), limit=0)
-        for phase in phases:
-            count += Phase().subtreeCount(phase)
-
-        return count
+        from covalic.models.submission import Submission  # prevent circular import
+        phaseIds = Phase().collection.distinct('_id', {'challengeId': challenge['_id']})
+        return Submission().countSubmissions(phaseIds) + len(phaseIds) + 1
 
     def validate(self, doc):
         doc['name'] = doc['name'].strip()
@@ -101,19 +112,22 @@ class Challenge(AccessControlledModel):
                 raise ValidationException('Invalid start and end dates.',
                                           field='startDate')
 
+        doc['status'], doc['nextTransition'] = timeframeStatus(doc)
+
         return doc
 
     def remove(self, challenge, progress=noProgress):
-        # Remove all phases for this challenge
-        phases = Phase().find({
-            'challengeId': challenge['_id']
-        }, limit=0)
-        for phase in phases:
-            Phase().remove(phase, progress=progress)
-        phases.close()
+        """
+        Remove this challenge, which also removes all its phases.
 
-        AccessControlledModel.remove(self, challenge)
+        The challenge document is removed last, so an interrupted removal can
+        be resumed by removing the challenge again.
+        """
+        phaseIds = Phase().collection.distinct('_id', {'challengeId': challenge['_id']})
+        Phase().removePhases(phaseIds, progress=progress)
 
+        AccessControlledModel.remove(self, challenge)
+        StatsMember().removeParent(challenge['_id'])
         progress.update(increment=1,
                         message='Deleted challenge ' + challenge['name'])
 
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+
+import datetime
+
+from girder.constants import AccessType, SortDir
+from girder.models.model_base import Model
+from pymongo import ReturnDocument
+
+from covalic import ranking
+from covalic.models.phase import Phase
+
+
+class Leaderboard(Model):
+    """
+    Materialized leaderboard of the latest submission per (phase, creator, approach).
+
+    Rows are kept up to date incrementally as submissions are scored, edited
+    and removed, so that a leaderboard page is a single indexed range read.
+    Each row stores its dense rank in the phase and among the rows of its
+    approach, as described in :py:mod:`covalic.ranking`.
+    """
+
+    def initialize(self):
+        self.name = 'covalic_leaderboard'
+        entryIdx = ([('phaseId', 1), ('creatorId', 1), ('approach', 1)], {'unique': True})
+        rankIdx = ([('phaseId', 1), ('rank', 1)], {})
+        approachRankIdx = ([('phaseId', 1), ('approach', 1), ('approachRank', 1)], {})
+        self.ensureIndices((entryIdx, rankIdx, approachRankIdx, 'submissionId'))
+        self.exposeFields(level=AccessType.READ, fields=(
+            '_id', 'phaseId', 'submissionId', 'creatorId', 'creatorName', 'approach', 'title',
+            'organization', 'organizationUrl', 'documentationUrl', 'created', 'overallScore',
+            'averages', 'rank', 'approachRank'
+        ))
+
+    def validate(self, doc):
+        return doc
+
+    def _shiftRanks(self, row, oldScore, newScore):
+        """
+        Adjust the ranks of the other rows in a phase after one row's score changes.
+
+        Pass None as ``oldScore`` when a row is added, and None as ``newScore``
+        when a row is removed.
+        """
+        others = {'phaseId': row['phaseId'], '_id': {'$ne': row.get('_id')}}
+        ranking.shiftDenseRanks(self.collection, others, 'rank', oldScore, newScore)
+        ranking.shiftDenseRanks(
+            self.collection, dict(others, approach=row['approach']), 'approachRank',
+            oldScore, newScore)
+
+    def _entryFields(self, submission):
+        fields = {
+            'submissionId': submission['_id'],
+            'creatorName': submission.get('creatorName'),
+            'title': submission.get('title'),
+            'organization': submission.get('organization'),
+            'organizationUrl': submission.get('organizationUrl'),
+            'documentationUrl': submission.get('documentationUrl'),
+            'created': submission.get('created'),
+            'overallScore': submission['overallScore'],
+            'updated': datetime.datetime.utcnow()
+        }
+        if submission.get('score'):
+            fields['averages'] = submission['score'][0]['metrics']
+        return fields
+
+    def updateEntry(self, submission):
+        """
+        Insert or update the leaderboard row for a latest, scored submission.
+
+        :param submission: The submission document.
+        :type submission: dict
+        """
+        key = {
+            'phaseId': submission['phaseId'],
+            'creatorId': submission['creatorId'],
+            'approach': submission.get('approach') or 'default'
+        }
+
+        # The submission may have been moved to another approach
+        for stale in self.find({'submissionId': submission['_id']}):
+            if stale['approach'] != key['approach']:
+                self.removeEntry(stale)
+
+        existing = self.findOne(key, fields=['overallScore'])
+        newScore = submission['overallScore']
+        self._shiftRanks(
+            dict(key, _id=existing and existing['_id']),
+            existing and existing['overallScore'], newScore)
+
+        row = self.collection.find_one_and_update(key, {
+            '$set': self._entryFields(submission)
+        }, upsert=True, return_document=ReturnDocument.AFTER)
+
+        others = {'phaseId': key['phaseId'], '_id': {'$ne': row['_id']}}
+        row['rank'] = ranking.denseRank(self.collection, others, newScore)
+        row['approachRank'] = ranking.denseRank(
+            self.collection, dict(others, approach=key['approach']), newScore)
+        self.collection.update_one({'_id': row['_id']}, {'$set': {
+            'rank': row['rank'],
+            'approachRank': row['approachRank']
+        }})
+        return row
+
+    def removeEntry(self, doc):
+        """
+        Remove a leaderboard row, given either the row or its submission.
+
+        :param doc: A leaderboard row or a submission document.
+        :type doc: dict
+        """
+        row = self.collection.find_one_and_delete({
+            '$or': [{'_id': doc['_id']}, {'submissionId': doc['_id']}]
+        })
+        if row is not None:
+            self._shiftRanks(row, row['overallScore'], None)
+
+    def rebuild(self, phase):
+        """
+        Recompute every leaderboard row of a phase from its latest submissions.
+
+        Ranks are copied from the submissions, so this should only be called
+        after their ranks have been rebuilt; use
+        :py:meth:`covalic.models.submission.Submission.rebuildRanks`.
+
+        :param phase: The phase.
+        """
+        from covalic.models.submission import Submission  # prevent circular import
+
+        submissions = Submission().find({
+            'phaseId': phase['_id'],
+            'latest': True,
+            'overallScore': {'$ne': None}
+        }, fields={
+            'score': {'$slice': 1}
+        })
+
+        rows = []
+        for submission in submissions:
+            row = self._entryFields(submission)
+            row.update({
+                'phaseId': submission['phaseId'],
+                'creatorId': submission['creatorId'],
+                'approach': submission.get('approach') or 'default',
+                'rank': submission['rank'],
+                'approachRank': submission['approachRank']
+            })
+            rows.append(row)
+
+        self.collection.delete_many({'phaseId': phase['_id']})
+        if rows:
+            self.collection.insert_many(rows, ordered=False)
+        Phase().update({'_id': phase['_id']}, {'$set': {'leaderboardBuilt': True}})
+
+    def list(self, phase, limit=50, offset=0, sort=None, approach=None):
+        """
+        List a page of the leaderboard of a phase.
+
+        :param phase: The phase.
+        :param approach: If set, only list rows for this approach.
+        :type approach: str or None
+        """
+        if not phase.get('leaderboardBuilt'):
+            from covalic.models.submission import Submission  # prevent circular import
+            Submission().rebuildRanks(phase)
+
+        q = {'phaseId': phase['_id']}
+        if approach is not None:
+            q['approach'] = approach or 'default'
+
+        return self.find(q, limit=limit, offset=offset, sort=sort or [('rank', SortDir.ASCENDING)])
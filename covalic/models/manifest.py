@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+from bson.objectid import ObjectId
+from girder.models.file import File
+from girder.models.item import Item
+from girder.models.model_base import Model
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+
+def matchName(name):
+    """Return the part of an item name that is matched, which ends at its first dot."""
+    return name.split('.', 1)[0]
+
+
+class GroundTruthManifest(Model):
+    """
+    Cached listing of the items of a ground truth folder.
+
+    Each manifest lists the name, size and checksum of the items of a folder,
+    along with a version stamp that changes whenever it is rebuilt. Manifests
+    are invalidated by item and file events, and rebuilt on their next use.
+    """
+
+    def initialize(self):
+        self.name = 'covalic_ground_truth_manifest'
+        self.ensureIndices((([('folderId', 1)], {'unique': True}), 'items._id'))
+
+    def validate(self, doc):
+        return doc
+
+    def invalidate(self, folderId=None, itemId=None):
+        """
+        Mark the manifests affected by a change to a folder or an item as stale.
+
+        :param folderId: The ID of a folder whose items changed.
+        :type folderId: ObjectId or None
+        :param itemId: The ID of an item that changed.
+        :type itemId: ObjectId or None
+        """
+        query = []
+        if folderId is not None:
+            query.append({'folderId': folderId})
+        if itemId is not None:
+            query.append({'items._id': itemId})
+        if query:
+            self.collection.update_many({'$or': query}, {'$inc': {'generation': 1}})
+
+    def getManifest(self, folder):
+        """
+        Get the manifest of a folder, building it if it is missing or stale.
+
+        :param folder: The folder.
+        :returns: The manifest document.
+        """
+        try:
+            doc = self.collection.find_one_and_update(
+                {'folderId': folder['_id']}, {'$setOnInsert': {'generation': 0}},
+                upsert=True, return_document=ReturnDocument.AFTER)
+        except DuplicateKeyError:
+            # A concurrent call created the manifest
+            return self.getManifest(folder)
+        if doc.get('builtGeneration') == doc['generation']:
+            return doc
+
+        items = {item['_id']: {
+            '_id': item['_id'],
+            'name': item['name'],
+            'size': item.get('size', 0),
+            'sha512': None
+        } for item in Item().find({'folderId': folder['_id']}, fields=['name', 'size'])}
+        fileCounts = {}
+        for file in File().find(
+                {'itemId': {'$in': list(items)}}, fields=['itemId', 'sha512']):
+            fileCounts[file['itemId']] = fileCounts.get(file['itemId'], 0) + 1
+            items[file['itemId']]['sha512'] = file.get('sha512')
+        # Only single file items have a meaningful checksum
+        for itemId, count in fileCounts.items():
+            if count > 1:
+                items[itemId]['sha512'] = None
+
+        doc.update({
+            'items': sorted(items.values(), key=lambda item: item['name']),
+            'version': ObjectId(),
+            'builtGeneration': doc['generation']
+        })
+        # Do not store the manifest if the folder changed while it was built
+        self.collection.update_one({'_id': doc['_id'], 'generation': doc['generation']}, {
+            '$set': {
+                'items': doc['items'],
+                'version': doc['version'],
+                'builtGeneration': doc['builtGeneration']
+            }
+        })
+        return doc
+
+    def matchItems(self, manifest, names):
+        """
+        Match item names against the items of a manifest.
+
+        Names are compared without their extensions.
+
+        :param manifest: The manifest document.
+        :param names: The item names to match.
+        :type names: iterable of str
+        :returns: A dict with the sorted lists of matched names, of names in the
+            manifest that are unmatched and of input names that are unmatched.
+        """
+        groundtruths = {matchName(item['name']) for item in manifest['items']}
+        inputs = {matchName(name) for name in names}
+        return {
+            'matched': sorted(inputs & groundtruths),
+            'unmatchedGroundtruths': sorted(groundtruths - inputs),
+            'unmatchedInputs': sorted(inputs - groundtruths)
+        }
+
+    def matchFolder(self, manifest, folder):
+        """
+        Match the item names of a folder against the items of a manifest.
+
+        :param manifest: The manifest document.
+        :param folder: The folder.
+        :returns: The result of :py:meth:`matchItems`.
+        """
+        return self.matchItems(manifest, (item['name'] for item in Item().find(
+            {'folderId': folder['_id']}, fields=['name'])))
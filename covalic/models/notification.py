@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import datetime
+
+from girder.models.model_base import Model
+from pymongo import ReturnDocument
+
+from covalic.constants import NOTIFICATION_CLAIM_TIMEOUT, NOTIFICATION_MAX_ATTEMPTS
+
+
+class Notification(Model):
+    """
+    Outbound email notifications waiting to be sent.
+
+    Notifications are rendered and sent outside of the request that queued
+    them, by :py:mod:`covalic.notifications`. A notification is due once its
+    ``sendAfter`` date has passed; claiming it for sending pushes that date
+    forward, so a notification claimed by a process that died is retried.
+    """
+
+    def initialize(self):
+        self.name = 'covalic_notification'
+        self.ensureIndices(('sendAfter', 'digestKey'))
+
+    def validate(self, doc):
+        return doc
+
+    def createNotification(self, template, subject, recipients, phaseId,
+                           submissionId, userId=None, log=None):
+        """
+        Queue a notification about a submission, to be sent as soon as possible.
+
+        :param template: The name of the mail template.
+        :type template: str
+        :param subject: The subject of the email.
+        :type subject: str
+        :param recipients: Either 'user' to mail the user, or 'phaseAdmins' to
+            mail the users with WRITE access on the phase or its challenge.
+        :type recipients: str
+        :param phaseId: The ID of the phase.
+        :param submissionId: The ID of the submission.
+        :param userId: The ID of the user the notification is about.
+        :param log: Log output to include in the email.
+        :type log: str or None
+        """
+        now = datetime.datetime.utcnow()
+        return self.save({
+            'template': template,
+            'subject': subject,
+            'recipients': recipients,
+            'phaseId': phaseId,
+            'submissionIds': [submissionId],
+            'userId': userId,
+            'log': log,
+            'created': now,
+            'sendAfter': now,
+            'attempts': 0
+        })
+
+    def addToDigest(self, template, subject, digestKey, phaseId, submissionId, delay):
+        """
+        Add a submission to the pending digest with the given key, creating it if needed.
+
+        All submissions added to a digest before it is claimed for sending are
+        reported to the phase admins in a single email.
+
+        :param digestKey: The key identifying the digest.
+        :type digestKey: str
+        :param delay: The number of seconds to wait before sending a new digest.
+        :type delay: float
+        """
+        now = datetime.datetime.utcnow()
+        return self.collection.find_one_and_update({
+            'digestKey': digestKey
+        }, {
+            '$addToSet': {'submissionIds': submissionId},
+            '$setOnInsert': {
+                'template': template,
+                'subject': subject,
+                'recipients': 'phaseAdmins',
+                'phaseId': phaseId,
+                'created': now,
+                'sendAfter': now + datetime.timedelta(seconds=delay),
+                'attempts': 0
+            }
+        }, upsert=True, return_document=ReturnDocument.AFTER)
+
+    def claim(self):
+        """
+        Claim the next due notification for sending.
+
+        Once claimed, a digest stops accepting submissions.
+
+        :returns: The notification, or None if none is due.
+        """
+        now = datetime.datetime.utcnow()
+        return self.collection.find_one_and_update({
+            'sendAfter': {'$lte': now}
+        }, {
+            '$set': {'sendAfter': now + datetime.timedelta(seconds=NOTIFICATION_CLAIM_TIMEOUT)},
+            '$unset': {'digestKey': ''},
+            '$inc': {'attempts': 1}
+        }, sort=[('sendAfter', 1)], return_document=ReturnDocument.AFTER)
+
+    def retryLater(self, notification):
+        """
+        Reschedule a notification that could not be sent, with exponential backoff.
+
+        :returns: Whether the notification will be retried; if not, it is removed.
+        """
+        if notification['attempts'] >= NOTIFICATION_MAX_ATTEMPTS:
+            self.remove(notification)
+            return False
+
+        delay = datetime.timedelta(seconds=60 * 2 ** notification['attempts'])
+        self.update({'_id': notification['_id']}, {
+            '$set': {'sendAfter': datetime.datetime.utcnow() + delay}
+        })
+        return True
@@ -19,45 +19,229 @@
 
 import datetime
 import json
+import posixpath
 import six
+import tempfile
+import time
 
 from bson.objectid import ObjectId
 from girder.constants import AccessType
 from girder.models.collection import Collection
+from girder.models.file import File
 from girder.models.folder import Folder
 from girder.models.group import Group
+from girder.models.item import Item
 from girder.models.model_base import AccessControlledModel, ValidationException
+from girder.models.upload import Upload
+from girder.utility import ziputil
 from girder.utility.progress import noProgress
+from girder_jobs.constants import JobStatus
+from girder_jobs.models.job import Job
 
-from covalic.utility import validateDate
+from covalic.constants import GROUND_TRUTH_ARCHIVE_BUILD_TIMEOUT, \
+    GROUND_TRUTH_ARCHIVE_POLL_INTERVAL, TimeframeStatus
+from covalic.models.manifest import GroundTruthManifest
+from covalic.models.stats_member import StatsMember
+from covalic.utility import accessQuery, folderContentHash, timeframeStatus, validateDate
+from covalic.utility.cache import leaderboardCache
 
 
 class Phase(AccessControlledModel):
     def initialize(self):
         self.name = 'challenge_phase'
         ordinalCompoundIndex = ([('challengeId', 1), ('ordinal', 1)], {})
-        self.ensureIndices(('challengeId', 'name', ordinalCompoundIndex))
+        self.ensureIndices(('challengeId', 'name', 'nextTransition', ordinalCompoundIndex))
 
         self.exposeFields(level=AccessType.READ, fields={
             '_id', 'name', 'public', 'description', 'created', 'updated',
             'active', 'challengeId', 'folderId', 'participantGroupId',
             'groundTruthFolderId', 'testDataFolderId', 'instructions',
-            'ordinal', 'startDate', 'endDate', 'type', 'hideScores',
+            'ordinal', 'startDate', 'endDate', 'status', 'type', 'hideScores',
             'matchSubmissions', 'enableOrganization', 'enableOrganizationUrl',
             'enableDocumentationUrl', 'requireOrganization',
             'requireOrganizationUrl', 'requireDocumentationUrl', 'metrics',
             'meta'})
         self.exposeFields(level=AccessType.ADMIN, fields={'scoreTask'})
 
+    def save(self, document, *args, **kwargs):
+        # A fresh stamp (rather than an incremented counter) cannot collide
+        # with a value issued by a concurrent bumpVersion that this full
+        # document write overwrites.
+        document['version'] = ObjectId()
+
+        # The submission folder ACL sync state, the ground truth archive, its
+        # build claim and the statistics are written with atomic updates, so
+        # do not let a stale copy of the document overwrite them.
+        stored = {}
+        if '_id' in document:
+            fields = ('submissionFolderAdminIds', 'groundTruthArchive', 'groundTruthArchiveBuild',
+                      'stats')
+            stored = self.collection.find_one(
+                {'_id': document['_id']}, projection=fields + ('participantGroupId',)) or {}
+            for field in fields:
+                if field in stored:
+                    document[field] = stored[field]
+                else:
+                    document.pop(field, None)
+
+        # Participants are counted again when the participant group changes
+        participantsChanged = stored.get('participantGroupId') != document.get(
+            'participantGroupId')
+        if participantsChanged:
+            document.pop('stats', None)
+
+        document = super(Phase, self).save(document, *args, **kwargs)
+
+        if participantsChanged:
+            from covalic.models.challenge import Challenge  # prevent circular import
+            from covalic.stats import invalidateStats  # prevent circular import
+            invalidateStats(Challenge(), document['challengeId'])
+        return document
+
+    def bumpVersion(self, phaseId):
+        """
+        Record that a phase or its submissions changed.
+
+        The version stamp is used to build ETags for the phase and its
+        leaderboards, so bumping it invalidates cached copies held by clients.
+
+        :param phaseId: The ID of the phase.
+        :type phaseId: ObjectId
+        """
+        self.update({'_id': phaseId}, {'$set': {'version': ObjectId()}})
+
+    def _groundTruthFiles(self, folder, path=''):
+        """
+        Yield the files of a ground truth folder and their paths in its archive.
+
+        The layout matches the one of Girder's folder download.
+        """
+        for item in Item().find({'folderId': folder['_id']}, sort=[('name', 1)]):
+            files = list(File().find({'itemId': item['_id']}, sort=[('name', 1)]))
+            itemPath = path
+            if len(files) != 1 or files[0]['name'] != item['name']:
+                itemPath = posixpath.join(path, item['name'])
+            for file in files:
+                yield posixpath.join(itemPath, file['name']), file
+        for child in Folder().find({
+                'parentId': folder['_id'], 'parentCollection': 'folder'}, sort=[('name', 1)]):
+            for entry in self._groundTruthFiles(child, posixpath.join(path, child['name'])):
+                yield entry
+
+    def _buildGroundTruthArchive(self, phase, groundTruth, creator):
+        """Zip a ground truth folder into an item of the phase folder."""
+        phaseFolder = Folder().load(phase['folderId'], force=True)
+        folder = Folder().createFolder(
+            phaseFolder, 'Ground truth archive', parentType='folder', public=False,
+            creator=creator, reuseExisting=True)
+        # The archive is as sensitive as the ground truth itself
+        folder = Folder().copyAccessPolicies(groundTruth, folder, save=True)
+
+        zip = ziputil.ZipGenerator(groundTruth['name'])
+        with tempfile.TemporaryFile() as stream:
+            for path, file in self._groundTruthFiles(groundTruth):
+                for data in zip.addFile(File().download(file, headers=False), path):
+                    stream.write(data)
+            stream.write(zip.footer())
+            size = stream.tell()
+            stream.seek(0)
+            return Upload().uploadFromFile(
+                stream, size, 'groundtruth.zip', parentType='folder', parent=folder,
+                user=creator, mimeType='application/zip')
+
+    def getGroundTruthArchive(self, phase, groundTruth, creator, contentHash=None):
+        """
+        Get the zip archive of the ground truth of a phase, building it if needed.
+
+        The archive is stored as an item of the phase folder, and rebuilt when
+        the contents of the ground truth folder change, so that scoring jobs
+        download a stored file instead of having the ground truth zipped on
+        the fly for each of them. Concurrent callers that find the archive
+        stale wait for a single one of them to rebuild it.
+
+        :param phase: The phase.
+        :param groundTruth: The ground truth folder of the phase.
+        :param creator: The user recorded as the creator of a new archive.
+        :param contentHash: The content hash of the ground truth folder, if it
+            was already computed.
+        :type contentHash: str or None
+        :returns: The file document of the archive.
+        """
+        if contentHash is None:
+            contentHash = folderContentHash(groundTruth)
+
+        while True:
+            stored = (self.collection.find_one(
+                {'_id': phase['_id']}, projection=['groundTruthArchive']) or {}).get(
+                    'groundTruthArchive')
+            if stored and stored['folderId'] == groundTruth['_id'] and \
+                    stored['hash'] == contentHash:
+                file = File().load(stored['fileId'], force=True)
+                if file:
+                    return file
+
+            # Only one caller builds the archive of a phase at a time, the
+            # others wait for it to be stored
+            now = datetime.datetime.utcnow()
+            if self.collection.find_one_and_update({
+                '_id': phase['_id'],
+                '$or': [
+                    {'groundTruthArchiveBuild': {'$exists': False}},
+                    {'groundTruthArchiveBuild.expires': {'$lt': now}}
+                ]
+            }, {'$set': {'groundTruthArchiveBuild': {
+                'hash': contentHash,
+                'expires': now + datetime.timedelta(seconds=GROUND_TRUTH_ARCHIVE_BUILD_TIMEOUT)
+            }}}) is None:
+                time.sleep(GROUND_TRUTH_ARCHIVE_POLL_INTERVAL)
+                continue
+
+            try:
+                file = self._buildGroundTruthArchive(phase, groundTruth, creator)
+                archive = {
+                    'folderId': groundTruth['_id'],
+                    'hash': contentHash,
+                    'itemId': file['itemId'],
+                    'fileId': file['_id']
+                }
+                # Only replace the archive this call found stale, in case a
+                # build whose claim expired already replaced it
+                replaced = self.collection.find_one_and_update({
+                    '_id': phase['_id'],
+                    'groundTruthArchive.fileId':
+                        stored['fileId'] if stored else {'$exists': False}
+                }, {'$set': {'groundTruthArchive': archive}}) is not None
+            finally:
+                self.collection.update_one(
+                    {'_id': phase['_id']}, {'$unset': {'groundTruthArchiveBuild': ''}})
+
+            if not replaced:
+                Item().remove(Item().load(file['itemId'], force=True))
+                continue
+
+            if stored:
+                previous = Item().load(stored['itemId'], force=True)
+                if previous:
+                    Item().remove(previous)
+            return file
+
+    def getGroundTruthManifest(self, phase):
+        """
+        Get the manifest of the ground truth items of a phase.
+
+        :param phase: The phase.
+        :returns: The manifest document, see :py:class:`GroundTruthManifest`.
+        """
+        folder = Folder().load(phase['groundTruthFolderId'], force=True)
+        return GroundTruthManifest().getManifest(folder)
+
     def list(self, challenge, user=None, limit=50, offset=0, sort=None):
         """List phases for a challenge."""
-        cursor = self.find(
-            {'challengeId': challenge['_id']}, limit=0, sort=sort)
-
-        for r in self.filterResultsByPermission(cursor=cursor, user=user,
-                                                level=AccessType.READ,
-                                                limit=limit, offset=offset):
-            yield r
+        query = {'challengeId': challenge['_id']}
+        access = accessQuery(user, AccessType.READ)
+        if access is not None:
+            query = {'$and': [query, access]}
+        return self.find(query, limit=limit, offset=offset, sort=sort)
 
     def validate(self, doc):
         if not doc.get('name'):
@@ -79,6 +263,13 @@ class Phase(AccessControlledModel):
                 raise ValidationException('Invalid start and end dates.',
                                           field='startDate')
 
+        # A save that crosses a date boundary applies the transition, which
+        # the activation scheduler would otherwise find already applied
+        previous = doc.get('status')
+        doc['status'], doc['nextTransition'] = timeframeStatus(doc)
+        if previous not in {None, doc['status']}:
+            doc['active'] = doc['status'] == TimeframeStatus.ACTIVE
+
         # Ensure dockerArgs is a proper JSON list. If not, convert it to one.
         if doc.get('scoreTask', {}).get('dockerArgs'):
             args = doc['scoreTask']['dockerArgs']
@@ -102,18 +293,56 @@ class Phase(AccessControlledModel):
         submissions, plus one record for the phase itself.
         """
         from covalic.models.submission import Submission  # prevent circular import
-        return Submission().getAllSubmissions(phase).count() + 1
+        return Submission().countSubmissions([phase['_id']]) + 1
 
-    def remove(self, phase, progress=noProgress):
-        """Remove this phase, which also removes all submissions to it."""
+    def removePhases(self, phaseIds, progress=noProgress):
+        """
+        Remove a set of phases, along with all submissions to them.
+
+        Submissions are removed first, and the phase documents last, so a
+        phase is still listed after an interrupted removal and removing it
+        again picks up where the removal stopped. The removal events of the
+        submissions are not triggered, so the state derived from them is
+        cleaned up here: unfinished jobs of the phases are canceled and
+        release their scheduler slots, and the leaderboards, statistics
+        members, locks and cached scores of the phases are removed.
+
+        :param phaseIds: The IDs of the phases.
+        :type phaseIds: list of ObjectId
+        :param progress: A progress context to report to.
+        """
+        from covalic.models.challenge import Challenge  # prevent circular import
+        from covalic.models.leaderboard import Leaderboard  # prevent circular import
+        from covalic.models.phase_lock import PhaseLock  # prevent circular import
         from covalic.models.submission import Submission  # prevent circular import
-        for sub in Submission().getAllSubmissions(phase):
-            Submission().remove(sub)
-            progress.update(increment=1,
-                            message='Deleted submission %s' % sub['title'])
+        from covalic.scheduler import scoringScheduler  # prevent circular import
+        from covalic.stats import invalidateStats  # prevent circular import
+
+        phaseIds = list(phaseIds)
+        for job in Job().find({
+            'covalicPhaseId': {'$in': phaseIds},
+            'status': {'$in': [JobStatus.INACTIVE, JobStatus.QUEUED, JobStatus.RUNNING]}
+        }):
+            Job().cancelJob(job)
+        scoringScheduler.releasePhases(phaseIds)
+
+        Submission().removeSubmissions(phaseIds, progress=progress)
+        Leaderboard().collection.delete_many({'phaseId': {'$in': phaseIds}})
+        StatsMember().collection.delete_many({'parentId': {'$in': phaseIds}})
+        PhaseLock().collection.delete_many({'_id': {'$in': phaseIds}})
+        for phaseId in phaseIds:
+            leaderboardCache.invalidate(phaseId)
+
+        query = {'_id': {'$in': phaseIds}}
+        challengeIds = self.collection.distinct('challengeId', query)
+        self.collection.delete_many(query)
+        for challengeId in challengeIds:
+            invalidateStats(Challenge(), challengeId)
+        progress.update(increment=len(phaseIds), message='Deleted %d phases' % len(phaseIds))
 
-        super(Phase, self).remove(phase, progress=progress)
-        progress.update(increment=1, message='Deleted phase %s' % phase['name'])
+    def remove(self, phase, progress=noProgress):
+        """Remove this phase, which also removes all submissions to it."""
+        self.removePhases([phase['_id']], progress=progress)
 
     def createPhase(self, name, challenge, creator, ordinal, description='',
                     instructions='', active=False, public=True,
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import contextlib
+import datetime
+import threading
+import time
+import uuid
+
+from girder.models.model_base import Model
+from pymongo.errors import DuplicateKeyError
+
+from covalic.constants import PHASE_LOCK_POLL_INTERVAL, PHASE_LOCK_TIMEOUT
+
+# The phase locks held by the current thread, with their owner token and depth
+_held = threading.local()
+
+
+class PhaseLock(Model):
+    """
+    Locks that serialize changes to the derived state of a phase across server processes.
+
+    Dense ranks are maintained with reads followed by writes, which are only
+    correct if no other change to the ranking interleaves. A lock expires
+    after a timeout, so a process that dies while holding it does not block
+    the phase forever.
+    """
+
+    def initialize(self):
+        self.name = 'covalic_phase_lock'
+
+    def validate(self, doc):
+        return doc
+
+    def _acquire(self, phaseId, owner, timeout):
+        while True:
+            now = datetime.datetime.utcnow()
+            try:
+                # Inserting the lock fails if it exists and is still held
+                self.collection.update_one({
+                    '_id': phaseId,
+                    '$or': [{'owner': None}, {'expires': {'$lt': now}}]
+                }, {'$set': {
+                    'owner': owner,
+                    'expires': now + datetime.timedelta(seconds=timeout)
+                }}, upsert=True)
+                return
+            except DuplicateKeyError:
+                time.sleep(PHASE_LOCK_POLL_INTERVAL)
+
+    def _release(self, phaseId, owner):
+        self.collection.update_one(
+            {'_id': phaseId, 'owner': owner}, {'$set': {'owner': None}})
+
+    @contextlib.contextmanager
+    def lock(self, phaseId, timeout=PHASE_LOCK_TIMEOUT):
+        """
+        Hold the lock of a phase for the duration of a with block.
+
+        The lock is reentrant within a thread.
+
+        :param phaseId: The ID of the phase.
+        :type phaseId: ObjectId
+        :param timeout: The number of seconds after which the lock expires.
+        :type timeout: float
+        """
+        held = _held.__dict__.setdefault('locks', {})
+        if phaseId in held:
+            owner, depth = held[phaseId]
+            held[phaseId] = (owner, depth + 1)
+        else:
+            owner = uuid.uuid4().hex
+            self._acquire(phaseId, owner, timeout)
+            held[phaseId] = (owner, 1)
+
+        try:
+            yield
+        finally:
+            owner, depth = held[phaseId]
+            if depth > 1:
+                held[phaseId] = (owner, depth - 1)
+            else:
+                del held[phaseId]
+                self._release(phaseId, owner)
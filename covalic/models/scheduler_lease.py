@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import datetime
+
+from girder.models.model_base import Model
+from pymongo.errors import DuplicateKeyError
+
+from covalic.constants import SCORING_DISPATCH_TIMEOUT
+
+
+class SchedulerLease(Model):
+    """
+    Leases that let one server process at a time run a scheduler.
+
+    A process that finds a lease taken asks its holder to run again once it
+    is done, so no request to run is lost. A lease expires after a timeout,
+    so a process that dies while holding it does not stop the scheduler.
+    """
+
+    def initialize(self):
+        self.name = 'covalic_scheduler_lease'
+
+    def validate(self, doc):
+        return doc
+
+    def acquire(self, name, owner, timeout=SCORING_DISPATCH_TIMEOUT):
+        """
+        Take a lease, or ask its holder to run again if it is taken.
+
+        :param name: The name of the lease.
+        :type name: str
+        :param owner: A token identifying the caller.
+        :type owner: str
+        :param timeout: The number of seconds after which the lease expires.
+        :type timeout: float
+        :returns: Whether the lease was taken.
+        """
+        while True:
+            now = datetime.datetime.utcnow()
+            try:
+                # Inserting the lease fails if it exists and is still held
+                self.collection.update_one({
+                    '_id': name,
+                    '$or': [{'owner': None}, {'expires': {'$lt': now}}]
+                }, {'$set': {
+                    'owner': owner,
+                    'expires': now + datetime.timedelta(seconds=timeout),
+                    'rerun': False
+                }}, upsert=True)
+                return True
+            except DuplicateKeyError:
+                pass
+
+            # If the lease was released meanwhile, try to take it again
+            if self.collection.update_one({
+                '_id': name,
+                'owner': {'$ne': None},
+                'expires': {'$gte': now}
+            }, {'$set': {'rerun': True}}).matched_count:
+                return False
+
+    def release(self, name, owner, timeout=SCORING_DISPATCH_TIMEOUT):
+        """
+        Give up a lease, unless another process asked its holder to run again.
+
+        :param name: The name of the lease.
+        :type name: str
+        :param owner: The token the lease was taken with.
+        :type owner: str
+        :param timeout: The number of seconds after which a kept lease expires.
+        :type timeout: float
+        :returns: Whether the caller should run again, still holding the lease.
+        """
+        if self.collection.update_one(
+                {'_id': name, 'owner': owner, 'rerun': False},
+                {'$set': {'owner': None}}).matched_count:
+            return False
+
+        return bool(self.collection.update_one(
+            {'_id': name, 'owner': owner, 'rerun': True},
+            {'$set': {
+                'rerun': False,
+                'expires': datetime.datetime.utcnow() + datetime.timedelta(seconds=timeout)
+            }}).matched_count)
+
+    def drop(self, name, owner):
+        """
+        Give up a lease, even if another process asked its holder to run again.
+
+        :param name: The name of the lease.
+        :type name: str
+        :param owner: The token the lease was taken with.
+        :type owner: str
+        """
+        self.collection.update_one({'_id': name, 'owner': owner}, {'$set': {'owner': None}})
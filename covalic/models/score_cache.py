@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import copy
+import datetime
+
+from girder.models.model_base import Model
+
+
+class ScoreCache(Model):
+    """
+    Scores reported by the scoring jobs, keyed by the fingerprint of their inputs.
+
+    A fingerprint covers the content of the submission and ground truth
+    folders and the scoring image and arguments, so a scoring run with the
+    same fingerprint would produce the same score.
+    """
+
+    def initialize(self):
+        self.name = 'covalic_score_cache'
+        self.ensureIndices(([('fingerprint', 1)], {'unique': True}),)
+
+    def validate(self, doc):
+        return doc
+
+    def getScore(self, fingerprint):
+        """
+        Get the score stored for a fingerprint.
+
+        :param fingerprint: The fingerprint of the scoring inputs.
+        :type fingerprint: str
+        :returns: A copy of the score, or None if none is stored.
+        """
+        doc = self.findOne({'fingerprint': fingerprint}, fields=['score'])
+        return copy.deepcopy(doc['score']) if doc else None
+
+    def setScore(self, fingerprint, score):
+        """
+        Store the score reported by a scoring run.
+
+        :param fingerprint: The fingerprint of the scoring inputs.
+        :type fingerprint: str
+        :param score: The score, as reported by the scoring job.
+        :type score: list
+        """
+        self.collection.update_one({'fingerprint': fingerprint}, {'$set': {
+            'score': copy.deepcopy(score),
+            'updated': datetime.datetime.utcnow()
+        }}, upsert=True)
+
+    def removeUnreferenced(self, fingerprints):
+        """
+        Remove the scores of fingerprints that no submission was scored with anymore.
+
+        :param fingerprints: The fingerprints to check.
+        :type fingerprints: iterable of str
+        """
+        from covalic.models.submission import Submission  # prevent circular import
+
+        fingerprints = {fingerprint for fingerprint in fingerprints if fingerprint}
+        if not fingerprints:
+            return
+        fingerprints -= set(Submission().collection.distinct(
+            'scoringFingerprint', {'scoringFingerprint': {'$in': list(fingerprints)}}))
+        self.collection.delete_many({'fingerprint': {'$in': list(fingerprints)}})
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+from girder.models.model_base import Model
+from pymongo import ReturnDocument
+
+
+class StatsMember(Model):
+    """
+    Members counted in the statistics of a phase or challenge.
+
+    Each document records how many times a user is counted in a distinct
+    count, e.g. the number of submissions a user made to a phase, so that the
+    distinct count can be maintained with atomic increments.
+    """
+
+    def initialize(self):
+        self.name = 'covalic_stats_member'
+        self.ensureIndices((
+            ([('parentId', 1), ('kind', 1), ('userId', 1)], {'unique': True}),))
+
+    def validate(self, doc):
+        return doc
+
+    def increment(self, parentId, kind, userId):
+        """
+        Count a user once more.
+
+        :param parentId: The ID of the phase or challenge.
+        :type parentId: ObjectId
+        :param kind: The kind of membership, e.g. 'submitter'.
+        :type kind: str
+        :param userId: The ID of the user.
+        :type userId: ObjectId
+        :returns: Whether the user was not counted before.
+        """
+        doc = self.collection.find_one_and_update(
+            {'parentId': parentId, 'kind': kind, 'userId': userId}, {'$inc': {'count': 1}},
+            upsert=True, return_document=ReturnDocument.AFTER)
+        return doc['count'] == 1
+
+    def decrement(self, parentId, kind, userId):
+        """
+        Count a user once less.
+
+        :param parentId: The ID of the phase or challenge.
+        :type parentId: ObjectId
+        :param kind: The kind of membership, e.g. 'submitter'.
+        :type kind: str
+        :param userId: The ID of the user.
+        :type userId: ObjectId
+        :returns: Whether the user is no longer counted.
+        """
+        query = {'parentId': parentId, 'kind': kind, 'userId': userId, 'count': {'$gt': 0}}
+        doc = self.collection.find_one_and_update(
+            query, {'$inc': {'count': -1}}, return_document=ReturnDocument.AFTER)
+        if doc is None or doc['count'] > 0:
+            return False
+        self.collection.delete_one({'_id': doc['_id'], 'count': 0})
+        return True
+
+    def reset(self, parentId, kind, counts):
+        """
+        Replace the members of a kind.
+
+        :param parentId: The ID of the phase or challenge.
+        :type parentId: ObjectId
+        :param kind: The kind of membership, e.g. 'submitter'.
+        :type kind: str
+        :param counts: The number of times each user is counted, by user ID.
+        :type counts: dict
+        """
+        self.collection.delete_many({'parentId': parentId, 'kind': kind})
+        if counts:
+            self.collection.insert_many([{
+                'parentId': parentId, 'kind': kind, 'userId': userId, 'count': count
+            } for userId, count in counts.items()])
+
+    def removeParent(self, parentId):
+        """
+        Remove the members of a phase or challenge.
+
+        :param parentId: The ID of the phase or challenge.
+        :type parentId: ObjectId
+        """
+        self.collection.delete_many({'parentId': parentId})
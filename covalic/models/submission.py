@@ -18,10 +18,16 @@
 ###############################################################################
 
 import datetime
+import hashlib
+import json
+import threading
+import time
 
-from girder.constants import AccessType
+from girder import logger
+from girder.constants import AccessType, SortDir
 from girder.exceptions import GirderException
 from girder.models.folder import Folder
+from girder.models.item import Item
 from girder.models.model_base import Model, ValidationException
 from girder.models.setting import Setting
 from girder.models.token import Token
@@ -29,11 +35,16 @@ from girder.models.user import User
 from girder.utility.progress import noProgress
 from girder_jobs.models.job import Job
 from girder_worker.girder_plugin import utils
+from pymongo import UpdateMany, UpdateOne
 
-from covalic import scoring
-from covalic.constants import PluginSettings
+from covalic import ranking, scoring, stats
+from covalic.constants import DELETE_BATCH_SIZE, DELETE_FOLDER_WORKERS, PluginSettings
+from covalic.models.leaderboard import Leaderboard
 from covalic.models.phase import Phase
-from covalic.utility import validateDate
+from covalic.models.phase_lock import PhaseLock
+from covalic.models.score_cache import ScoreCache
+from covalic.scheduler import scoringScheduler
+from covalic.utility import folderContentHash, validateDate
 
 
 class Submission(Model):
@@ -48,12 +59,13 @@ class Submission(Model):
             ('phaseId', 1), ('overallScore', -1), ('approach', 1), ('latest', 1)
         ], {})
         userPhaseIdx = ([('creatorId', 1), ('phaseId', 1), ('approach', 1)], {})
-        self.ensureIndices((leaderboardIdx, userPhaseIdx, 'folderId',
+        fingerprintIdx = ([('scoringFingerprint', 1)], {'sparse': True})
+        self.ensureIndices((leaderboardIdx, userPhaseIdx, fingerprintIdx, 'folderId',
                             'overallScore', 'approach', 'created'))
         self.exposeFields(level=AccessType.READ, fields=(
             '_id', 'creatorId', 'creatorName', 'phaseId', 'folderId', 'created',
             'score', 'title', 'latest', 'overallScore', 'jobId', 'organization', 'organizationUrl',
-            'documentationUrl', 'approach', 'meta'
+            'documentationUrl', 'approach', 'meta', 'rank', 'approachRank'
         ))
 
     def load(self, *args, **kwargs):
@@ -67,9 +79,31 @@ class Submission(Model):
         return doc
 
     def save(self, document, *args, **kwargs):
-        document = super(Submission, self).save(document, *args, **kwargs)
-        document.setdefault('approach', 'default')
-        document.setdefault('meta', {})
+        # Ranks are maintained incrementally, which is only correct if
+        # concurrent changes to the ranking of a phase do not interleave
+        with PhaseLock().lock(document['phaseId']):
+            previous = None
+            if '_id' in document:
+                previous = self.collection.find_one({'_id': document['_id']}, projection=[
+                    'phaseId', 'creatorId', 'latest', 'overallScore', 'approach'])
+
+            document = super(Submission, self).save(document, *args, **kwargs)
+            self._updateRanks(previous, document)
+            wasLatest = bool(previous and previous.get('latest'))
+            if document.get('latest') and not wasLatest:
+                stats.latestSubmissionAdded(document)
+            elif wasLatest and not document.get('latest'):
+                stats.latestSubmissionRemoved(previous)
+            document.setdefault('approach', 'default')
+            document.setdefault('meta', {})
+
+            # Keep the materialized leaderboard in sync with the latest submissions
+            if document.get('latest') and document.get('overallScore') is not None:
+                Leaderboard().updateEntry(document)
+            elif document.get('latest') is False:
+                Leaderboard().removeEntry(document)
+
+        Phase().bumpVersion(document['phaseId'])
         return document
 
     def validate(self, doc):
@@ -86,6 +120,19 @@ class Submission(Model):
             doc['overallScore'] = scoring.computeOverallScore(doc, phase)
             doc['latest'] = True
 
+            supersededQuery = {
+                'phaseId': doc['phaseId'],
+                'creatorId': doc['creatorId'],
+                'approach': doc.get('approach'),
+                'latest': True
+            }
+            if '_id' in doc:
+                supersededQuery['_id'] = {'$ne': doc['_id']}
+            for superseded in self.collection.find(supersededQuery, projection=[
+                    'phaseId', 'creatorId', 'latest', 'overallScore', 'approach']):
+                self._updateRanks(superseded, dict(superseded, latest=False))
+                stats.latestSubmissionRemoved(superseded)
+
             Model.update(self, query={
                 'phaseId': doc['phaseId'],
                 'creatorId': doc['creatorId'],
@@ -97,6 +144,113 @@ class Submission(Model):
 
         return doc
 
+    @staticmethod
+    def _isRanked(doc):
+        return bool(doc and doc.get('latest') and doc.get('overallScore') is not None)
+
+    def _rankQueries(self, doc):
+        """
+        Build the queries selecting the other ranked submissions of a phase.
+
+        :returns: The query over the whole phase and the query restricted to
+            the approach of the submission.
+        """
+        others = {
+            'phaseId': doc['phaseId'],
+            'latest': True,
+            'overallScore': {'$ne': None},
+            '_id': {'$ne': doc['_id']}
+        }
+        approach = doc.get('approach')
+        if approach in {'default', ''}:
+            approach = None
+        return others, dict(others, approach=approach)
+
+    def _updateRanks(self, previous, document):
+        """
+        Maintain the dense ranks of the latest submissions after one submission changes.
+
+        :param previous: The stored state of the submission before the change,
+            or None if it is new.
+        :param document: The new state of the submission.
+        """
+        wasRanked = self._isRanked(previous)
+        isRanked = self._isRanked(document)
+        if not wasRanked and not isRanked:
+            if previous is not None and 'rank' in document:
+                self.collection.update_one({'_id': document['_id']}, {
+                    '$unset': {'rank': '', 'approachRank': ''}})
+                document.pop('rank', None)
+                document.pop('approachRank', None)
+            return
+
+        oldScore = previous['overallScore'] if wasRanked else None
+        newScore = document['overallScore'] if isRanked else None
+        others, approachOthers = self._rankQueries(document)
+
+        ranking.shiftDenseRanks(self.collection, others, 'rank', oldScore, newScore)
+        previousApproachOthers = self._rankQueries(previous)[1] if wasRanked else None
+        if wasRanked and previousApproachOthers != approachOthers:
+            # The submission moved to another approach
+            ranking.shiftDenseRanks(
+                self.collection, previousApproachOthers, 'approachRank', oldScore, None)
+            oldScore = None
+        ranking.shiftDenseRanks(
+            self.collection, approachOthers, 'approachRank', oldScore, newScore)
+
+        if isRanked:
+            ranks = {
+                'rank': ranking.denseRank(self.collection, others, newScore),
+                'approachRank': ranking.denseRank(self.collection, approachOthers, newScore)
+            }
+            self.collection.update_one({'_id': document['_id']}, {'$set': ranks})
+            document.update(ranks)
+        else:
+            self.collection.update_one({'_id': document['_id']}, {
+                '$unset': {'rank': '', 'approachRank': ''}})
+            document.pop('rank', None)
+            document.pop('approachRank', None)
+
+    def rebuildRanks(self, phase):
+        """
+        Recompute the dense ranks of the latest submissions of a phase.
+
+        The materialized leaderboard of the phase is rebuilt afterwards.
+
+        :param phase: The phase.
+        """
+        with PhaseLock().lock(phase['_id']):
+            query = {
+                'phaseId': phase['_id'],
+                'latest': True,
+                'overallScore': {'$ne': None}
+            }
+            docs = list(self.collection.find(
+                query, projection=['overallScore', 'approach'],
+                sort=[('overallScore', SortDir.DESCENDING)]))
+
+            byApproach = {}
+            for doc in docs:
+                byApproach.setdefault(doc.get('approach'), []).append(doc)
+
+            ranks = {}
+            for doc, rank in zip(docs, ranking.denseRanks([d['overallScore'] for d in docs])):
+                ranks[doc['_id']] = {'rank': rank}
+            for group in byApproach.values():
+                approachRanks = ranking.denseRanks([d['overallScore'] for d in group])
+                for doc, rank in zip(group, approachRanks):
+                    ranks[doc['_id']]['approachRank'] = rank
+
+            requests = [UpdateOne({'_id': _id}, {'$set': fields}) for _id, fields in ranks.items()]
+            requests.append(UpdateMany(
+                {'phaseId': phase['_id'], '$or': [
+                    {'latest': {'$ne': True}}, {'overallScore': None}
+                ], 'rank': {'$exists': True}},
+                {'$unset': {'rank': '', 'approachRank': ''}}))
+            self.collection.bulk_write(requests, ordered=False)
+
+            Leaderboard().rebuild(phase)
+
     def getAllSubmissions(self, phase, filter=None):
         """
         Return a cursor of all submissions to a given phase.
@@ -111,30 +265,209 @@ class Submission(Model):
 
         return self.find(filter, limit=0)
 
-    def recomputeOverallScores(self, phase):
+    def countSubmissions(self, phaseIds):
+        """
+        Count the submissions to a set of phases with a single aggregation.
+
+        :param phaseIds: The IDs of the phases.
+        :type phaseIds: list of ObjectId
+        :returns: The number of submissions.
+        """
+        result = list(self.collection.aggregate([
+            {'$match': {'phaseId': {'$in': list(phaseIds)}}},
+            {'$group': {'_id': None, 'count': {'$sum': 1}}}
+        ]))
+        return result[0]['count'] if result else 0
+
+    def _scoredSubmissionsQuery(self, phase, startId=None):
+        query = {
+            'phaseId': phase['_id'],
+            'score.0': {'$exists': True}
+        }
+        if startId is not None:
+            query['_id'] = {'$gt': startId}
+        return query
+
+    def countScoredSubmissions(self, phase, startId=None):
+        """
+        Count the scored submissions of a given phase.
+
+        :param phase: The phase.
+        :param startId: If set, only count submissions with a greater ID.
+        :type startId: ObjectId or None
+        """
+        return self.collection.count_documents(
+            self._scoredSubmissionsQuery(phase, startId))
+
+    def recomputeOverallScores(self, phase, batchSize=1000, startId=None,
+                               progress=noProgress, checkpoint=None):
         """
         Recompute all of the overall score values for the submissions of a given phase.
 
         This might be fairly expensive, so it should only be done
-        if the metric identifiers or weighting values actually change.
+        if the metric identifiers or weighting values actually change. Only
+        the averages row of each score is read, and the new overall scores are
+        written back with unordered bulk updates of at most ``batchSize``
+        documents each. Submissions are processed in ``_id`` order so that an
+        interrupted recomputation can be resumed.
 
         :param phase: The phase to recompute all submissions on.
+        :param batchSize: The number of updates to send per bulk write.
+        :type batchSize: int
+        :param startId: If set, only recompute submissions with a greater ID.
+        :type startId: ObjectId or None
+        :param progress: A progress context to update after each batch.
+        :param checkpoint: If set, called with the ID of the last processed
+            submission and the running count after each batch.
+        :type checkpoint: callable or None
+        :returns: The number of submissions that were updated.
         """
-        for submission in self.getAllSubmissions(phase):
-            if submission.get('score'):
-                submission['overallScore'] = scoring.computeOverallScore(
-                    submission, phase)
-                self.save(submission, validate=False)
+        startTime = time.time()
+        count = 0
+        lastId = None
+        requests = []
+
+        def flush():
+            result = self.collection.bulk_write(requests, ordered=False)
+            progress.update(increment=len(requests),
+                            message='Recomputed %d overall scores' % (count + len(requests)))
+            if checkpoint is not None:
+                checkpoint(lastId, count + result.matched_count)
+            return result.matched_count
+
+        cursor = self.collection.aggregate([{
+            '$match': self._scoredSubmissionsQuery(phase, startId)
+        }, {
+            '$sort': {'_id': 1}
+        }, {
+            '$project': {
+                'averages': {'$arrayElemAt': ['$score.metrics', 0]}
+            }
+        }])
+        for doc in cursor:
+            overallScore = scoring.computeOverallScore(
+                {'score': [{'metrics': doc['averages']}]}, phase)
+            requests.append(UpdateOne(
+                {'_id': doc['_id']}, {'$set': {'overallScore': overallScore}}))
+            lastId = doc['_id']
+            if len(requests) >= batchSize:
+                count += flush()
+                requests = []
+
+        if requests:
+            count += flush()
+
+        self.rebuildRanks(phase)
+        Phase().bumpVersion(phase['_id'])
+
+        logger.info('Recomputed %d overall scores for phase %s in %.2f seconds.' % (
+            count, phase['_id'], time.time() - startTime))
+        return count
 
     def remove(self, doc, progress=noProgress):
         folder = Folder().load(doc['folderId'], force=True)
         if folder:
             Folder().remove(folder)
 
-        Model.remove(self, doc, progress=progress)
+        with PhaseLock().lock(doc['phaseId']):
+            # The passed document may predate its submission being superseded
+            stored = self.collection.find_one({'_id': doc['_id']}, projection=[
+                'phaseId', 'creatorId', 'latest', 'overallScore', 'approach'])
+            Model.remove(self, doc, progress=progress)
+            if stored and stored.get('latest'):
+                stats.latestSubmissionRemoved(stored)
+            if self._isRanked(stored):
+                self._updateRanks(stored, dict(stored, latest=False))
+            Leaderboard().removeEntry(doc)
+        Phase().bumpVersion(doc['phaseId'])
+
+    @staticmethod
+    def _removeFolders(folderIds, workers):
+        """Remove folder trees, spread over a number of threads."""
+        folders = list(Folder().find({'_id': {'$in': folderIds}}))
+        errors = []
+
+        def removeAll(folders):
+            try:
+                for folder in folders:
+                    Folder().remove(folder)
+            except Exception as e:  # noqa: B902
+                errors.append(e)
+
+        threads = [threading.Thread(target=removeAll, args=(folders[i::workers],))
+                   for i in range(min(workers, len(folders)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def removeSubmissions(self, phaseIds, progress=noProgress, batchSize=DELETE_BATCH_SIZE,
+                          workers=DELETE_FOLDER_WORKERS):
+        """
+        Remove all submissions to a set of phases, along with their folders.
+
+        Submissions are removed in batches, first their folders and then the
+        documents, so an interrupted removal can be resumed by calling this
+        again. Ranks, leaderboards and statistics are not maintained, so this
+        is meant for phases that are being removed. Cached scores that no
+        remaining submission was scored with are removed.
+
+        :param phaseIds: The IDs of the phases.
+        :type phaseIds: list of ObjectId
+        :param progress: A progress context to report each batch to.
+        :param batchSize: The number of submissions removed per batch.
+        :type batchSize: int
+        :param workers: The number of threads removing folders.
+        :type workers: int
+        """
+        query = {'phaseId': {'$in': list(phaseIds)}}
+        while True:
+            batch = list(self.collection.find(
+                query, projection=['folderId', 'scoringFingerprint'], limit=batchSize))
+            if not batch:
+                break
+            self._removeFolders([doc['folderId'] for doc in batch], workers)
+            self.collection.delete_many({'_id': {'$in': [doc['_id'] for doc in batch]}})
+            ScoreCache().removeUnreferenced(doc.get('scoringFingerprint') for doc in batch)
+            progress.update(increment=len(batch), message='Deleted %d submissions' % len(batch))
+
+    @staticmethod
+    def _keysetQuery(field, direction, value, lastId):
+        """
+        Build a query matching the documents that sort after the given (value, _id) pair.
+
+        Null values sort before all numbers and dates, which range operators
+        do not match, so they are handled explicitly.
+        """
+        if direction == SortDir.DESCENDING:
+            op = '$lt'
+            if value is None:
+                return {field: None, '_id': {op: lastId}}
+            after = {'$or': [{field: {op: value}}, {field: None}]}
+        else:
+            op = '$gt'
+            if value is None:
+                after = {field: {'$ne': None}}
+            else:
+                after = {field: {op: value}}
+
+        return {'$or': [after, {field: value, '_id': {op: lastId}}]}
 
     def list(self, phase, limit=50, offset=0, sort=None, userFilter=None,
-             fields=None, latest=True, approach=None):
+             fields=None, latest=True, approach=None, after=None, batchSize=0):
+        """
+        List submissions to a phase.
+
+        :param after: For keyset pagination, the (value, _id) pair of the last
+            document of the previous page. Requires ``sort`` to be a single
+            field, and ignores ``offset``.
+        :type after: tuple or None
+        :param batchSize: The number of documents to fetch from the database
+            per round trip, or 0 for the server default.
+        :type batchSize: int
+        """
         q = {'phaseId': phase['_id']}
 
         if userFilter is not None:
@@ -147,8 +480,16 @@ class Submission(Model):
             if approach in {'default', ''}:
                 q['approach'] = None
 
-        cursor = self.find(q, limit=limit, offset=offset, sort=sort,
-                           fields=fields)
+        if after is not None:
+            field, direction = sort[0]
+            q.update(self._keysetQuery(field, direction, *after))
+            sort = [(field, direction), ('_id', direction)]
+            offset = 0
+
+        # Model.find does not pass the batch size on to the cursor
+        cursor = self.find(q, limit=limit, offset=offset, sort=sort, fields=fields)
+        if batchSize:
+            cursor = cursor.batch_size(batchSize)
         for result in cursor:
             result.setdefault('approach', 'default')
             yield result
@@ -198,66 +539,104 @@ class Submission(Model):
         self.updateFolderAccess(phase, (submission,))
         return submission
 
+    @staticmethod
+    def _phaseAdminIds(phase):
+        """Get the IDs of the users with WRITE access or above on a phase."""
+        return sorted({
+            entry['id'] for entry in phase.get('access', {}).get('users', ())
+            if entry['level'] >= AccessType.WRITE
+        })
+
+    def _grantFolderAccess(self, folderIds, userIds):
+        """Give users read access on the folders they do not own, in bulk."""
+        for userId in userIds:
+            query = {'_id': {'$in': folderIds}, 'creatorId': {'$ne': userId}}
+            Folder().update(dict(query, **{
+                'access.users': {'$elemMatch': {'id': userId, 'level': {'$ne': AccessType.READ}}}
+            }), {'$set': {'access.users.$.level': AccessType.READ}})
+            Folder().update(dict(query, **{'access.users.id': {'$ne': userId}}), {
+                '$push': {'access.users': {'id': userId, 'level': AccessType.READ, 'flags': []}}
+            })
+
+    def _revokeFolderAccess(self, folderIds, userIds):
+        """Remove users from the ACLs of the folders they do not own, in bulk."""
+        for userId in userIds:
+            Folder().update({'_id': {'$in': folderIds}, 'creatorId': {'$ne': userId}}, {
+                '$pull': {'access.users': {'id': userId}}
+            })
+
+    def _setFolderAdmins(self, folderIds, adminIds):
+        """Make the user ACLs of folders exactly their owner plus the given users."""
+        creatorIds = Folder().collection.distinct('creatorId', {'_id': {'$in': folderIds}})
+        for creatorId in creatorIds:
+            Folder().update({'_id': {'$in': folderIds}, 'creatorId': creatorId}, {
+                '$pull': {'access.users': {'id': {'$nin': list(adminIds) + [creatorId]}}}
+            })
+        self._grantFolderAccess(folderIds, adminIds)
+
     def updateFolderAccess(self, phase, submissions):
         """
         Synchronize access control between the phase and submission folders for the phase.
 
         Phase admins should have read access on the submission
-        folders.
+        folders. The folder ACLs are rewritten in bulk, with a few
+        operations per phase admin and per folder owner.
         """
-        # Get phase admin users
-        phaseAcl = Phase().getFullAccessList(phase)
-        phaseAdminUserIds = set([user['id']
-                                 for user in phaseAcl.get('users')
-                                 if user['level'] >= AccessType.WRITE])
-        phaseAdminUsers = [User().load(userId, force=True, exc=True)
-                           for userId in phaseAdminUserIds]
-
-        # Update submission folder ACL for current phase admins
         try:
-            for sub in submissions:
-                folder = Folder().load(sub['folderId'], force=True)
-                if not folder:
-                    continue
-                folderAcl = Folder().getFullAccessList(folder)
-
-                # Revoke access to users who are not phase admins; ignore folder
-                # owner
-                usersToRemove = [User().load(user['id'], force=True,
-                                             exc=True)
-                                 for user in folderAcl.get('users')
-                                 if (user['id'] not in phaseAdminUserIds
-                                     and user['id'] != folder['creatorId'])]
-                for user in usersToRemove:
-                    Folder().setUserAccess(folder, user, None)
-
-                # Add access to phase admins; ignore folder owner
-                usersToAdd = [user for user in phaseAdminUsers
-                              if user['_id'] != folder['creatorId']]
-                for user in usersToAdd:
-                    Folder().setUserAccess(folder, user, AccessType.READ)
-
-                # Save folder if access changed
-                if usersToRemove or usersToAdd:
-                    Folder().save(folder, validate=False)
+            folderIds = [sub['folderId'] for sub in submissions]
         except TypeError:
             raise ValidationException('A list of submissions is required.')
+        if folderIds:
+            self._setFolderAdmins(folderIds, self._phaseAdminIds(phase))
 
-    def scoreSubmission(self, submission, apiUrl):
-        """Run a Girder Worker job to score a submission."""
-        phase = Phase().load(submission['phaseId'], force=True)
-        folder = Folder().load(submission['folderId'], force=True)
-        user = User().load(submission['creatorId'], force=True)
+    def folderAccessChanged(self, phase):
+        """
+        Check whether the phase admins changed since the submission folders were last synchronized.
 
-        otherFields = {}
-        if 'overallScore' in submission:
-            otherFields['rescoring'] = True
+        :param phase: The phase.
+        :returns: Whether :py:meth:`syncFolderAccess` has any work to do.
+        """
+        previous = phase.get('submissionFolderAdminIds')
+        return previous is None or sorted(previous) != self._phaseAdminIds(phase)
 
-        jobTitle = '%s submission: %s' % (phase['name'], folder['name'])
-        job = Job().createJob(
-            title=jobTitle, type='covalic_score', handler='worker_handler', user=user,
-            otherFields=otherFields)
+    def syncFolderAccess(self, phase):
+        """
+        Propagate changes of the phase admins to all submission folders of the phase.
+
+        The phase admins are diffed against the ones recorded at the last
+        synchronization, so only users who gained or lost admin access are
+        granted or revoked, and nothing is done if the admins did not change.
+        When no previous state is recorded, every folder ACL is rewritten.
 
+        :param phase: The phase.
+        """
+        if not self.folderAccessChanged(phase):
+            return
+
+        adminIds = self._phaseAdminIds(phase)
+        previous = phase.get('submissionFolderAdminIds')
+        folderIds = self.collection.distinct('folderId', {'phaseId': phase['_id']})
+        if folderIds:
+            if previous is None:
+                self._setFolderAdmins(folderIds, adminIds)
+            else:
+                self._revokeFolderAccess(folderIds, set(previous) - set(adminIds))
+                self._grantFolderAccess(folderIds, set(adminIds) - set(previous))
+
+        Phase().update({'_id': phase['_id']}, {'$set': {'submissionFolderAdminIds': adminIds}})
+        phase['submissionFolderAdminIds'] = adminIds
+
+    def getScoringContext(self, phase):
+        """
+        Look up the state shared by all scoring jobs of a phase.
+
+        This also grants the scoring user the access it needs on the phase and
+        its ground truth.
+
+        :param phase: The phase.
+        :returns: A dict with the phase, the scoring user, the ground truth
+            folder and its archive.
+        """
         scoreUserId = Setting().get(PluginSettings.SCORING_USER_ID)
         if not scoreUserId:
             raise GirderException(
@@ -267,10 +646,6 @@ class Submission(Model):
         if not scoreUser:
             raise GirderException('Invalid scoring user setting (%s).' % scoreUserId)
 
-        scoreToken = Token().createToken(user=scoreUser, days=7)
-        Folder().setUserAccess(
-            folder, user=scoreUser, level=AccessType.READ, save=True)
-
         groundTruth = Folder().load(phase['groundTruthFolderId'], force=True)
 
         if not Phase().hasAccess(phase, user=scoreUser, level=AccessType.ADMIN):
@@ -281,12 +656,115 @@ class Submission(Model):
             Folder().setUserAccess(
                 groundTruth, user=scoreUser, level=AccessType.READ, save=True)
 
+        groundTruthHash = folderContentHash(groundTruth)
+        groundTruthArchive = Phase().getGroundTruthArchive(
+            phase, groundTruth, scoreUser, contentHash=groundTruthHash)
+        archiveFolder = Folder().load(
+            Item().load(groundTruthArchive['itemId'], force=True)['folderId'], force=True)
+        if not Folder().hasAccess(archiveFolder, user=scoreUser, level=AccessType.READ):
+            Folder().setUserAccess(
+                archiveFolder, user=scoreUser, level=AccessType.READ, save=True)
+
         task = phase.get('scoreTask', {})
-        image = task.get('dockerImage') or 'girder/covalic-metrics:latest'
-        containerArgs = task.get('dockerArgs') or [
-            '--groundtruth=$input{groundtruth}',
-            '--submission=$input{submission}'
-        ]
+        return {
+            'phase': phase,
+            'scoreUser': scoreUser,
+            'groundTruth': groundTruth,
+            'groundTruthArchive': groundTruthArchive,
+            'groundTruthHash': groundTruthHash,
+            'image': task.get('dockerImage') or 'girder/covalic-metrics:latest',
+            'containerArgs': task.get('dockerArgs') or [
+                '--groundtruth=$input{groundtruth}',
+                '--submission=$input{submission}'
+            ]
+        }
+
+    def getScoringFingerprint(self, folder, context):
+        """
+        Compute the fingerprint of the inputs of a scoring run.
+
+        :param folder: The submission folder.
+        :param context: The scoring context of the phase, from
+            :py:meth:`getScoringContext`.
+        :returns: The hexadecimal SHA-256 digest of the submission and ground
+            truth contents and the scoring image and arguments.
+        """
+        return hashlib.sha256(json.dumps([
+            folderContentHash(folder), context['groundTruthHash'], context['image'],
+            context['containerArgs']
+        ]).encode('utf8')).hexdigest()
+
+    def applyCachedScore(self, submission, fingerprint):
+        """
+        Score a submission with the stored score of a previous run with the same inputs.
+
+        :param submission: The submission.
+        :param fingerprint: The fingerprint of the scoring inputs.
+        :type fingerprint: str
+        :returns: The scored submission, or None if no score is stored.
+        """
+        from covalic.notifications import notifySubmissionScored  # prevent circular import
+
+        score = ScoreCache().getScore(fingerprint)
+        if score is None:
+            return None
+
+        submission = self.load(submission['_id'], force=True)
+        rescoring = 'overallScore' in submission
+        submission.pop('overallScore', None)
+        submission['score'] = score
+        submission['scoringFingerprint'] = fingerprint
+        submission = self.save(submission)
+
+        phase = Phase().load(submission['phaseId'], force=True)
+        notifySubmissionScored(submission, phase, rescoring)
+        return submission
+
+    def createScoreJob(self, submission, folder, user, context, apiUrl, otherFields=None,
+                       dispatch=True, fingerprint=None):
+        """
+        Create the Girder Worker job that scores a submission, and queue it for scheduling.
+
+        :param submission: The submission.
+        :param folder: The submission folder.
+        :param user: The user who made the submission, who owns the job.
+        :param context: The scoring context of the phase, from
+            :py:meth:`getScoringContext`.
+        :param apiUrl: The API URL the job posts the score to.
+        :param otherFields: Additional fields to set on the job.
+        :type otherFields: dict or None
+        :param dispatch: Whether to dispatch queued scoring jobs right away.
+        :type dispatch: bool
+        :param fingerprint: The fingerprint of the scoring inputs.
+        :type fingerprint: str or None
+        :returns: The job document.
+        """
+        phase = context['phase']
+        scoreUser = context['scoreUser']
+        groundTruthArchive = context['groundTruthArchive']
+
+        otherFields = dict(otherFields or {})
+        if 'overallScore' in submission:
+            otherFields['rescoring'] = True
+
+        jobTitle = '%s submission: %s' % (phase['name'], folder['name'])
+        job = Job().createJob(
+            title=jobTitle, type='covalic_score', handler='worker_handler', user=user,
+            otherFields=otherFields)
+
+        if not Folder().hasAccess(folder, user=scoreUser, level=AccessType.READ):
+            Folder().setUserAccess(
+                folder, user=scoreUser, level=AccessType.READ, save=True)
+
+        # Each job gets its own token, since posting the score revokes it. The
+        # token carries the fingerprint, so the score is cached under the
+        # inputs of the job that produced it.
+        scoreToken = Token().createToken(user=scoreUser, days=7)
+        if fingerprint is not None:
+            Token().update({'_id': scoreToken['_id']}, {
+                '$set': {'covalicFingerprint': fingerprint}})
+        image = context['image']
+        containerArgs = context['containerArgs']
 
         kwargs = {
             'task': {
@@ -317,7 +795,7 @@ class Submission(Model):
                 'submission': utils.girderInputSpec(
                     folder, 'folder', token=scoreToken),
                 'groundtruth': utils.girderInputSpec(
-                    groundTruth, 'folder', token=scoreToken)
+                    groundTruthArchive, 'file', token=scoreToken)
             },
             'outputs': {
                 '_stdout': {
@@ -336,8 +814,80 @@ class Submission(Model):
         }
         job['kwargs'] = kwargs
         job['covalicSubmissionId'] = submission['_id']
+        job['covalicFingerprint'] = fingerprint
         job = Job().save(job)
-        Job().scheduleJob(job)
+        return scoringScheduler.enqueue(job, phase, dispatch=dispatch)
+
+    def scoreSubmission(self, submission, apiUrl, force=False):
+        """
+        Run a Girder Worker job to score a submission.
+
+        If a previous scoring run had the same inputs, its score is reused
+        instead, unless ``force`` is set.
+        """
+        phase = Phase().load(submission['phaseId'], force=True)
+        folder = Folder().load(submission['folderId'], force=True)
+        user = User().load(submission['creatorId'], force=True)
+
+        context = self.getScoringContext(phase)
+        fingerprint = self.getScoringFingerprint(folder, context)
+        if not force:
+            scored = self.applyCachedScore(submission, fingerprint)
+            if scored is not None:
+                return scored
+
+        job = self.createScoreJob(
+            submission, folder, user, context, apiUrl, fingerprint=fingerprint)
 
         submission['jobId'] = job['_id']
+        submission['scoringFingerprint'] = fingerprint
         return self.save(submission, validate=False)
+
+    def scoreSubmissions(self, submissions, context, apiUrl, otherFields=None, force=False):
+        """
+        Run Girder Worker jobs to score a batch of submissions of the same phase.
+
+        The submission folders and users are loaded with one query each, and
+        the job IDs are recorded with a single bulk write. Submissions whose
+        scoring inputs match a previous run reuse its score instead, unless
+        ``force`` is set.
+
+        :param submissions: The submissions. They need at least the
+            ``folderId`` and ``creatorId`` fields, and ``overallScore`` if set.
+        :type submissions: list of dict
+        :param context: The scoring context of the phase, from
+            :py:meth:`getScoringContext`.
+        :param apiUrl: The API URL the jobs post the scores to.
+        :param otherFields: Additional fields to set on the jobs.
+        :type otherFields: dict or None
+        :param force: Whether to run the scoring jobs even if scores are cached.
+        :type force: bool
+        :returns: The IDs of the created jobs.
+        """
+        folders = {folder['_id']: folder for folder in Folder().find(
+            {'_id': {'$in': [sub['folderId'] for sub in submissions]}})}
+        users = {user['_id']: user for user in User().find(
+            {'_id': {'$in': [sub['creatorId'] for sub in submissions]}})}
+
+        jobIds = []
+        requests = []
+        for submission in submissions:
+            folder = folders.get(submission['folderId'])
+            if folder is None:
+                continue
+            fingerprint = self.getScoringFingerprint(folder, context)
+            if not force and self.applyCachedScore(submission, fingerprint) is not None:
+                continue
+            job = self.createScoreJob(
+                submission, folder, users.get(submission['creatorId']), context, apiUrl,
+                otherFields, dispatch=False, fingerprint=fingerprint)
+            jobIds.append(job['_id'])
+            requests.append(UpdateOne({'_id': submission['_id']}, {'$set': {
+                'jobId': job['_id'],
+                'scoringFingerprint': fingerprint
+            }}))
+
+        if requests:
+            self.collection.bulk_write(requests, ordered=False)
+        scoringScheduler.dispatch()
+        return jobIds
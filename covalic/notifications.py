@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import posixpath
+import threading
+
+from girder import logger
+from girder.constants import AccessType
+from girder.models.user import User
+from girder.utility import mail_utils
+
+from covalic.constants import NOTIFICATION_DIGEST_INTERVAL, NOTIFICATION_DIGEST_MAX_LISTED, \
+    NOTIFICATION_POLL_INTERVAL, NOTIFICATION_WORKERS
+from covalic.models.challenge import Challenge
+from covalic.models.notification import Notification
+from covalic.models.phase import Phase
+from covalic.models.submission import Submission
+from covalic.utility.user_emails import getPhaseUserEmails
+
+
+def notifySubmissionScored(submission, phase, rescoring=False):
+    """
+    Queue the notifications for a submission that has been scored.
+
+    The user is mailed unless the submission was re-scored. Phase admins are
+    sent a periodic digest of the submissions scored in the phase.
+
+    :param submission: The submission.
+    :param phase: The phase.
+    :param rescoring: Whether the submission was re-scored.
+    :type rescoring: bool
+    """
+    if not rescoring:
+        Notification().createNotification(
+            'covalic.submissionCompleteUser.mako', 'Your submission has been scored',
+            'user', phase['_id'], submission['_id'], userId=submission['creatorId'])
+
+    Notification().addToDigest(
+        'covalic.submissionCompleteAdmin.mako', 'A submission has been scored',
+        'scored:%s' % phase['_id'], phase['_id'], submission['_id'],
+        NOTIFICATION_DIGEST_INTERVAL)
+
+
+def notifySubmissionError(submission, phase, user, log, minimalLog, rescoring=False):
+    """
+    Queue the notifications for a submission that failed to be scored.
+
+    :param submission: The submission.
+    :param phase: The phase.
+    :param user: The user who made the submission.
+    :param log: The full job log, which is sent to the phase admins.
+    :type log: str or None
+    :param minimalLog: The log sent to the user.
+    :type minimalLog: str or None
+    :param rescoring: Whether the submission was being re-scored.
+    :type rescoring: bool
+    """
+    Notification().createNotification(
+        'covalic.submissionErrorAdmin.mako', 'Submission processing error',
+        'phaseAdmins', phase['_id'], submission['_id'], userId=user['_id'], log=log)
+
+    if not rescoring:
+        Notification().createNotification(
+            'covalic.submissionErrorUser.mako', 'Submission processing error',
+            'user', phase['_id'], submission['_id'], userId=user['_id'], log=minimalLog)
+
+
+def sendNotification(notification):
+    """
+    Render and send a queued notification.
+
+    Notifications about phases, submissions or users that no longer exist
+    are dropped.
+
+    :param notification: The notification document.
+    :returns: Whether an email was sent.
+    """
+    submissionIds = notification['submissionIds']
+    phase = Phase().load(notification['phaseId'], force=True)
+    submissions = list(Submission().find(
+        {'_id': {'$in': submissionIds}}, sort=[('created', 1)],
+        limit=NOTIFICATION_DIGEST_MAX_LISTED, fields={'score': False}))
+    if phase is None or not submissions:
+        return False
+
+    challenge = Challenge().load(phase['challengeId'], force=True)
+    template = notification['template']
+    subject = notification['subject']
+    if len(submissionIds) > 1:
+        template = 'covalic.submissionDigestAdmin.mako'
+        subject = '%d submissions have been scored' % len(submissionIds)
+        user = None
+    else:
+        user = User().load(notification.get('userId') or submissions[0]['creatorId'], force=True)
+        if user is None:
+            return False
+
+    if notification['recipients'] == 'user':
+        emails = [user['email']]
+    else:
+        emails = sorted(getPhaseUserEmails(
+            phase, AccessType.WRITE, includeChallengeUsers=True))
+
+    html = mail_utils.renderTemplate(template, {
+        'phase': phase,
+        'challenge': challenge,
+        'submission': submissions[0],
+        'submissions': submissions,
+        'count': len(submissionIds),
+        'user': user,
+        'log': notification.get('log'),
+        'host': posixpath.dirname(mail_utils.getEmailUrlPrefix())
+    })
+    mail_utils.sendMail(subject, html, emails)
+    return True
+
+
+def dispatchPending(stop=None):
+    """
+    Send notifications until none is due.
+
+    :param stop: If set, stop early once this event is set.
+    :type stop: threading.Event or None
+    :returns: The number of notifications that were processed.
+    """
+    count = 0
+    while stop is None or not stop.is_set():
+        notification = Notification().claim()
+        if notification is None:
+            break
+        count += 1
+        try:
+            sendNotification(notification)
+        except Exception:  # noqa: B902
+            logger.exception('Failed to send notification %s.' % notification['_id'])
+            Notification().retryLater(notification)
+        else:
+            Notification().remove(notification)
+    return count
+
+
+class NotificationDispatcher(object):
+    """
+    A pool of daemon threads that drain the notification queue.
+
+    :param workers: The number of threads.
+    :type workers: int
+    :param pollInterval: The number of seconds to wait when no notification is due.
+    :type pollInterval: float
+    """
+
+    def __init__(self, workers, pollInterval):
+        self.workers = workers
+        self.pollInterval = pollInterval
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        if self._threads:
+            return
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._run, name='covalic-notifications-%d' % i)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                processed = dispatchPending(self._stop)
+            except Exception:  # noqa: B902
+                logger.exception('Failed to dispatch notifications.')
+                processed = 0
+            if not processed:
+                self._stop.wait(self.pollInterval)
+
+
+notificationDispatcher = NotificationDispatcher(NOTIFICATION_WORKERS, NOTIFICATION_POLL_INTERVAL)
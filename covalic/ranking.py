@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+
+def denseRank(collection, query, score):
+    """
+    Compute the dense rank of an overall score among the documents matching a query.
+
+    The dense rank is one plus the number of distinct overall scores that are
+    strictly greater, so tied documents share a rank and no ranks are skipped.
+
+    :param collection: The pymongo collection.
+    :param query: The query selecting the other ranked documents.
+    :type query: dict
+    :param score: The overall score.
+    :type score: float
+    """
+    greater = dict(query, overallScore={'$gt': score})
+    return 1 + len(collection.distinct('overallScore', greater))
+
+
+def shiftDenseRanks(collection, query, field, oldScore=None, newScore=None):
+    """
+    Adjust stored dense ranks after the overall score of one document changes.
+
+    Ranks only change when a distinct score value disappears or appears, so
+    this costs at most two existence checks and two ``update_many`` calls.
+
+    :param collection: The pymongo collection.
+    :param query: The query selecting the other ranked documents. It must
+        exclude the document whose score changed.
+    :type query: dict
+    :param field: The name of the rank field to adjust.
+    :type field: str
+    :param oldScore: The previous score, or None if the document is being
+        added to the ranking.
+    :param newScore: The new score, or None if the document is being removed
+        from the ranking.
+    """
+    if oldScore == newScore:
+        return
+
+    if oldScore is not None and not collection.count_documents(
+            dict(query, overallScore=oldScore), limit=1):
+        collection.update_many(
+            dict(query, overallScore={'$lt': oldScore}), {'$inc': {field: -1}})
+
+    if newScore is not None and not collection.count_documents(
+            dict(query, overallScore=newScore), limit=1):
+        collection.update_many(
+            dict(query, overallScore={'$lt': newScore}), {'$inc': {field: 1}})
+
+
+def denseRanks(scores):
+    """
+    Compute the dense ranks of a list of overall scores sorted in descending order.
+
+    :param scores: The overall scores, sorted in descending order.
+    :type scores: list
+    :returns: The list of ranks, in the same order.
+    """
+    ranks = []
+    rank = 0
+    previous = None
+    for i, score in enumerate(scores):
+        if i == 0 or score != previous:
+            rank += 1
+            previous = score
+        ranks.append(rank)
+    return ranks
@@ -18,7 +18,6 @@
 ###############################################################################
 
 import cherrypy
-import datetime
 import json
 
 from girder import logger
@@ -27,13 +26,13 @@ from girder.api.describe import Description, describeRoute
 from girder.api.rest import filtermodel, loadmodel, Resource, RestException
 from girder.constants import AccessType
 from girder.models.file import File
-from girder.models.user import User
-from girder.utility.progress import ProgressContext
+from girder_jobs.models.job import Job
 from girder_thumbnails.worker import createThumbnail
 
+from covalic.constants import TimeframeStatus
+from covalic.jobs import scheduleCascadeDelete
 from covalic.models.challenge import Challenge
-from covalic.models.phase import Phase
-from covalic.models.submission import Submission
+from covalic.stats import getChallengeStats
 from covalic.utility import getAssetsFolder
 
 
@@ -73,34 +72,14 @@ class ChallengeResource(Resource):
             filters['name'] = params['name']
         if 'timeframe' in params:
             timeframe = params.get('timeframe')
-            now = datetime.datetime.utcnow()
             if timeframe == 'all':
                 # Allow all challenges
                 pass
-            elif timeframe == 'active':
-                # Limit to active challenges. 'Active' is defined liberally in
-                # that this passes open-ended challenges.
-                filters['$or'] = [
-                    {
-                        'startDate': {'$lte': now},
-                        'endDate': {'$gt': now},
-                    },
-                    {
-                        'startDate': {'$lte': now},
-                        'endDate': {'$in': [None, '']},
-                    },
-                    {
-                        'startDate': {'$in': [None, '']},
-                        'endDate': {'$gt': now},
-                    },
-                    {
-                        'startDate': {'$in': [None, '']},
-                        'endDate': {'$in': [None, '']},
-                    }]
-            elif timeframe == 'upcoming':
-                # Limit to challenges that start in the future. Doesn't include
-                # 'active' challenges.
-                filters['startDate'] = {'$gt': now}
+            elif timeframe in {TimeframeStatus.ACTIVE, TimeframeStatus.UPCOMING}:
+                # 'Active' is defined liberally in that this passes open-ended
+                # challenges. 'Upcoming' doesn't include active challenges.
+                # The stored status is kept up to date by a periodic sweep.
+                filters['status'] = timeframe
             else:
                 raise RestException('Invalid timeframe parameter.')
 
@@ -225,55 +204,27 @@ class ChallengeResource(Resource):
     @loadmodel(model='challenge', plugin='covalic', level=AccessType.READ)
     @describeRoute(
         Description('Get statistics for a challenge.')
+        .notes('Submissions are counted if they are the latest scored submission of '
+               'their participant and approach.')
         .param('id', 'The ID of the challenge.', paramType='path')
         .errorResponse('ID was invalid.')
         .errorResponse('Read permission denied on the challenge.', 403)
     )
     def getStats(self, challenge, params):
-        participantCount = User().find({
-            'groups': {'$in': Phase().collection.distinct(
-                'participantGroupId',
-                {'challengeId': challenge['_id']}
-            )}
-        }).count()
-        submissionStats = next(Submission().collection.aggregrate([
-            {
-                '$match': {
-                    'challengeId': challenge['_id'],
-                    'latest': True
-                }
-            }, {
-                '$facet': {
-                    'submissionCount': [
-                        {
-                            '$count': 'count'
-                        }
-                    ],
-                    'submittingParticipantCount': [
-                        {
-                            '$group': {
-                                '_id': '$creatorId'
-                            }
-                        }, {
-                            '$count': 'count'
-                        }
-                    ]
-                }
-            }
-        ]))
-        submissionCount = submissionStats['submissionCount'][0]['count']
-        submittingParticipantCount = submissionStats['submittingParticipantCount'][0]['count']
-
+        stats = getChallengeStats(challenge)
         return {
-            'submissionCount': submissionCount,
-            'participantCount': participantCount,
-            'submittingParticipantCount': submittingParticipantCount,
+            'submissionCount': stats['submissionCount'],
+            'participantCount': stats['participantCount'],
+            'submittingParticipantCount': stats['submitterCount'],
+            'lastSubmission': stats['lastSubmission']
         }
 
     @access.user
     @loadmodel(model='challenge', plugin='covalic', level=AccessType.ADMIN)
     @describeRoute(
         Description('Delete a challenge.')
+        .notes('The challenge, its phases and their submissions are deleted by '
+               'a background job, which is returned.')
         .param('id', 'The ID of the challenge to delete.', paramType='path')
         .param('progress', 'Whether to record progress on this task. Default '
                'is false.', required=False, dataType='boolean')
@@ -281,16 +232,10 @@ class ChallengeResource(Resource):
         .errorResponse('Admin access was denied for the challenge.', 403)
     )
     def deleteChallenge(self, challenge, params):
+        user = self.getCurrentUser()
         progress = self.boolParam('progress', params, default=False)
-        with ProgressContext(progress, user=self.getCurrentUser(),
-                             title=u'Deleting challenge ' + challenge['name'],
-                             message='Calculating total size...') as ctx:
-            if progress:
-                ctx.update(
-                    total=Challenge().subtreeCount(
-                        challenge))
-            Challenge().remove(challenge, progress=ctx)
-        return {'message': 'Deleted challenge %s.' % challenge['name']}
+        job = scheduleCascadeDelete(user, challenge=challenge, progress=progress)
+        return Job().filter(job, user)
 
     @access.public
     @loadmodel(model='challenge', plugin='covalic', level=AccessType.READ)
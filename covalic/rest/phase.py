@@ -18,22 +18,43 @@
 ###############################################################################
 
 import cherrypy
+import csv
+import datetime
+import io
 import json
+import math
 
 import bson.json_util
 from girder.api import access
-from girder.api.describe import Description, describeRoute
-from girder.api.rest import filtermodel, loadmodel, getApiUrl, Resource, RestException
-from girder.constants import AccessType
+from girder.api.describe import Description, autoDescribeRoute, describeRoute
+from girder.api.rest import filtermodel, loadmodel, getApiUrl, Resource, RestException, \
+    setContentDisposition, setRawResponse, setResponseHeader
+from girder.constants import AccessType, SortDir
+from girder.exceptions import AccessException
 from girder.models.folder import Folder
 from girder.models.group import Group
 from girder.models.token import Token
-from girder.models.user import User
-from girder.utility.progress import ProgressContext
+from girder.utility import JsonEncoder
 from girder_jobs.models.job import Job
 
+from covalic.constants import EXPORT_BATCH_SIZE, RESCORE_CHUNK_SIZE
+from covalic.jobs import scheduleCascadeDelete, scheduleRecomputeOverallScores, \
+    scheduleRescorePhase
+from covalic.models.leaderboard import Leaderboard
+from covalic.models.manifest import GroundTruthManifest
 from covalic.models.phase import Phase
 from covalic.models.submission import Submission
+from covalic.scheduler import scoringScheduler
+from covalic.stats import getPhaseStats
+from covalic.utility import checkETag, filterScore
+
+
+# Submission columns of the csv export, followed by dataset, metric and value
+EXPORT_CSV_FIELDS = (
+    '_id', 'creatorId', 'creatorName', 'approach', 'title', 'organization',
+    'organizationUrl', 'documentationUrl', 'created', 'latest', 'overallScore',
+    'rank', 'approachRank'
+)
 
 
 def _loadMetadata(params):
@@ -59,12 +80,15 @@ class PhaseResource(Resource):
         self.route('GET', (':id',), self.getPhase)
         self.route('GET', (':id', 'access'), self.getAccess)
         self.route('GET', (':id', 'stats'), self.getStats)
+        self.route('GET', (':id', 'leaderboard'), self.getLeaderboard)
+        self.route('GET', (':id', 'submissions', 'export'), self.exportSubmissions)
         self.route('POST', (), self.createPhase)
         self.route('POST', (':id', 'participant'), self.joinPhase)
         self.route('PUT', (':id',), self.updatePhase)
         self.route('PUT', (':id', 'access'), self.updateAccess)
         self.route('DELETE', (':id',), self.deletePhase)
         self.route('GET', (':id', 'groundtruth', 'item'), self.groundtruthItems)
+        self.route('POST', (':id', 'groundtruth', 'validate'), self.validateSubmissionFolder)
         self.route('GET', (':id', 'test_data', 'item'), self.testDataItems)
         self.route('PUT', (':id', 'metrics'), self.setMetrics)
         self.route('PUT', (':id', 'scoring_info'), self.setScoringInfo)
@@ -205,48 +229,159 @@ class PhaseResource(Resource):
     @loadmodel(model='phase', plugin='covalic', level=AccessType.READ)
     @describeRoute(
         Description('Get statistics for a phase.')
+        .notes('Submissions are counted if they are the latest scored submission of '
+               'their participant and approach.')
         .param('id', 'The ID of the phase.', paramType='path')
         .errorResponse('ID was invalid.')
         .errorResponse('Admin access was denied for the phase.', 403)
     )
     def getStats(self, phase, params):
-        participantCount = User().find({
-            'groups': phase['participantGroupId']
-        }).count()
-        submissionStats = next(Submission().collection.aggregrate([
-            {
-                '$match': {
-                    'phaseId': phase['_id'],
-                    'latest': True
-                }
-            }, {
-                '$facet': {
-                    'submissionCount': [
-                        {
-                            '$count': 'count'
-                        }
-                    ],
-                    'submittingParticipantCount': [
-                        {
-                            '$group': {
-                                '_id': '$creatorId'
-                            }
-                        }, {
-                            '$count': 'count'
-                        }
-                    ]
-                }
-            }
-        ]))
-        submissionCount = submissionStats['submissionCount'][0]['count']
-        submittingParticipantCount = submissionStats['submittingParticipantCount'][0]['count']
-
+        stats = getPhaseStats(phase)
         return {
-            'submissionCount': submissionCount,
-            'participantCount': participantCount,
-            'submittingParticipantCount': submittingParticipantCount,
+            'submissionCount': stats['submissionCount'],
+            'participantCount': stats['participantCount'],
+            'submittingParticipantCount': stats['submitterCount'],
+            'lastSubmission': stats['lastSubmission']
         }
 
+    @access.public
+    @filtermodel(model=Leaderboard)
+    @autoDescribeRoute(
+        Description('List the leaderboard of a phase.')
+        .notes('The leaderboard contains the latest scored submission of each '
+               'participant and approach, along with its dense rank in the phase and '
+               'among the submissions of the same approach.')
+        .modelParam('id', 'The ID of the phase.', model=Phase, level=AccessType.READ)
+        .param('approach', 'Only include this approach in the results.', required=False)
+        .pagingParams(defaultSort=None)
+        .param('sort', 'Field to sort the result set by. Defaults to rank, or to the '
+               'creation date if scores are hidden from the caller.',
+               required=False, strip=True)
+        .param('sortdir', 'Sort order: 1 for ascending, -1 for descending.',
+               required=False, dataType='integer',
+               enum=[SortDir.ASCENDING, SortDir.DESCENDING], default=SortDir.ASCENDING)
+        .errorResponse('ID was invalid.')
+        .errorResponse('Read permission denied on the phase.', 403)
+    )
+    def getLeaderboard(self, phase, approach, limit, offset, sort):
+        user = self.getCurrentUser()
+        hidden = bool(phase.get('hideScores')
+                      and not Phase().hasAccess(phase, user, AccessType.WRITE))
+        checkETag(phase.get('version'), int(hidden))
+
+        field, sortdir = sort[0]
+        if field is None:
+            sort = [('created' if hidden else 'rank', sortdir)]
+
+        # If scores are hidden, do not allow sorting by score fields
+        if hidden:
+            for field, _ in sort:
+                if field in {'overallScore', 'rank', 'approachRank'} or \
+                        field.startswith('averages'):
+                    raise AccessException(
+                        'Scores are hidden from participants in this phase, '
+                        'you may not sort by score fields.')
+
+        rows = []
+        for row in Leaderboard().list(
+                phase, limit=limit, offset=offset, sort=sort, approach=approach):
+            if hidden:
+                for field in ('overallScore', 'averages', 'rank', 'approachRank'):
+                    row.pop(field, None)
+            else:
+                # coerce any nans or infs to strings
+                for metric in row.get('averages') or ():
+                    if metric['value'] is not None:
+                        v = float(metric['value'])
+                        if math.isnan(v) or math.isinf(v):
+                            metric['value'] = str(v)
+                v = row['overallScore']
+                if math.isnan(v) or math.isinf(v):
+                    row['overallScore'] = str(v)
+            rows.append(row)
+        return rows
+
+    @access.public
+    @autoDescribeRoute(
+        Description('Export the submissions of a phase, including their scores.')
+        .notes('The response is streamed. In ndjson format, each line is a JSON '
+               'submission document. In csv format, each row holds one metric value '
+               'of one dataset of a submission, so a submission spans several rows. '
+               'Scores are omitted if they are hidden from the caller.')
+        .modelParam('id', 'The ID of the phase.', model=Phase, level=AccessType.READ)
+        .param('format', 'The export format.', required=False, enum=['csv', 'ndjson'],
+               default='csv')
+        .param('latest', 'Only include the latest scored submission for each user.',
+               required=False, dataType='boolean', default=True)
+        .param('approach', 'Only include this approach in the results.', required=False)
+        .errorResponse('ID was invalid.')
+        .errorResponse('Read permission denied on the phase.', 403)
+    )
+    def exportSubmissions(self, phase, format, latest, approach):
+        user = self.getCurrentUser()
+        hidden = bool(phase.get('hideScores')
+                      and not Phase().hasAccess(phase, user, AccessType.WRITE))
+
+        # Do not reveal the order of hidden scores
+        if hidden:
+            sort = [('created', SortDir.ASCENDING), ('_id', SortDir.ASCENDING)]
+        else:
+            sort = [('overallScore', SortDir.DESCENDING), ('_id', SortDir.ASCENDING)]
+
+        submissions = Submission().list(
+            phase, limit=0, sort=sort, latest=latest, approach=approach,
+            batchSize=EXPORT_BATCH_SIZE)
+        documents = (
+            filterScore(Submission().filter(submission, user), hidden)
+            for submission in submissions)
+
+        setRawResponse()
+        setContentDisposition('%s.%s' % (phase['name'], format))
+        if format == 'ndjson':
+            setResponseHeader('Content-Type', 'application/x-ndjson')
+            return self._exportNdjson(documents)
+        setResponseHeader('Content-Type', 'text/csv')
+        return self._exportCsv(documents)
+
+    def _exportNdjson(self, documents):
+        def stream():
+            lines = []
+            for doc in documents:
+                lines.append(json.dumps(doc, cls=JsonEncoder, allow_nan=False))
+                if len(lines) >= EXPORT_BATCH_SIZE:
+                    yield '\n'.join(lines) + '\n'
+                    lines = []
+            if lines:
+                yield '\n'.join(lines) + '\n'
+        return stream
+
+    def _exportCsv(self, documents):
+        def row(doc, dataset=None, metric=None):
+            values = [doc.get(field) for field in EXPORT_CSV_FIELDS]
+            values += [dataset, metric and metric['name'], metric and metric['value']]
+            return ['' if v is None else v.isoformat() if isinstance(v, datetime.datetime)
+                    else v for v in values]
+
+        def stream():
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            writer.writerow(EXPORT_CSV_FIELDS + ('dataset', 'metric', 'value'))
+            count = 0
+            for doc in documents:
+                if doc.get('score'):
+                    for dataset in doc['score']:
+                        for metric in dataset['metrics']:
+                            writer.writerow(row(doc, dataset['dataset'], metric))
+                else:
+                    writer.writerow(row(doc))
+                count += 1
+                if count % EXPORT_BATCH_SIZE == 0:
+                    yield buf.getvalue()
+                    buf.seek(0)
+                    buf.truncate()
+            yield buf.getvalue()
+        return stream
+
     @access.user
     @loadmodel(model='phase', plugin='covalic', level=AccessType.ADMIN)
     @describeRoute(
@@ -396,8 +531,9 @@ class PhaseResource(Resource):
         .errorResponse('Read permission denied on the phase.', 403)
     )
     def getPhase(self, phase, params):
-        return Phase().filter(
-            phase, self.getCurrentUser())
+        user = self.getCurrentUser()
+        checkETag(phase.get('version'), Phase().getAccessLevel(phase, user))
+        return Phase().filter(phase, user)
 
     @access.user
     @loadmodel(model='phase', plugin='covalic', level=AccessType.READ)
@@ -422,6 +558,8 @@ class PhaseResource(Resource):
     @loadmodel(model='phase', plugin='covalic', level=AccessType.ADMIN)
     @describeRoute(
         Description('Delete a phase.')
+        .notes('The phase and its submissions are deleted by a background job, '
+               'which is returned.')
         .param('id', 'The ID of the phase to delete.', paramType='path')
         .param('progress', 'Whether to record progress on this task. Default '
                'is false.', required=False, dataType='boolean')
@@ -429,34 +567,63 @@ class PhaseResource(Resource):
         .errorResponse('Admin access was denied for the phase.', 403)
     )
     def deletePhase(self, phase, params):
+        user = self.getCurrentUser()
         progress = self.boolParam('progress', params, default=False)
-        with ProgressContext(progress, user=self.getCurrentUser(),
-                             title=u'Deleting phase ' + phase['name'],
-                             message='Calculating total size...') as ctx:
-            if progress:
-                ctx.update(
-                    total=Phase().subtreeCount(phase))
-            Phase().remove(phase, progress=ctx)
-        return {'message': 'Deleted phase %s.' % phase['name']}
+        job = scheduleCascadeDelete(user, phase=phase, progress=progress)
+        return Job().filter(job, user)
 
     @access.public
-    @loadmodel(model='phase', plugin='covalic', level=AccessType.READ)
-    @filtermodel(model='item')
-    @describeRoute(
+    @autoDescribeRoute(
         Description('List all ground truth item names for a challenge phase.')
-        .param('id', 'The ID of the phase.', paramType='path')
+        .notes('Items are listed from a cached manifest of the ground truth '
+               'folder, whose version is returned in the ETag header.')
+        .modelParam('id', 'The ID of the phase.', model=Phase, level=AccessType.READ)
         .pagingParams(defaultSort='name')
+        .errorResponse('ID was invalid.')
+        .errorResponse('Read permission denied on the phase.', 403)
     )
-    def groundtruthItems(self, phase, params):
+    def groundtruthItems(self, phase, limit, offset, sort):
         # All participants can see the names of the ground truth items in
         # order to validate their submissions, even if they don't have
         # read access to the folder.
-        folder = Folder().load(
-            phase['groundTruthFolderId'], force=True)
+        manifest = Phase().getGroundTruthManifest(phase)
+        checkETag(manifest['version'])
+
+        # Only names are exposed, the checksums stay on the server
+        items = [{'_id': item['_id'], 'name': item['name']} for item in manifest['items']]
+        for field, direction in reversed(sort):
+            if field != 'name':
+                raise RestException('Invalid sort field: %s.' % field)
+            items = sorted(items, key=lambda item: item[field],
+                           reverse=direction == SortDir.DESCENDING)
+        return items[offset:offset + limit] if limit else items[offset:]
 
-        return list(Folder().childItems(folder, limit=0, fields=(
-            'name', '_id'
-        )))
+    @access.user
+    @autoDescribeRoute(
+        Description('Check the items of a submission against the ground truth of a phase.')
+        .notes('Pass either a submission folder, or the names of the files to submit '
+               'before uploading them. Item names are compared without their extensions.')
+        .modelParam('id', 'The ID of the phase.', model=Phase, level=AccessType.READ)
+        .modelParam('folderId', 'The ID of the submission folder.', model=Folder,
+                    level=AccessType.READ, paramType='query', destName='folder',
+                    required=False)
+        .jsonParam('names', 'The names of the files to submit, as a JSON list.',
+                   requireArray=True, required=False)
+        .errorResponse('ID was invalid.')
+        .errorResponse('Read permission denied on the phase or folder.', 403)
+    )
+    def validateSubmissionFolder(self, phase, folder, names):
+        if (folder is None) == (names is None):
+            raise RestException('Exactly one of folderId and names must be passed.')
+
+        manifest = Phase().getGroundTruthManifest(phase)
+        if folder is not None:
+            result = GroundTruthManifest().matchFolder(manifest, folder)
+        else:
+            result = GroundTruthManifest().matchItems(manifest, names)
+        result['ok'] = not result['unmatchedGroundtruths'] and not result['unmatchedInputs']
+        result['version'] = manifest['version']
+        return result
 
     @access.public
     @loadmodel(model='phase', plugin='covalic', level=AccessType.READ)
@@ -483,8 +650,9 @@ class PhaseResource(Resource):
     @loadmodel(model='phase', plugin='covalic', level=AccessType.WRITE)
     @describeRoute(
         Description('Set the metric information set for this phase.')
-        .notes('If the metrics have changed, this will recompute all of the '
-               'overall scores for this phase.')
+        .notes('If the metrics have changed, this schedules a job that '
+               'recomputes all of the overall scores for this phase, and '
+               'returns the job document. Otherwise, returns the phase.')
         .param('id', 'ID of the phase to set metric info on.', paramType='path')
         .param('copyFrom', 'To copy the metric info from another phase, set '
                'this parameter to the ID of that phase.', required=False)
@@ -514,12 +682,14 @@ class PhaseResource(Resource):
                     changed = True
                     break
 
+        phase = Phase().save(phase)
+
         # If they have changed, recompute all scores using the new weights
         if changed:
-            # TODO progress context
-            Submission().recomputeOverallScores(phase)
+            job = scheduleRecomputeOverallScores(phase, user)
+            return Job().filter(job, user)
 
-        return Phase().filter(Phase().save(phase), user)
+        return Phase().filter(phase, user)
 
     @access.user
     @loadmodel(model='phase', plugin='covalic', level=AccessType.WRITE)
@@ -545,6 +715,7 @@ class PhaseResource(Resource):
         groundTruth = Folder().load(
             phase['groundTruthFolderId'], user=user, level=AccessType.READ,
             exc=True)
+        groundTruthArchive = Phase().getGroundTruthArchive(phase, groundTruth, user)
 
         kwargs = {
             'task': {
@@ -574,7 +745,7 @@ class PhaseResource(Resource):
                     'mode': 'http',
                     'method': 'GET',
                     'url': '/'.join((
-                        apiUrl, 'folder', str(groundTruth['_id']),
+                        apiUrl, 'file', str(groundTruthArchive['_id']),
                         'download')),
                     'headers': {'Girder-Token': scoreToken['_id']}
                 }
@@ -627,19 +798,32 @@ class PhaseResource(Resource):
             Phase().save(phase), self.getCurrentUser())
 
     @access.admin
-    @loadmodel(model='phase', plugin='covalic', level=AccessType.ADMIN)
-    @describeRoute(
+    @autoDescribeRoute(
         Description('Re-run scoring for the latest submissions in the phase.')
-        .param('id', 'The ID of the phase.', paramType='path')
+        .notes('The scoring jobs are created by a background job, which is returned. '
+               'That job succeeds once all of its scoring jobs have finished. '
+               'Submissions whose content, ground truth and scoring task are unchanged '
+               'since a previous scoring run reuse its score without running a job.')
+        .modelParam('id', 'The ID of the phase.', model=Phase, level=AccessType.ADMIN)
+        .param('chunkSize', 'The number of scoring jobs to create at a time.',
+               required=False, dataType='integer', default=RESCORE_CHUNK_SIZE)
+        .param('maxConcurrent', 'The maximum number of unfinished scoring jobs. '
+               'Defaults to the number the scheduler runs at a time for one phase.',
+               required=False, dataType='integer')
+        .param('force', 'Run the scoring jobs even if scores are cached.', required=False,
+               dataType='boolean', default=False)
         .errorResponse('ID was invalid.')
         .errorResponse('Site admin access is required.', 403)
     )
-    def rescorePhase(self, phase, params):
-        submissions = Submission().list(
-            phase, limit=0, sort=[('created', 1)], fields={'score': False}, latest=True)
+    def rescorePhase(self, phase, chunkSize, maxConcurrent, force):
+        if maxConcurrent is None:
+            maxConcurrent = scoringScheduler.limits()[1]
+        if chunkSize < 1 or maxConcurrent < 1:
+            raise RestException('chunkSize and maxConcurrent must be positive.')
 
         # Get API URL by removing this endpoint's parameters
         apiUrl = '/'.join(cherrypy.url().split('/')[:-3])
 
-        for submission in submissions:
-            Submission().scoreSubmission(submission, apiUrl)
+        user = self.getCurrentUser()
+        return Job().filter(
+            scheduleRescorePhase(phase, user, apiUrl, chunkSize, maxConcurrent, force), user)
@@ -17,11 +17,11 @@
 #  limitations under the License.
 ###############################################################################
 
+import base64
 import cherrypy
-import math
 import os
-import posixpath
 
+import bson.json_util
 from girder.api import access
 from girder.api.describe import Description, autoDescribeRoute, describeRoute
 from girder.api.rest import Resource, filtermodel, loadmodel
@@ -30,12 +30,45 @@ from girder.exceptions import AccessException, GirderException, RestException, V
 from girder.models.folder import Folder
 from girder.models.token import Token
 from girder.models.user import User
-from girder.utility import mail_utils
 
-from covalic.utility.user_emails import getPhaseUserEmails
-from covalic.models.challenge import Challenge
+from covalic.models.manifest import GroundTruthManifest
 from covalic.models.phase import Phase
+from covalic.models.score_cache import ScoreCache
 from covalic.models.submission import Submission
+from covalic.notifications import notifySubmissionScored
+from covalic.utility import checkETag, filterScore, submissionsOpen
+from covalic.utility.cache import leaderboardCache
+
+
+# Sort fields that support keyset pagination with the 'cursor' parameter
+KEYSET_SORT_FIELDS = {'overallScore', 'created'}
+
+# Maximum number of mismatched names listed when a submission is rejected
+MISMATCH_MAX_LISTED = 10
+
+
+def _listNames(names):
+    listed = ', '.join(names[:MISMATCH_MAX_LISTED])
+    if len(names) > MISMATCH_MAX_LISTED:
+        listed += ' and %d more' % (len(names) - MISMATCH_MAX_LISTED)
+    return listed
+
+
+def _encodeCursor(field, direction, doc):
+    cursor = bson.json_util.dumps([field, direction, doc.get(field), doc['_id']])
+    return base64.urlsafe_b64encode(cursor.encode('utf8')).decode('utf8')
+
+
+def _decodeCursor(cursor, sort):
+    try:
+        field, direction, value, lastId = bson.json_util.loads(
+            base64.urlsafe_b64decode(cursor.encode('utf8')).decode('utf8'))
+    except (TypeError, ValueError):
+        raise RestException('Invalid cursor.')
+
+    if [(field, direction)] != sort[:1]:
+        raise RestException('The cursor does not match the sort order.')
+    return value, lastId
 
 
 class SubmissionResource(Resource):
@@ -46,7 +79,9 @@ class SubmissionResource(Resource):
 
         self.route('GET', (), self.listSubmissions)
         self.route('GET', ('approaches',), self.listUserApproaches)
+        self.route('GET', ('cache',), self.getCacheStats)
         self.route('GET', (':id',), self.getSubmission)
+        self.route('GET', (':id', 'rank'), self.getSubmissionRank)
         self.route('GET', ('unscored',), self.getUnscoredSubmissions)
         self.route('POST', (), self.postSubmission)
         self.route('PUT', (':id',), self.updateSubmission)
@@ -64,23 +99,9 @@ class SubmissionResource(Resource):
         Additionally, ensures that any NaN or Infinity score values are coerced
         to corresponding strings so they can be JSON encoded.
         """
-        if (phase.get('hideScores')
-                and not Phase().hasAccess(phase, user, level=AccessType.WRITE)):
-            submission.pop('score', None)
-            submission.pop('overallScore', None)
-        else:
-            # coerce any nans or infs to strings
-            for dataset in (submission.get('score') or ()):
-                for metric in dataset['metrics']:
-                    if metric['value'] is not None:
-                        v = float(metric['value'])
-                        if math.isnan(v) or math.isinf(v):
-                            metric['value'] = str(v)
-            v = submission.get('overallScore') or 0
-            if math.isnan(v) or math.isinf(v):
-                submission['overallScore'] = str(v)
-
-        return submission
+        hidden = bool(phase.get('hideScores')
+                      and not Phase().hasAccess(phase, user, level=AccessType.WRITE))
+        return filterScore(submission, hidden)
 
     def _checkRequireParam(self, phase, params, paramName, requireOptionName):
         """
@@ -119,27 +140,66 @@ class SubmissionResource(Resource):
                required=False, dataType='boolean', default=True)
         .param('approach', 'Only include this approach in the results',
                required=False)
+        .param('cursor', 'Opaque cursor returned in the Covalic-Next-Cursor header of the '
+               'previous page. When sorting by overallScore or created, use this instead of '
+               'offset for constant-cost paging.', required=False)
         .pagingParams(defaultSort='overallScore', defaultSortDir=SortDir.DESCENDING)
     )
-    def listSubmissions(self, phase, userFilter, latest, limit, offset, sort, approach):
+    def listSubmissions(self, phase, userFilter, latest, limit, offset, sort, approach, cursor):
         user = self.getCurrentUser()
+        hidden = bool(phase.get('hideScores')
+                      and not Phase().hasAccess(phase, user, AccessType.WRITE))
 
         # If scores are hidden, do not allow sorting by score fields
-        if (phase.get('hideScores')
-                and not Phase().hasAccess(phase, user, AccessType.WRITE)):
+        if hidden:
             for field, _ in sort:
-                if field == 'overallScore' or field.startswith('score.'):
+                if field in {'overallScore', 'rank', 'approachRank'} or \
+                        field.startswith('score.'):
                     raise AccessException(
                         'Scores are hidden from participants in this phase, '
                         'you may not sort by score fields.')
 
-        # Exclude score field
-        fields = {'score': False}
-
-        submissions = Submission().list(
-            phase, limit=limit, offset=offset, sort=sort, userFilter=userFilter,
-            fields=fields, latest=latest, approach=approach)
-        return [self._filterScore(phase, s, user) for s in submissions]
+        # Use _id as a tiebreaker so the order is stable across pages
+        keyset = len(sort) == 1 and sort[0][0] in KEYSET_SORT_FIELDS
+        after = None
+        if keyset:
+            field, direction = sort[0]
+            if cursor is not None:
+                after = _decodeCursor(cursor, sort)
+            sort = [(field, direction), ('_id', direction)]
+        elif cursor is not None:
+            raise RestException(
+                'Cursors are only supported when sorting by one of: %s.' %
+                ', '.join(sorted(KEYSET_SORT_FIELDS)))
+
+        # Answer polling clients without querying submissions if nothing changed
+        checkETag(phase.get('version'), int(hidden))
+
+        # The version stamp in the key keeps entries computed by this process
+        # from outliving changes made by other processes.
+        cacheKey = (
+            phase['_id'], phase.get('version'), tuple(sort), approach, latest, limit, offset,
+            cursor, userFilter['_id'] if userFilter else None, hidden)
+        cached = leaderboardCache.get(cacheKey)
+        if cached is None:
+            # Exclude score field
+            fields = {'score': False}
+
+            submissions = list(Submission().list(
+                phase, limit=limit, offset=offset, sort=sort, userFilter=userFilter,
+                fields=fields, latest=latest, approach=approach, after=after))
+
+            nextCursor = None
+            if keyset and limit and len(submissions) == limit:
+                nextCursor = _encodeCursor(field, direction, submissions[-1])
+
+            cached = ([self._filterScore(phase, s, user) for s in submissions], nextCursor)
+            leaderboardCache.set(cacheKey, cached)
+
+        submissions, nextCursor = cached
+        if nextCursor is not None:
+            cherrypy.response.headers['Covalic-Next-Cursor'] = nextCursor
+        return list(submissions)
 
     @access.user
     @autoDescribeRoute(
@@ -161,10 +221,23 @@ class SubmissionResource(Resource):
 
         return Submission().listApproaches(phase=phase, user=user)
 
+    @access.admin
+    @autoDescribeRoute(
+        Description('Get the statistics of the submission listing cache.')
+        .notes('Hit, miss and eviction counters are counted since the server '
+               'process started, and only describe this process.')
+        .errorResponse('Site admin access is required.', 403)
+    )
+    def getCacheStats(self):
+        return leaderboardCache.stats()
+
     @access.user
     @filtermodel(model=Submission)
     @autoDescribeRoute(
         Description('Make a submission to the challenge.')
+        .notes('Participants may submit while the phase is active. Phases open '
+               'and close at their start and end dates, and admins may set the '
+               'active flag to open a phase early or to reopen it.')
         .modelParam('phaseId', 'The ID of the challenge phase to submit to.',
                     model=Phase, level=AccessType.READ, paramType='query',
                     destName='phase')
@@ -185,11 +258,12 @@ class SubmissionResource(Resource):
                    paramType='form', requireObject=True, required=False)
         .errorResponse('You are not a member of the participant group.', 403)
         .errorResponse('The ID was invalid.')
+        .errorResponse('The submission does not match the ground truth.')
     )
     def postSubmission(self, phase, folder, **params):
         user = self.getCurrentUser()
 
-        if not phase.get('active') and (not user or not user.get('admin')):
+        if not submissionsOpen(phase) and (not user or not user.get('admin')):
             raise ValidationException('You may not submit to this phase '
                                       'because it is not currently active.')
 
@@ -230,6 +304,20 @@ class SubmissionResource(Resource):
                                     'to this phase on behalf of another user.')
             user = User().load(params['userId'], force=True, exc=True)
 
+        # Reject mismatched submissions before a scoring job is run on them
+        if phase.get('matchSubmissions', True):
+            match = GroundTruthManifest().matchFolder(
+                Phase().getGroundTruthManifest(phase), folder)
+            errors = []
+            if match['unmatchedGroundtruths']:
+                errors.append('missing: %s' % _listNames(match['unmatchedGroundtruths']))
+            if match['unmatchedInputs']:
+                errors.append('unexpected: %s' % _listNames(match['unmatchedInputs']))
+            if errors:
+                raise ValidationException(
+                    'The submission does not match the ground truth (%s).' % '; '.join(errors),
+                    'folderId')
+
         submission = Submission().createSubmission(
             creator=user,
             phase=phase,
@@ -365,45 +453,24 @@ class SubmissionResource(Resource):
         # Record whether submission is being re-scored
         rescoring = 'overallScore' in submission
 
+        # Reuse this score for scoring runs with the same inputs as the job
+        # that produced it, which a later rescore may have changed
+        token = self.getCurrentToken()
+        if token.get('covalicFingerprint'):
+            ScoreCache().setScore(token['covalicFingerprint'], score)
+
         # Save document to trigger computing overall score
         submission.pop('overallScore', None)
         submission['score'] = score
         submission = Submission().save(submission)
 
         # Delete the scoring user's job token since the job is now complete.
-        token = self.getCurrentToken()
         Token().remove(token)
 
-        user = User().load(submission['creatorId'], force=True)
-        challenge = Challenge().load(phase['challengeId'], force=True)
-        covalicHost = posixpath.dirname(mail_utils.getEmailUrlPrefix())
-
-        # Mail user
-        if not rescoring:
-            html = mail_utils.renderTemplate(
-                'covalic.submissionCompleteUser.mako',
-                {
-                    'phase': phase,
-                    'challenge': challenge,
-                    'submission': submission,
-                    'host': covalicHost
-                })
-            mail_utils.sendMail('Your submission has been scored', html, [user['email']])
-
-        # Mail admins
-        emails = sorted(getPhaseUserEmails(
-            phase, AccessType.WRITE, includeChallengeUsers=True))
-        html = mail_utils.renderTemplate(
-            'covalic.submissionCompleteAdmin.mako',
-            {
-                'user': user,
-                'phase': phase,
-                'challenge': challenge,
-                'submission': submission,
-                'host': covalicHost
-            })
-        mail_utils.sendMail('A submission has been scored', html, emails)
+        # Mail the user and the admins in the background
+        notifySubmissionScored(submission, phase, rescoring)
 
+        user = User().load(submission['creatorId'], force=True)
         return self._filterScore(phase, submission, user)
 
     @access.public
@@ -423,6 +490,36 @@ class SubmissionResource(Resource):
 
         return self._filterScore(phase, submission, user)
 
+    @access.public
+    @loadmodel(model='submission', plugin='covalic')
+    @describeRoute(
+        Description('Get the leaderboard rank of a submission.')
+        .notes('Ranks are dense, so tied submissions share a rank. Only the '
+               'latest scored submission of each user is ranked.')
+        .param('id', 'The ID of the submission.', paramType='path')
+        .errorResponse('ID was invalid.')
+        .errorResponse('The submission is not ranked.')
+        .errorResponse('Read access was denied for the challenge phase.', 403)
+        .errorResponse('Scores are hidden from participants in this phase.', 403)
+    )
+    def getSubmissionRank(self, submission, params):
+        user = self.getCurrentUser()
+        phase = Phase().load(
+            submission['phaseId'], user=user, exc=True, level=AccessType.READ)
+
+        if phase.get('hideScores') and not Phase().hasAccess(
+                phase, user, level=AccessType.WRITE):
+            raise AccessException(
+                'Scores are hidden from participants in this phase.')
+
+        if not submission.get('latest') or submission.get('overallScore') is None:
+            raise RestException('Only the latest scored submission of a user is ranked.')
+
+        return {
+            'rank': submission.get('rank'),
+            'approachRank': submission.get('approachRank')
+        }
+
     @access.user
     @loadmodel(model='phase', plugin='covalic', level=AccessType.ADMIN)
     def getUnscoredSubmissions(self, params):
@@ -444,12 +541,16 @@ class SubmissionResource(Resource):
     @filtermodel(model=Submission)
     @autoDescribeRoute(
         Description('Re-run scoring for a submission.')
+        .notes('If the submission, ground truth and scoring task are unchanged since a '
+               'previous scoring run, its score is reused without running a job.')
         .modelParam('id', 'The ID of the submission.', model=Submission, paramType='path',
                     destName='submission')
+        .param('force', 'Run the scoring job even if a score is cached.', required=False,
+               dataType='boolean', default=False)
         .errorResponse('ID was invalid.')
         .errorResponse('Site admin access is required.', 403)
     )
-    def rescoreSubmission(self, submission):
+    def rescoreSubmission(self, submission, force):
         user = self.getCurrentUser()
 
         # Allow rescoring only the latest submission
@@ -461,7 +562,7 @@ class SubmissionResource(Resource):
         # Get API URL like in postSubmission(), but remove this endpoint's parameters
         apiUrl = '/'.join(cherrypy.url().split('/')[:-3])
 
-        submission = Submission().scoreSubmission(submission, apiUrl)
+        submission = Submission().scoreSubmission(submission, apiUrl, force=force)
 
         return self._filterScore(phase, submission, user)
 
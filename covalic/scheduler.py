@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import datetime
+import threading
+import uuid
+
+from girder.models.setting import Setting
+from girder_jobs.constants import JobStatus
+from girder_jobs.models.job import Job
+from pymongo import ReturnDocument
+
+from covalic.constants import PluginSettings, SCORING_DISPATCH_TIMEOUT, SCORING_JOB_TIMEOUT, \
+    SCORING_MAX_CONCURRENT, SCORING_PHASE_MAX_CONCURRENT, SCORING_USER_MAX_CONCURRENT
+from covalic.models.scheduler_lease import SchedulerLease
+
+# Queue priorities of scoring jobs; lower values are dispatched first
+PRIORITY_NEW = 0
+PRIORITY_RESCORE = 1
+
+_UNFINISHED = [JobStatus.INACTIVE, JobStatus.QUEUED, JobStatus.RUNNING]
+
+
+def _scheduleJob(job):
+    Job().scheduleJob(job)
+
+
+class ScoringScheduler(object):
+    """
+    A fair-share dispatch queue between the creation and the scheduling of scoring jobs.
+
+    Scoring jobs are created inactive and queued with :py:meth:`enqueue`.
+    :py:meth:`dispatch` then schedules queued jobs while fewer than
+    ``maxConcurrent`` dispatched jobs are unfinished, subject to per-phase
+    and per-user caps. New submissions are dispatched ahead of rescoring, and
+    challenges take turns so that a busy challenge cannot starve the others.
+
+    The queue state is stored on the job documents, so any server process
+    may dispatch, and jobs queued before a restart are dispatched when the
+    server starts. A lease in the database lets one process dispatch at a
+    time, and slot usage is recomputed from the job documents on each
+    dispatch. Dispatched jobs that stop being updated, because their worker
+    died, fail after ``SCORING_JOB_TIMEOUT`` seconds and release their slot.
+
+    :param maxConcurrent: The maximum number of unfinished dispatched jobs.
+        Defaults to the plugin setting.
+    :type maxConcurrent: int or None
+    :param phaseMaxConcurrent: The maximum number per phase. Defaults to the
+        plugin setting.
+    :type phaseMaxConcurrent: int or None
+    :param userMaxConcurrent: The maximum number per user. Defaults to the
+        plugin setting.
+    :type userMaxConcurrent: int or None
+    :param schedule: Called with each job to dispatch. Defaults to
+        scheduling the job with Girder Worker.
+    :type schedule: callable or None
+    """
+
+    def __init__(self, maxConcurrent=None, phaseMaxConcurrent=None, userMaxConcurrent=None,
+                 schedule=None):
+        self.maxConcurrent = maxConcurrent
+        self.phaseMaxConcurrent = phaseMaxConcurrent
+        self.userMaxConcurrent = userMaxConcurrent
+        self.schedule = schedule or _scheduleJob
+        self._lastChallengeId = None
+        self._lock = threading.RLock()
+        self._owner = uuid.uuid4().hex
+
+    def limits(self):
+        """
+        Get the caps on unfinished dispatched jobs.
+
+        :returns: The maximum number in total, per phase and per user.
+        :rtype: tuple
+        """
+        limits = []
+        for value, key, default in (
+                (self.maxConcurrent, PluginSettings.SCORING_MAX_CONCURRENT,
+                 SCORING_MAX_CONCURRENT),
+                (self.phaseMaxConcurrent, PluginSettings.SCORING_PHASE_MAX_CONCURRENT,
+                 SCORING_PHASE_MAX_CONCURRENT),
+                (self.userMaxConcurrent, PluginSettings.SCORING_USER_MAX_CONCURRENT,
+                 SCORING_USER_MAX_CONCURRENT)):
+            if value is None:
+                value = Setting().get(key)
+            limits.append(default if value is None else value)
+        return tuple(limits)
+
+    def ensureIndices(self):
+        queueIdx = ([
+            ('covalicQueued', 1), ('covalicChallengeId', 1), ('covalicPriority', 1),
+            ('covalicQueuedAt', 1)
+        ], {'sparse': True})
+        activeIdx = ([('covalicActive', 1)], {'sparse': True})
+        Job().ensureIndices((queueIdx, activeIdx))
+
+    def enqueue(self, job, phase, dispatch=True):
+        """
+        Queue an inactive scoring job.
+
+        :param job: The job document.
+        :param phase: The phase of the submission being scored.
+        :param dispatch: Whether to dispatch queued jobs right away.
+        :type dispatch: bool
+        :returns: The job document.
+        """
+        fields = {
+            'covalicQueued': True,
+            'covalicChallengeId': phase['challengeId'],
+            'covalicPhaseId': phase['_id'],
+            'covalicPriority': PRIORITY_RESCORE if job.get('rescoring') else PRIORITY_NEW,
+            'covalicQueuedAt': datetime.datetime.utcnow()
+        }
+        Job().update({'_id': job['_id']}, {'$set': fields})
+        job.update(fields)
+
+        if dispatch:
+            self.dispatch()
+        return job
+
+    def jobFinished(self, job):
+        """
+        Release the slot of a dispatched job, and dispatch queued jobs.
+
+        :param job: The job document, which should have a final status.
+        """
+        Job().update({'_id': job['_id']}, {'$unset': {'covalicActive': ''}})
+        self.dispatch()
+
+    def releasePhases(self, phaseIds):
+        """
+        Remove the jobs of removed phases from the queue and release their slots.
+
+        Queued jobs are dispatched into the released slots.
+
+        :param phaseIds: The IDs of the phases.
+        :type phaseIds: list of ObjectId
+        """
+        Job().collection.update_many({
+            'covalicPhaseId': {'$in': list(phaseIds)},
+            '$or': [{'covalicQueued': True}, {'covalicActive': True}]
+        }, {'$unset': {'covalicQueued': '', 'covalicActive': ''}})
+        self.dispatch()
+
+    def _reapLostJobs(self):
+        """Release the slots of dispatched jobs that were lost before or after scheduling."""
+        now = datetime.datetime.utcnow()
+
+        # The process claiming these died before scheduling them
+        Job().collection.update_many({
+            'covalicActive': True,
+            'status': JobStatus.INACTIVE,
+            'covalicDispatchedAt': {
+                '$lt': now - datetime.timedelta(seconds=SCORING_DISPATCH_TIMEOUT)}
+        }, {'$set': {'covalicQueued': True}, '$unset': {'covalicActive': ''}})
+
+        for job in Job().collection.find({
+            'covalicActive': True,
+            'status': {'$in': [JobStatus.QUEUED, JobStatus.RUNNING]},
+            'updated': {'$lt': now - datetime.timedelta(seconds=SCORING_JOB_TIMEOUT)}
+        }, projection={'log': False}):
+            # Releasing the slot first makes only one process fail the job
+            if Job().collection.update_one({
+                '_id': job['_id'], 'covalicActive': True, 'updated': job['updated']
+            }, {'$unset': {'covalicActive': ''}}).modified_count:
+                Job().updateJob(
+                    job, status=JobStatus.ERROR,
+                    log='The job was not updated for %d seconds, its worker is '
+                        'presumed lost.\n' % SCORING_JOB_TIMEOUT)
+
+    def _activeCounts(self):
+        phases = {}
+        users = {}
+        total = 0
+        for job in Job().collection.find({'covalicActive': True}, projection=[
+                'status', 'covalicPhaseId', 'userId']):
+            if job['status'] not in _UNFINISHED:
+                # The final status update was missed
+                Job().update({'_id': job['_id']}, {'$unset': {'covalicActive': ''}})
+                continue
+            phases[job['covalicPhaseId']] = phases.get(job['covalicPhaseId'], 0) + 1
+            users[job['userId']] = users.get(job['userId'], 0) + 1
+            total += 1
+        return total, phases, users
+
+    def _nextJob(self, challengeId, phases, users, phaseMax, userMax):
+        """Claim the next queued job of a challenge that is within the caps."""
+        fullPhases = [k for k, v in phases.items() if v >= phaseMax]
+        fullUsers = [k for k, v in users.items() if v >= userMax]
+        query = {
+            'covalicQueued': True,
+            'covalicChallengeId': challengeId,
+            'status': JobStatus.INACTIVE,
+            'covalicPhaseId': {'$nin': fullPhases},
+            'userId': {'$nin': fullUsers}
+        }
+        candidate = Job().collection.find_one(query, sort=[
+            ('covalicPriority', 1), ('covalicQueuedAt', 1)])
+        if candidate is None:
+            return None
+
+        # Another process may have dispatched or canceled it meanwhile
+        return Job().collection.find_one_and_update({
+            '_id': candidate['_id'],
+            'covalicQueued': True,
+            'status': JobStatus.INACTIVE
+        }, {
+            '$unset': {'covalicQueued': ''},
+            '$set': {'covalicActive': True, 'covalicDispatchedAt': datetime.datetime.utcnow()}
+        }, return_document=ReturnDocument.AFTER)
+
+    def dispatch(self):
+        """
+        Schedule queued jobs while there is capacity.
+
+        If another process is dispatching, it is asked to dispatch again once
+        it is done instead.
+
+        :returns: The number of jobs that were scheduled.
+        """
+        with self._lock:
+            if not SchedulerLease().acquire('scoring', self._owner):
+                return 0
+            count = 0
+            try:
+                rerun = True
+                while rerun:
+                    count += self._dispatch()
+                    rerun = SchedulerLease().release('scoring', self._owner)
+            except Exception:  # noqa: B902
+                SchedulerLease().drop('scoring', self._owner)
+                raise
+            return count
+
+    def _dispatch(self):
+        # Jobs canceled while queued are never dispatched
+        Job().collection.update_many(
+            {'covalicQueued': True, 'status': {'$ne': JobStatus.INACTIVE}},
+            {'$unset': {'covalicQueued': ''}})
+
+        self._reapLostJobs()
+        maxConcurrent, phaseMax, userMax = self.limits()
+        total, phases, users = self._activeCounts()
+        challengeIds = sorted(Job().collection.distinct(
+            'covalicChallengeId', {'covalicQueued': True}))
+
+        # Start the round after the challenge served last
+        if self._lastChallengeId in challengeIds:
+            start = challengeIds.index(self._lastChallengeId) + 1
+            challengeIds = challengeIds[start:] + challengeIds[:start]
+
+        count = 0
+        while challengeIds and total < maxConcurrent:
+            for challengeId in list(challengeIds):
+                if total >= maxConcurrent:
+                    break
+                job = self._nextJob(challengeId, phases, users, phaseMax, userMax)
+                if job is None:
+                    challengeIds.remove(challengeId)
+                    continue
+
+                try:
+                    self.schedule(job)
+                except Exception:  # noqa: B902
+                    Job().update({'_id': job['_id']}, {
+                        '$set': {'covalicQueued': True},
+                        '$unset': {'covalicActive': ''}
+                    })
+                    raise
+                self._lastChallengeId = challengeId
+                phases[job['covalicPhaseId']] = phases.get(job['covalicPhaseId'], 0) + 1
+                users[job['userId']] = users.get(job['userId'], 0) + 1
+                total += 1
+                count += 1
+        return count
+
+
+scoringScheduler = ScoringScheduler()
@@ -20,17 +20,53 @@
 from collections import defaultdict
 import six
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
-def computeAverageScores(score):
+
+def scoreMatrix(score):
     """
-    Compute the average score for each metric and add it to the score list under the name "Average".
+    Convert a score object into a dense (datasets x metrics) matrix.
 
-    Datasets with a score of None are omitted from the average calculation.
+    Cells for metrics that a dataset does not report, or reports as None, are
+    set to NaN in the value matrix and to False in the presence mask. A
+    separate mask is used because NaN is also a legitimate metric value.
 
-    :param score: The score object to compute the average of. The result of the
-        computation is placed at the head of the list.
+    Requires numpy.
+
+    :param score: The score object, as posted by the scoring job.
     :type score: list
+    :returns: A tuple of (metric names in sorted order, value matrix,
+        presence mask), or None if the score cannot be represented densely
+        because a dataset reports the same metric more than once.
     """
+    names = sorted({metric['name'] for dataset in score for metric in dataset['metrics']})
+    columns = {name: i for i, name in enumerate(names)}
+
+    rows = []
+    cols = []
+    cells = []
+    for row, dataset in enumerate(score):
+        for metric in dataset['metrics']:
+            if metric['value'] is not None:
+                rows.append(row)
+                cols.append(columns[metric['name']])
+                cells.append(metric['value'])
+
+    values = numpy.full((len(score), len(names)), numpy.nan)
+    present = numpy.zeros(values.shape, dtype=bool)
+    values[rows, cols] = numpy.array(cells, dtype=float)
+    present[rows, cols] = True
+
+    if numpy.count_nonzero(present) != len(cells):
+        return None
+
+    return names, values, present
+
+
+def _computeAverageScoresPython(score):
     sums = defaultdict(float)
     counts = defaultdict(int)
 
@@ -40,13 +76,81 @@ def computeAverageScores(score):
                 sums[metric['name']] += float(metric['value'])
                 counts[metric['name']] += 1
 
-    metrics = [
+    return [
         {
             'name': metricName,
             'value': sums[metricName] / float(counts[metricName])
         }
         for metricName in sorted(six.viewkeys(sums))]
 
+
+def _computeAverageScoresNumpy(score):
+    matrix = scoreMatrix(score)
+    if matrix is None:
+        return _computeAverageScoresPython(score)
+    names, values, present = matrix
+
+    # An accumulation adds the datasets strictly in order, so the sums are
+    # bitwise identical to the sequential pure-Python loop (a plain reduction
+    # may use pairwise summation). Adding 0.0 normalizes -0.0 the same way
+    # starting the Python sum from 0.0 does.
+    if len(score):
+        sums = numpy.add.accumulate(numpy.where(present, values, 0.0), axis=0)[-1] + 0.0
+    else:
+        sums = numpy.zeros(len(names))
+    counts = numpy.add.reduce(present, axis=0)
+    reported = counts > 0
+    averages = sums[reported] / counts[reported]
+
+    reportedNames = [name for name, keep in zip(names, reported.tolist()) if keep]
+    return [
+        {
+            'name': metricName,
+            'value': value
+        }
+        for metricName, value in zip(reportedNames, averages.tolist())]
+
+
+def _computeOverallScorePython(averages, metricInfo):
+    total = 0
+    for metric in averages:
+        if metric['name'] in metricInfo:
+            total += float(metric['value']) * \
+                float(metricInfo[metric['name']].get('weight', 0))
+
+    return total
+
+
+def _computeOverallScoreNumpy(averages, metricInfo):
+    weighted = [metric for metric in averages if metric['name'] in metricInfo]
+    if not weighted:
+        return 0
+
+    values = numpy.array([metric['value'] for metric in weighted], dtype=float)
+    weights = numpy.array([
+        metricInfo[metric['name']].get('weight', 0) for metric in weighted], dtype=float)
+
+    # A cumulative sum adds the products in order, matching the pure-Python loop.
+    return float(numpy.cumsum(values * weights)[-1] + 0.0)
+
+
+def computeAverageScores(score):
+    """
+    Compute the average score for each metric and add it to the score list under the name "Average".
+
+    Datasets with a score of None are omitted from the average calculation.
+    Uses the numpy engine when numpy is available, otherwise falls back to
+    pure Python; both produce identical results.
+
+    :param score: The score object to compute the average of. The result of the
+        computation is placed at the head of the list.
+    :type score: list
+    """
+    if numpy is not None:
+        metrics = _computeAverageScoresNumpy(score)
+    else:
+        metrics = _computeAverageScoresPython(score)
+
     score.insert(0, {
         'dataset': 'Average',
         'metrics': metrics
@@ -64,13 +168,9 @@ def computeOverallScore(submission, phase):
     :param submission: The submission to compute the overall score on.
     :param phase: The challenge phase that was submitted to.
     """
-    total = 0
     metricInfo = phase.get('metrics', {})
     averages = submission['score'][0]['metrics']
 
-    for metric in averages:
-        if metric['name'] in metricInfo:
-            total += float(metric['value']) * \
-                float(metricInfo[metric['name']].get('weight', 0))
-
-    return total
+    if numpy is not None:
+        return _computeOverallScoreNumpy(averages, metricInfo)
+    return _computeOverallScorePython(averages, metricInfo)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import collections
+
+from girder.models.user import User
+
+from covalic.models.challenge import Challenge
+from covalic.models.phase import Phase
+from covalic.models.stats_member import StatsMember
+
+
+def _parents(phaseId):
+    """Return the phase and challenge models and IDs whose statistics cover a phase."""
+    phase = Phase().collection.find_one({'_id': phaseId}, projection=['challengeId'])
+    parents = [(Phase(), phaseId)]
+    if phase:
+        parents.append((Challenge(), phase['challengeId']))
+    return parents
+
+
+def _increment(model, parentId, inc, extra=None):
+    # Statistics that were never computed are computed in full when read
+    update = {'$inc': inc}
+    update.update(extra or {})
+    model.update({'_id': parentId, 'stats': {'$exists': True}}, update)
+
+
+def latestSubmissionAdded(submission):
+    """
+    Count a submission that became latest in the statistics of its phase and challenge.
+
+    Only the latest submission of each participant and approach is counted,
+    so superseded submissions do not inflate the statistics.
+
+    :param submission: The submission.
+    """
+    for model, parentId in _parents(submission['phaseId']):
+        inc = {'stats.submissionCount': 1}
+        if StatsMember().increment(parentId, 'submitter', submission['creatorId']):
+            inc['stats.submitterCount'] = 1
+        _increment(model, parentId, inc, {'$max': {'stats.lastSubmission': submission['created']}})
+
+
+def latestSubmissionRemoved(submission):
+    """
+    Stop counting a formerly latest submission in the statistics of its phase and challenge.
+
+    :param submission: The submission, as it was while it was latest.
+    """
+    for model, parentId in _parents(submission['phaseId']):
+        inc = {'stats.submissionCount': -1}
+        if StatsMember().decrement(parentId, 'submitter', submission['creatorId']):
+            inc['stats.submitterCount'] = -1
+        _increment(model, parentId, inc)
+
+
+def groupsChanged(userId, added=(), removed=()):
+    """
+    Update the participant counts after a user joins or leaves groups.
+
+    :param userId: The ID of the user.
+    :type userId: ObjectId
+    :param added: The IDs of the groups the user joined.
+    :param removed: The IDs of the groups the user left.
+    """
+    for groupIds, delta in ((added, 1), (removed, -1)):
+        if not groupIds:
+            continue
+        phases = list(Phase().collection.find(
+            {'participantGroupId': {'$in': list(groupIds)}}, projection=['challengeId']))
+        if not phases:
+            continue
+
+        Phase().update({
+            '_id': {'$in': [phase['_id'] for phase in phases]},
+            'stats': {'$exists': True}
+        }, {'$inc': {'stats.participantCount': delta}})
+
+        # A challenge counts a user once per phase it participates in
+        for phase in phases:
+            if delta > 0:
+                changed = StatsMember().increment(phase['challengeId'], 'participant', userId)
+            else:
+                changed = StatsMember().decrement(phase['challengeId'], 'participant', userId)
+            if changed:
+                _increment(Challenge(), phase['challengeId'], {'stats.participantCount': delta})
+
+
+def _submissionStats(parentId, query):
+    from covalic.models.submission import Submission  # prevent circular import
+
+    query = dict(query, latest=True)
+    submitters = {row['_id']: row['count'] for row in Submission().collection.aggregate([
+        {'$match': query},
+        {'$group': {'_id': '$creatorId', 'count': {'$sum': 1}}}
+    ])}
+    StatsMember().reset(parentId, 'submitter', submitters)
+    last = Submission().collection.find_one(
+        query, projection=['created'], sort=[('created', -1)])
+    return {
+        'submissionCount': sum(submitters.values()),
+        'submitterCount': len(submitters),
+        'lastSubmission': last['created'] if last else None
+    }
+
+
+def _store(model, doc, stats):
+    model.update({'_id': doc['_id']}, {'$set': {'stats': stats}})
+    doc['stats'] = stats
+    return stats
+
+
+def getPhaseStats(phase):
+    """
+    Get the statistics of a phase, computing them if they were never computed.
+
+    :param phase: The phase.
+    :returns: A dict with the latest submission count, the number of
+        distinct submitters, the participant count and the time of the last submission.
+    """
+    if 'stats' in phase:
+        return phase['stats']
+
+    stats = _submissionStats(phase['_id'], {'phaseId': phase['_id']})
+    stats['participantCount'] = User().collection.count_documents(
+        {'groups': phase['participantGroupId']})
+    return _store(Phase(), phase, stats)
+
+
+def getChallengeStats(challenge):
+    """
+    Get the statistics of a challenge, computing them if they were never computed.
+
+    Submitters and participants of several phases of the challenge are
+    counted once.
+
+    :param challenge: The challenge.
+    :returns: A dict with the latest submission count, the number of
+        distinct submitters, the participant count and the time of the last submission.
+    """
+    if 'stats' in challenge:
+        return challenge['stats']
+
+    phases = list(Phase().collection.find(
+        {'challengeId': challenge['_id']}, projection=['participantGroupId']))
+    stats = _submissionStats(
+        challenge['_id'], {'phaseId': {'$in': [phase['_id'] for phase in phases]}})
+
+    phaseCounts = collections.Counter(phase['participantGroupId'] for phase in phases)
+    participants = {user['_id']: sum(phaseCounts[groupId] for groupId in user['groups'])
+                    for user in User().collection.find(
+                        {'groups': {'$in': list(phaseCounts)}}, projection=['groups'])}
+    StatsMember().reset(challenge['_id'], 'participant', participants)
+    stats['participantCount'] = len(participants)
+    return _store(Challenge(), challenge, stats)
+
+
+def invalidateStats(model, docId):
+    """
+    Discard the statistics of a phase or challenge, so they are computed in full when next read.
+
+    :param model: The Phase or Challenge model.
+    :param docId: The ID of the phase or challenge.
+    :type docId: ObjectId
+    """
+    model.update({'_id': docId}, {'$unset': {'stats': True}})
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import datetime
+import heapq
+import threading
+import time
+
+from girder import logger
+
+from covalic.constants import PHASE_SCHEDULE_RELOAD_INTERVAL, STATUS_SWEEP_INTERVAL, \
+    TimeframeStatus
+from covalic.models.challenge import Challenge
+from covalic.models.phase import Phase
+from covalic.utility import timeframeStatus
+from covalic.utility.cache import leaderboardCache
+
+
+def updateStatus(model, doc, now=None):
+    """
+    Update the stored timeframe status of a challenge or phase.
+
+    When a phase opens or closes, its active flag is set accordingly, as
+    :py:meth:`Phase.validate` does when a save crosses a date boundary.
+    Phases stored before the status was introduced keep their active flag.
+
+    :param model: The Challenge or Phase model.
+    :param doc: The document, with at least its dates, status and next
+        transition time as stored.
+    :param now: The current time, as a naive UTC datetime. Defaults to now.
+    :type now: datetime.datetime or None
+    :returns: The next transition time, or None if the status never changes
+        again or a concurrent update already changed it.
+    """
+    status, nextTransition = timeframeStatus(doc, now)
+    update = {'status': status, 'nextTransition': nextTransition}
+    flip = isinstance(model, Phase) and doc.get('status') not in {None, status}
+    if flip:
+        update['active'] = status == TimeframeStatus.ACTIVE
+
+    # Only one process applies a transition
+    result = model.collection.update_one({
+        '_id': doc['_id'],
+        'nextTransition': doc.get('nextTransition')
+    }, {'$set': update})
+    if not result.modified_count:
+        return None
+
+    if flip:
+        Phase().bumpVersion(doc['_id'])
+        leaderboardCache.invalidate(doc['_id'])
+    return nextTransition
+
+
+def sweepStatus(model, now=None):
+    """
+    Update the stored timeframe status of the documents whose status changed.
+
+    Documents stored before the status was introduced are updated as well.
+
+    :param model: The Challenge or Phase model.
+    :param now: The current time, as a naive UTC datetime. Defaults to now.
+    :type now: datetime.datetime or None
+    :returns: The number of updated documents.
+    """
+    now = now or datetime.datetime.utcnow()
+    count = 0
+    for doc in model.collection.find({'$or': [
+        {'nextTransition': {'$lte': now}},
+        {'status': {'$exists': False}}
+    ]}, projection=['startDate', 'endDate', 'status', 'nextTransition']):
+        updateStatus(model, doc, now)
+        count += 1
+    return count
+
+
+class PhaseActivationScheduler(object):
+    """
+    A daemon thread that opens and closes phases at their start and end dates.
+
+    Upcoming transitions are kept in a min-heap, loaded from the phases'
+    nextTransition index and extended as phases are saved. Since other server
+    processes may save phases too, the heap is reloaded periodically.
+
+    :param reloadInterval: The number of seconds between heap reloads.
+    :type reloadInterval: float
+    """
+
+    def __init__(self, reloadInterval):
+        self.reloadInterval = reloadInterval
+        self._heap = []
+        self._loaded = None
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._stop.clear()
+        self.load()
+        self._thread = threading.Thread(target=self._run, name='covalic-phase-activation')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        with self._condition:
+            self._condition.notify()
+        if self._thread:
+            self._thread.join()
+        self._thread = None
+
+    def load(self):
+        """Reload the upcoming transitions of all phases."""
+        heap = [(doc['nextTransition'], doc['_id']) for doc in Phase().collection.find(
+            {'nextTransition': {'$ne': None}}, projection=['nextTransition'])]
+        heapq.heapify(heap)
+        with self._condition:
+            self._heap = heap
+            self._loaded = time.time()
+            self._condition.notify()
+
+    def schedule(self, phase):
+        """
+        Schedule the next transition of a phase.
+
+        :param phase: The phase, as saved.
+        """
+        if phase.get('nextTransition'):
+            with self._condition:
+                heapq.heappush(self._heap, (phase['nextTransition'], phase['_id']))
+                self._condition.notify()
+
+    def _due(self):
+        with self._condition:
+            now = datetime.datetime.utcnow()
+            due = []
+            while self._heap and self._heap[0][0] <= now:
+                due.append(heapq.heappop(self._heap))
+            if not due:
+                timeout = self._loaded + self.reloadInterval - time.time()
+                if self._heap:
+                    timeout = min(timeout, (self._heap[0][0] - now).total_seconds())
+                self._condition.wait(max(timeout, 0))
+            return due
+
+    def _transition(self, phaseId, when):
+        # Entries for transitions that were rescheduled or applied are stale
+        phase = Phase().collection.find_one(
+            {'_id': phaseId, 'nextTransition': when},
+            projection=['startDate', 'endDate', 'status', 'nextTransition'])
+        if phase:
+            nextTransition = updateStatus(Phase(), phase, now=when)
+            if nextTransition:
+                with self._condition:
+                    heapq.heappush(self._heap, (nextTransition, phaseId))
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                for when, phaseId in self._due():
+                    self._transition(phaseId, when)
+                if time.time() >= self._loaded + self.reloadInterval:
+                    self.load()
+            except Exception:  # noqa: B902
+                logger.exception('Failed to update the activation of phases.')
+                self._stop.wait(self.reloadInterval)
+
+
+class StatusSweeper(object):
+    """
+    A daemon thread that periodically sweeps the timeframe status of challenges and phases.
+
+    :param interval: The number of seconds between sweeps.
+    :type interval: float
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='covalic-status-sweeper')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            for model in (Challenge(), Phase()):
+                try:
+                    sweepStatus(model)
+                except Exception:  # noqa: B902
+                    logger.exception('Failed to update the timeframe status of %s.', model.name)
+            self._stop.wait(self.interval)
+
+
+statusSweeper = StatusSweeper(STATUS_SWEEP_INTERVAL)
+phaseActivationScheduler = PhaseActivationScheduler(PHASE_SCHEDULE_RELOAD_INTERVAL)
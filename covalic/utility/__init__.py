@@ -17,20 +17,49 @@
 #  limitations under the License.
 ###############################################################################
 
+import cherrypy
+import datetime
+import hashlib
+import math
 import dateutil.parser
 import dateutil.tz
 
 from girder.constants import AccessType
 from girder.models.model_base import ValidationException
 from girder.models.collection import Collection
+from girder.models.file import File
 from girder.models.folder import Folder
+from girder.models.item import Item
 from girder.models.user import User
 
+from covalic.constants import TimeframeStatus
+
+
+def _assetsFolderAccess(challenge):
+    """Return the part of a challenge that is copied onto its Assets folder."""
+    return {'access': challenge.get('access'), 'public': challenge.get('public')}
+
+
+def _copyAssetsFolderAccess(challenge, folder):
+    """Copy the challenge ACL onto its Assets folder and record what was copied."""
+    from covalic.models.challenge import Challenge  # prevent circular import
+    Folder().copyAccessPolicies(challenge, folder, save=True)
+    state = {
+        'assetsFolderId': folder['_id'],
+        'assetsFolderAccess': _assetsFolderAccess(challenge)
+    }
+    Challenge().update({'_id': challenge['_id']}, {'$set': state})
+    challenge.update(state)
+
 
 def getAssetsFolder(challenge, user, testAccess=True):
     """
     Get the Assets folder for a given challenge, creating one if it does not already exist.
 
+    The folder ID is stored on the challenge, so the folder is only looked up
+    by name when it is first needed or after it was deleted. A newly created
+    folder gets the access policies of the challenge.
+
     Ensures the specified user has read access on the folder if it already exists.
 
     :param challenge: The challenge.
@@ -42,17 +71,23 @@ def getAssetsFolder(challenge, user, testAccess=True):
     :type testAccess: bool
     :returns: The assets folder.
     """
-    collection = Collection().load(
-        challenge['collectionId'], force=True)
+    folder = None
+    if challenge.get('assetsFolderId'):
+        folder = Folder().load(challenge['assetsFolderId'], force=True)
 
-    if user is None and challenge['creatorId']:
-        user = User().load(
-            challenge['creatorId'], force=True)
+    if folder is None:
+        collection = Collection().load(
+            challenge['collectionId'], force=True)
 
-    folder = Folder().createFolder(
-        parentType='collection', parent=collection,
-        name='Assets', creator=user, reuseExisting=True,
-        description='Assets related to this challenge.')
+        if user is None and challenge['creatorId']:
+            user = User().load(
+                challenge['creatorId'], force=True)
+
+        folder = Folder().createFolder(
+            parentType='collection', parent=collection,
+            name='Assets', creator=user, reuseExisting=True,
+            description='Assets related to this challenge.')
+        _copyAssetsFolderAccess(challenge, folder)
 
     if testAccess:
         Folder().requireAccess(folder, user=user, level=AccessType.READ)
@@ -60,6 +95,87 @@ def getAssetsFolder(challenge, user, testAccess=True):
     return folder
 
 
+def syncAssetsFolderAccess(challenge, user=None):
+    """
+    Make the Assets folder of a challenge track the access policies of the challenge.
+
+    Nothing is done unless the challenge ``access`` or ``public`` fields
+    changed since they were last copied onto the folder.
+
+    :param challenge: The challenge.
+    :type challenge: dict
+    :param user: The user to create the folder as, if it does not exist.
+    :type user: dict or None
+    """
+    if challenge.get('assetsFolderId') and \
+            challenge.get('assetsFolderAccess') == _assetsFolderAccess(challenge):
+        return
+
+    folder = getAssetsFolder(challenge, user, False)
+    if challenge.get('assetsFolderAccess') != _assetsFolderAccess(challenge):
+        _copyAssetsFolderAccess(challenge, folder)
+
+
+def accessQuery(user, level=AccessType.READ):
+    """
+    Build a query clause matching the documents a user has access to.
+
+    The clause can be combined with other query clauses, so that access
+    control is applied by the database instead of by filtering results.
+
+    :param user: The user, or None for anonymous access.
+    :type user: dict or None
+    :param level: The required access level.
+    :type level: AccessType
+    :returns: The query clause, or None if the user has access to every document.
+    """
+    if user and user.get('admin'):
+        return None
+
+    clauses = []
+    if level <= AccessType.READ:
+        clauses.append({'public': True})
+    if user:
+        clauses.append({'access.users': {'$elemMatch': {
+            'id': user['_id'], 'level': {'$gte': level}}}})
+        if user.get('groups'):
+            clauses.append({'access.groups': {'$elemMatch': {
+                'id': {'$in': user['groups']}, 'level': {'$gte': level}}}})
+    return {'$or': clauses} if clauses else {'_id': {'$exists': False}}
+
+
+def folderContentHash(folder):
+    """
+    Compute a hash of the files in a folder and its subfolders.
+
+    Files are identified by their path in the folder, their size and their
+    SHA-512 checksum when it is known. Files without a checksum fall back to
+    their ID, which Girder does not reuse for new content.
+
+    :param folder: The folder.
+    :type folder: dict
+    :returns: The hexadecimal SHA-256 digest.
+    """
+    entries = []
+    folders = [(folder['_id'], '')]
+    while folders:
+        folderId, path = folders.pop()
+        items = {item['_id']: path + item['name'] for item in Item().find(
+            {'folderId': folderId}, fields=['name'])}
+        for file in File().find({'itemId': {'$in': list(items)}}, fields=[
+                'itemId', 'name', 'size', 'sha512', 'linkUrl']):
+            entries.append('%s/%s\t%s\t%s' % (
+                items[file['itemId']], file['name'], file.get('size'),
+                file.get('sha512') or file.get('linkUrl') or file['_id']))
+        folders.extend((child['_id'], path + child['name'] + '/') for child in Folder().find(
+            {'parentId': folderId, 'parentCollection': 'folder'}, fields=['name']))
+
+    digest = hashlib.sha256()
+    for entry in sorted(entries):
+        digest.update(entry.encode('utf8') + b'\n')
+    return digest.hexdigest()
+
+
 def validateDate(date, field):
     """Convert datetime objects or ISO 8601-formatted strings to datetime objects in UTC."""
     date = str(date).strip()
@@ -70,3 +186,109 @@ def validateDate(date, field):
     except ValueError:
         raise ValidationException('Invalid date format.', field=field)
     return date
+
+
+def _utcNaive(date):
+    if date.tzinfo is not None:
+        date = date.astimezone(dateutil.tz.tzutc()).replace(tzinfo=None)
+    # Match the millisecond precision of dates stored in MongoDB
+    return date.replace(microsecond=date.microsecond // 1000 * 1000)
+
+
+def timeframeStatus(doc, now=None):
+    """
+    Compute the timeframe status of a challenge or phase from its dates.
+
+    Documents without a start date have started, and documents without an
+    end date never close.
+
+    :param doc: The challenge or phase document.
+    :type doc: dict
+    :param now: The current time, as a naive UTC datetime. Defaults to now.
+    :type now: datetime.datetime or None
+    :returns: A tuple of the status, a value of
+        :py:class:`covalic.constants.TimeframeStatus`, and the naive UTC time
+        at which it next changes, or None if it never changes.
+    """
+    now = now or datetime.datetime.utcnow()
+    startDate = _utcNaive(doc['startDate']) if doc.get('startDate') else None
+    endDate = _utcNaive(doc['endDate']) if doc.get('endDate') else None
+
+    if startDate and startDate > now:
+        return TimeframeStatus.UPCOMING, startDate
+    if endDate and endDate <= now:
+        return TimeframeStatus.CLOSED, None
+    return TimeframeStatus.ACTIVE, endDate
+
+
+def submissionsOpen(phase, now=None):
+    """
+    Check whether a phase accepts submissions from participants.
+
+    This is the active flag of the phase, which opens and closes with its
+    dates and which admins may set to open a phase early or to reopen it.
+    While a transition of its dates is due but not applied yet, the dates
+    decide instead, so submissions are refused from the exact end date.
+
+    :param phase: The phase document.
+    :type phase: dict
+    :param now: The current time, as a naive UTC datetime. Defaults to now.
+    :type now: datetime.datetime or None
+    :returns: Whether the phase accepts submissions.
+    """
+    status = timeframeStatus(phase, now)[0]
+    if phase.get('status') not in {None, status}:
+        return status == TimeframeStatus.ACTIVE
+    return bool(phase.get('active'))
+
+
+def filterScore(submission, hidden):
+    """
+    Remove or sanitize the score fields of a submission document.
+
+    :param submission: The submission document, which is modified in place.
+    :type submission: dict
+    :param hidden: Whether the scores are hidden from the caller. If so, the
+        score fields are removed. Otherwise, any NaN or Infinity score values
+        are coerced to corresponding strings so they can be JSON encoded.
+    :type hidden: bool
+    :returns: The submission document.
+    """
+    if hidden:
+        for field in ('score', 'overallScore', 'rank', 'approachRank'):
+            submission.pop(field, None)
+    else:
+        # coerce any nans or infs to strings
+        for dataset in (submission.get('score') or ()):
+            for metric in dataset['metrics']:
+                if metric['value'] is not None:
+                    v = float(metric['value'])
+                    if math.isnan(v) or math.isinf(v):
+                        metric['value'] = str(v)
+        v = submission.get('overallScore') or 0
+        if math.isnan(v) or math.isinf(v):
+            submission['overallScore'] = str(v)
+
+    return submission
+
+
+def checkETag(*parts):
+    """
+    Set an ETag on the current response, and respond 304 Not Modified if the client has it.
+
+    The ETag is built from the given parts, which should together identify
+    the representation being returned, e.g. a version stamp and the caller's
+    access level.
+
+    :raises cherrypy.HTTPRedirect: With status 304 if the request's
+        If-None-Match header matches the ETag.
+    """
+    etag = '"%s"' % '-'.join(str(part) for part in parts)
+    cherrypy.response.headers['ETag'] = etag
+
+    ifNoneMatch = cherrypy.request.headers.get('If-None-Match')
+    if ifNoneMatch:
+        tags = [tag.strip() for tag in ifNoneMatch.split(',')]
+        tags = [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+        if '*' in tags or etag in tags:
+            raise cherrypy.HTTPRedirect([], 304)
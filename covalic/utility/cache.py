@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+
+import collections
+import threading
+import time
+
+from covalic.constants import LEADERBOARD_CACHE_SIZE, LEADERBOARD_CACHE_TTL, \
+    USER_EMAIL_CACHE_SIZE, USER_EMAIL_CACHE_TTL
+
+
+class LRUCache(object):
+    """
+    A thread-safe, process-local LRU cache with a per-entry time to live.
+
+    Keys must be tuples whose first element identifies the phase the entry
+    was computed from, so that all entries of a phase can be invalidated
+    together.
+
+    :param maxSize: The maximum number of entries to keep.
+    :type maxSize: int
+    :param ttl: The number of seconds an entry remains valid.
+    :type ttl: float
+    """
+
+    def __init__(self, maxSize, ttl):
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value for a key, or None if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > time.time():
+                    self._entries.pop(key)
+                    self._entries[key] = entry
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self.ttl, value)
+            while len(self._entries) > self.maxSize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, phaseId=None):
+        """
+        Remove the entries of a phase, or all entries if no phase is given.
+
+        :param phaseId: The phase ID.
+        :type phaseId: ObjectId or None
+        """
+        with self._lock:
+            if phaseId is None:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if key[0] == phaseId]:
+                    del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxSize': self.maxSize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+# Rendered pages of GET /covalic_submission
+leaderboardCache = LRUCache(LEADERBOARD_CACHE_SIZE, LEADERBOARD_CACHE_TTL)
+
+# Email addresses of the users on phase and challenge access lists
+userEmailCache = LRUCache(USER_EMAIL_CACHE_SIZE, USER_EMAIL_CACHE_TTL)
@@ -20,29 +20,39 @@
 from girder.models.user import User
 
 from covalic.models.challenge import Challenge
-from covalic.models.phase import Phase
+from covalic.utility.cache import userEmailCache
 
 
-def _getUser(userId):
-    """Get a user document from a user ID."""
-    user = User().load(userId, force=True)
-    return user
+def _accessHash(doc):
+    """Summarize the user access list of a document as a hashable value."""
+    return tuple(sorted(
+        (user['id'], user['level']) for user in doc.get('access', {}).get('users', ())))
 
 
-def _getUsers(acl, accessLevel):
+def _getUserEmails(docs, accessLevel):
     """
-    Return a list of the users at or above the access level in the access list.
+    Return the email addresses of the users at or above the access level on any of the documents.
 
-    :param acl: an access list such as that returned by
-        AccessControlledModel.getFullAccessList()
-    :type acl: dict
+    All users are resolved with a single query, and the result is cached
+    briefly for the same access lists, so that a burst of notifications does
+    not repeat identical lookups.
+
+    :param docs: access controlled documents, such as a phase and its challenge
+    :type docs: list of dict
     :param accessLevel: the minimum access level
     :type accessLevel: girder.AccessType
     """
-    users = [_getUser(user['id']) for user
-             in acl.get('users', None)
-             if user['level'] >= accessLevel]
-    return users
+    key = (docs[0]['_id'], accessLevel) + tuple((doc['_id'], _accessHash(doc)) for doc in docs)
+    emails = userEmailCache.get(key)
+    if emails is None:
+        userIds = {
+            user['id'] for doc in docs
+            for user in doc.get('access', {}).get('users', ())
+            if user['level'] >= accessLevel}
+        emails = sorted({user['email'] for user in User().find(
+            {'_id': {'$in': list(userIds)}}, fields=['email'])})
+        userEmailCache.set(key, emails)
+    return list(emails)
 
 
 def getChallengeUserEmails(challenge, accessLevel):
@@ -54,10 +64,7 @@ def getChallengeUserEmails(challenge, accessLevel):
     :param accessLevel: the minimum access level
     :type accessLevel: girder.AccessType
     """
-    acl = Challenge().getFullAccessList(challenge)
-    users = _getUsers(acl, accessLevel)
-    emails = [user['email'] for user in users]
-    return emails
+    return _getUserEmails([challenge], accessLevel)
 
 
 def getPhaseUserEmails(phase, accessLevel, includeChallengeUsers=True):
@@ -72,14 +79,9 @@ def getPhaseUserEmails(phase, accessLevel, includeChallengeUsers=True):
         users with on the phase's challenge. Duplicates are removed.
     :type includeChallengeUsers: bool
     """
-    acl = Phase().getFullAccessList(phase)
-    users = _getUsers(acl, accessLevel)
-    emails = [user['email'] for user in users]
-
+    docs = [phase]
     if includeChallengeUsers:
-        challenge = Challenge().load(
-            phase['challengeId'], force=True)
-        emails.extend(getChallengeUserEmails(challenge, accessLevel))
-        emails = list(set(emails))
+        docs.append(Challenge().load(
+            phase['challengeId'], force=True))
 
-    return emails
+    return _getUserEmails(docs, accessLevel)
@@ -5,10 +5,11 @@ import { restRequest } from '@girder/core/rest';
 var PhaseModel = AccessControlledModel.extend({
     resourceName: 'challenge_phase',
 
-    fetchGroundtruthItems: function () {
+    fetchGroundtruthItems: function (params) {
         restRequest({
             url: `${this.resourceName}/${this.id}/groundtruth/item`,
-            method: 'GET'
+            method: 'GET',
+            data: params
         }).done((resp) => {
             this.set('groundtruthItems', resp);
             this.trigger('c:groundtruthItemsFetched', resp);
@@ -17,6 +18,20 @@ var PhaseModel = AccessControlledModel.extend({
         });
     },
 
+    /**
+     * Check the names of files to submit against the ground truth, without
+     * downloading the list of ground truth items.
+     */
+    validateSubmissionNames: function (names) {
+        return restRequest({
+            url: `${this.resourceName}/${this.id}/groundtruth/validate`,
+            method: 'POST',
+            data: {names: JSON.stringify(names)}
+        }).fail((err) => {
+            this.trigger('c:error', err);
+        });
+    },
+
     fetchTestDataItems: function (params) {
         var items = new ItemCollection();
         items.altUrl = `${this.resourceName}/${this.id}/test_data/item`;
@@ -4,9 +4,10 @@ import { AccessType } from '@girder/core/constants';
 import { confirm } from '@girder/core/dialog';
 import events from '@girder/core/events';
 import { renderMarkdown } from '@girder/core/misc';
-import { cancelRestRequests } from '@girder/core/rest';
+import { cancelRestRequests, restRequest } from '@girder/core/rest';
 
 import router from '../../router';
+import waitForJob from '../../waitForJob';
 import View from '../view';
 import ChallengeModel from '../../models/ChallengeModel';
 import ChallengePhasesWidget from '../widgets/ChallengePhasesWidget';
@@ -37,7 +38,12 @@ var ChallengeView = View.extend({
                 yesText: 'Delete',
                 escapedHtml: true,
                 confirmCallback: () => {
-                    this.model.once('g:deleted', function () {
+                    // The challenge is deleted by a background job
+                    restRequest({
+                        url: `challenge/${this.model.id}`,
+                        method: 'DELETE',
+                        data: { progress: true }
+                    }).then((job) => waitForJob(job._id)).done(() => {
                         events.trigger('g:alert', {
                             icon: 'ok',
                             text: 'Challenge deleted.',
@@ -45,8 +51,13 @@ var ChallengeView = View.extend({
                             timeout: 4000
                         });
                         router.navigate('challenges', { trigger: true });
-                    }).destroy({
-                        progress: true
+                    }).fail(() => {
+                        events.trigger('g:alert', {
+                            icon: 'cancel',
+                            text: 'The challenge could not be deleted.',
+                            type: 'danger',
+                            timeout: 4000
+                        });
                     });
                 }
             });
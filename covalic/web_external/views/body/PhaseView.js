@@ -10,6 +10,7 @@ import FolderModel from '@girder/core/models/FolderModel';
 import ItemModel from '@girder/core/models/ItemModel';
 
 import router from '../../router';
+import waitForJob from '../../waitForJob';
 import View from '../view';
 import ChallengeModel from '../../models/ChallengeModel';
 import EditPhaseWidget from '../widgets/EditPhaseWidget';
@@ -69,7 +70,12 @@ var PhaseView = View.extend({
                 yesText: 'Delete',
                 escapedHtml: true,
                 confirmCallback: () => {
-                    this.model.once('g:deleted', function () {
+                    // The phase is deleted by a background job
+                    restRequest({
+                        url: `challenge_phase/${this.model.id}`,
+                        method: 'DELETE',
+                        data: { progress: true }
+                    }).then((job) => waitForJob(job._id)).done(() => {
                         events.trigger('g:alert', {
                             icon: 'ok',
                             text: 'Phase deleted.',
@@ -80,8 +86,13 @@ var PhaseView = View.extend({
                             'challenge/' + this.model.get('challengeId'), {
                                 trigger: true
                             });
-                    }, this).destroy({
-                        progress: true
+                    }).fail(() => {
+                        events.trigger('g:alert', {
+                            icon: 'cancel',
+                            text: 'The phase could not be deleted.',
+                            type: 'danger',
+                            timeout: 4000
+                        });
                     });
                 }
             });
@@ -125,7 +136,7 @@ var PhaseView = View.extend({
                     }
                     this.$('.c-download-ground-truth').removeClass('hide')
                         .attr('href', downloadUrl);
-                }, this).fetchGroundtruthItems();
+                }, this).fetchGroundtruthItems({limit: 2});
             }, this).fetch({
                 ignoreError: true
             });
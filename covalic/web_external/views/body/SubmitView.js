@@ -42,7 +42,6 @@ var SubmitView = View.extend({
 
     initialize: function (settings) {
         this.phase = settings.phase;
-        this.phase.fetchGroundtruthItems();
 
         this.hasFiles = false;
         this.filesCorrect = false;
@@ -136,51 +135,37 @@ var SubmitView = View.extend({
      * Called when the user selects or drops files to be uploaded.
      */
     filesSelected: function (files) {
-        var transformName = function (f) {
-            var dotPos = _.indexOf(f.name, '.');
-            if (dotPos === -1) {
-                return f.name;
-            } else {
-                return f.name.substr(0, dotPos);
-            }
-        };
-
-        var matchInfo = this._matchInput(
-            _.map(files, transformName),
-            _.map(this.phase.get('groundtruthItems'), transformName)
-        );
-
-        var matchSubmissions = this.phase.get('matchSubmissions');
-        if (_.isUndefined(matchSubmissions)) {
-            matchSubmissions = true;
-        }
-
-        matchInfo.ok = !matchSubmissions ||
-                       (_.isEmpty(matchInfo.unmatchedGroundtruths) &&
-                        _.isEmpty(matchInfo.unmatchedInputs));
+        this.hasFiles = true;
+        this.filesCorrect = false;
+        this.validateInputs();
 
-        this.$('.c-submission-mismatch-container').html(mismatchTemplate({
-            matchInfo
-        }));
+        // The names are matched on the server, which holds the ground truth listing
+        var request = this.phase.validateSubmissionNames(_.pluck(files, 'name'));
+        this.matchRequest = request;
+        request.done((matchInfo) => {
+            if (request !== this.matchRequest) {
+                // The user selected other files meanwhile
+                return;
+            }
+            var matchSubmissions = this.phase.get('matchSubmissions');
+            if (_.isUndefined(matchSubmissions)) {
+                matchSubmissions = true;
+            }
+            matchInfo.ok = !matchSubmissions || matchInfo.ok;
 
-        this.hasFiles = true;
-        this.filesCorrect = matchInfo.ok;
+            this.$('.c-submission-mismatch-container').html(mismatchTemplate({
+                matchInfo
+            }));
 
-        this.validateInputs();
+            this.filesCorrect = matchInfo.ok;
+            this.validateInputs();
+        });
     },
 
     _updateApproach: function () {
         this.approach = this.$('.c-submission-approach-input').val().trim();
     },
 
-    _matchInput: function (inputs, groundtruths) {
-        return {
-            unmatchedGroundtruths: _.difference(groundtruths, inputs),
-            unmatchedInputs: _.difference(inputs, groundtruths),
-            matched: _.intersection(inputs, groundtruths)
-        };
-    },
-
     /**
      * When "start upload" is clicked, we want to make a folder in the user's
      * personal space for the submission contents, so we do that and then proceed
@@ -0,0 +1,34 @@
+import $ from 'jquery';
+import JobModel from '@girder/jobs/models/JobModel';
+import JobStatus from '@girder/jobs/JobStatus';
+
+// Time in ms between polling for job updates.
+const jobPollingDelay = 1000;
+
+/**
+ * Wait for a job to finish.
+ *
+ * @param {string} jobId The ID of the job.
+ * @returns {Promise} Resolved with the job model when the job succeeds, or
+ *     rejected with it when the job fails or is canceled.
+ */
+export default function (jobId) {
+    const job = new JobModel({ _id: jobId });
+    const deferred = $.Deferred();
+
+    const poll = () => {
+        job.fetch({ ignoreError: true }).done(() => {
+            const status = job.get('status');
+            if (status === JobStatus.SUCCESS) {
+                deferred.resolve(job);
+            } else if (status === JobStatus.ERROR || status === JobStatus.CANCELED) {
+                deferred.reject(job);
+            } else {
+                window.setTimeout(poll, jobPollingDelay);
+            }
+        }).fail(() => deferred.reject(job));
+    };
+    poll();
+
+    return deferred.promise();
+}
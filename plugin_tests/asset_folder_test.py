@@ -17,6 +17,8 @@
 #  limitations under the License.
 ###############################################################################
 
+import mock
+
 from girder.constants import AccessType
 from girder.models.folder import Folder
 from girder.models.group import Group
@@ -78,3 +80,49 @@ class AssetFolderTestCase(base.TestCase):
                 'level': AccessType.WRITE
             }]
         })
+
+    def testAssetFolderCached(self):
+        admin = User().createUser(
+            email='admin@email.com', login='admin', firstName='Admin',
+            lastName='Admin', password='passwd')
+        challenge = Challenge().createChallenge(
+            name='challenge 1', creator=admin, public=False)
+
+        # The folder ID is stored on the challenge when it is created
+        challenge = Challenge().load(challenge['_id'], force=True)
+        folderId = challenge['assetsFolderId']
+
+        with mock.patch.object(Folder, 'createFolder') as createFolder, \
+                mock.patch.object(Folder, 'copyAccessPolicies') as copyAccessPolicies:
+            resp = self.request('/challenge/%s/assets_folder' % challenge['_id'],
+                                method='GET', user=admin)
+            self.assertStatusOk(resp)
+            self.assertEqual(resp.json['_id'], str(folderId))
+
+            # Saves that do not change the access policies do not touch the folder
+            challenge['description'] = 'A new description'
+            challenge = Challenge().save(challenge)
+            self.assertEqual(createFolder.call_count, 0)
+            self.assertEqual(copyAccessPolicies.call_count, 0)
+
+        # Making the challenge public makes the folder public
+        challenge['public'] = True
+        challenge = Challenge().save(challenge)
+        self.assertTrue(Folder().load(folderId, force=True)['public'])
+
+        # A stale copy of the challenge does not drop the folder ID
+        stale = dict(challenge)
+        del stale['assetsFolderId']
+        Challenge().save(stale)
+        self.assertEqual(Challenge().load(challenge['_id'], force=True)['assetsFolderId'],
+                         folderId)
+
+        # A deleted folder is created again
+        Folder().remove(Folder().load(folderId, force=True))
+        resp = self.request('/challenge/%s/assets_folder' % challenge['_id'],
+                            method='GET', user=admin)
+        self.assertStatusOk(resp)
+        self.assertNotEqual(resp.json['_id'], str(folderId))
+        self.assertTrue(resp.json['public'])
+        self.assertEqual(Challenge().load(challenge['_id'], force=True)['assetsFolderId'],
+                         Folder().load(resp.json['_id'], force=True)['_id'])
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+
+import mock
+import unittest
+
+from covalic.utility.cache import LRUCache
+
+
+class LRUCacheTestCase(unittest.TestCase):
+    def testSizeEviction(self):
+        cache = LRUCache(maxSize=2, ttl=60)
+        cache.set(('a', 1), 'a1')
+        cache.set(('a', 2), 'a2')
+        self.assertEqual(cache.get(('a', 1)), 'a1')
+
+        # ('a', 2) is now the least recently used entry
+        cache.set(('b', 1), 'b1')
+        self.assertIsNone(cache.get(('a', 2)))
+        self.assertEqual(cache.get(('a', 1)), 'a1')
+        self.assertEqual(cache.get(('b', 1)), 'b1')
+        stats = cache.stats()
+        self.assertEqual(stats['size'], 2)
+        self.assertEqual(stats['hits'], 3)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['evictions'], 1)
+
+    def testTtlEviction(self):
+        cache = LRUCache(maxSize=2, ttl=10)
+        with mock.patch('time.time', return_value=1000):
+            cache.set(('a', 1), 'a1')
+        with mock.patch('time.time', return_value=1009):
+            self.assertEqual(cache.get(('a', 1)), 'a1')
+        with mock.patch('time.time', return_value=1010):
+            self.assertIsNone(cache.get(('a', 1)))
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def testInvalidate(self):
+        cache = LRUCache(maxSize=10, ttl=60)
+        cache.set(('a', 1), 'a1')
+        cache.set(('a', 2), 'a2')
+        cache.set(('b', 1), 'b1')
+
+        cache.invalidate('a')
+        self.assertIsNone(cache.get(('a', 1)))
+        self.assertIsNone(cache.get(('a', 2)))
+        self.assertEqual(cache.get(('b', 1)), 'b1')
+
+        cache.invalidate()
+        self.assertIsNone(cache.get(('b', 1)))
@@ -20,11 +20,19 @@
 import datetime
 import dateutil.parser
 import dateutil.tz
+import mock
 
+from girder.constants import AccessType
+from girder.models.folder import Folder
 from girder.models.user import User
+from girder_jobs.constants import JobStatus
+from girder_jobs.models.job import Job
 from tests import base
 
+from covalic import jobs
 from covalic.models.challenge import Challenge
+from covalic.models.phase import Phase
+from covalic.models.submission import Submission
 
 
 def setUpModule():
@@ -174,6 +182,37 @@ class ChallengeTestCase(base.TestCase):
         self.assertStatusOk(resp)
         self.assertEqual(len(resp.json), 2)
 
+    def testListChallengesAccess(self):
+        other = User().createUser(
+            email='other@email.com', login='otherlogin', firstName='First',
+            lastName='Last', password='otherpassword', admin=False)
+        for i in range(4):
+            Challenge().createChallenge(
+                name='private %d' % i, creator=self.user, public=False)
+        for i in range(3):
+            Challenge().createChallenge(
+                name='public %d' % i, creator=self.user, public=True)
+        shared = Challenge().createChallenge(
+            name='shared', creator=self.user, public=False)
+        Challenge().setUserAccess(shared, other, level=AccessType.READ, save=True)
+
+        # Paging is applied to the challenges the user can read
+        resp = self.request(path='/challenge', user=other, params={'limit': 2, 'offset': 1})
+        self.assertStatusOk(resp)
+        self.assertEqual([c['name'] for c in resp.json], ['public 1', 'public 2'])
+
+        resp = self.request(path='/challenge', user=other, params={'offset': 3})
+        self.assertStatusOk(resp)
+        self.assertEqual([c['name'] for c in resp.json], ['shared'])
+
+        resp = self.request(path='/challenge')
+        self.assertStatusOk(resp)
+        self.assertEqual(len(resp.json), 3)
+
+        resp = self.request(path='/challenge', user=self.user)
+        self.assertStatusOk(resp)
+        self.assertEqual(len(resp.json), 8)
+
     def testGetChallenge(self):
         challenge = Challenge().createChallenge(
             name='challenge 1',
@@ -258,10 +297,48 @@ class ChallengeTestCase(base.TestCase):
     def testChallengeDeletion(self):
         challenge = Challenge().createChallenge(
             name='challenge', creator=self.user)
-
-        resp = self.request(path='/challenge/%s' % challenge['_id'],
-                            method='DELETE', user=self.user)
-        self.assertStatusOk(resp)
+        phases = [
+            Phase().createPhase('phase %d' % i, challenge, creator=self.user, ordinal=i)
+            for i in (1, 2)]
+        folder = Folder().createFolder(
+            self.user, 'submission', parentType='user', creator=self.user)
+        submission = Submission().createSubmission(
+            self.user, phases[0], folder, title='submission')
+
+        with mock.patch.object(Job, 'scheduleJob'):
+            resp = self.request(path='/challenge/%s' % challenge['_id'],
+                                method='DELETE', user=self.user)
+            self.assertStatusOk(resp)
+            self.assertEqual(resp.json['type'], 'covalic_delete')
+
+            # The challenge is removed by the deletion job
+            job = Job().load(resp.json['_id'], force=True)
+            jobs.cascadeDelete(job)
+
+        job = Job().load(job['_id'], force=True)
+        self.assertEqual(job['status'], JobStatus.SUCCESS)
+        self.assertEqual(job['progress']['current'], 4)
+        self.assertIsNone(Challenge().load(challenge['_id'], force=True))
+        for phase in phases:
+            self.assertIsNone(Phase().load(phase['_id'], force=True))
+        self.assertIsNone(Submission().load(submission['_id']))
+        self.assertIsNone(Folder().load(folder['_id'], force=True))
+
+    def testChallengeSubtreeCount(self):
+        challenge = Challenge().createChallenge(
+            name='challenge', creator=self.user)
+        self.assertEqual(Challenge().subtreeCount(challenge), 1)
+
+        phase1 = Phase().createPhase('phase 1', challenge, creator=self.user, ordinal=1)
+        phase2 = Phase().createPhase('phase 2', challenge, creator=self.user, ordinal=2)
+        for phase in (phase1, phase1, phase2):
+            folder = Folder().createFolder(
+                self.user, 'submission', parentType='user', creator=self.user,
+                allowRename=True)
+            Submission().createSubmission(self.user, phase, folder, title='submission')
+
+        self.assertEqual(Phase().subtreeCount(phase1), 3)
+        self.assertEqual(Challenge().subtreeCount(challenge), 6)
 
     def testChallengeDeletionInvalid(self):
         resp = self.request(path='/challenge/1', method='DELETE', user=self.user)
@@ -19,10 +19,14 @@
 
 import datetime
 
+from girder.models.folder import Folder
 from girder.models.user import User
 from tests import base
 
 from covalic.models.challenge import Challenge
+from covalic.models.phase import Phase
+from covalic.timeframe import PhaseActivationScheduler, sweepStatus
+from covalic.utility import submissionsOpen
 
 
 def setUpModule():
@@ -163,3 +167,104 @@ class ChallengeTimeframeTestCase(base.TestCase):
         self.assertEqual(resp.json[0]['name'], 'both, in future')
         self.assertEqual(resp.json[1]['name'], 'only start, in future (empty)')
         self.assertEqual(resp.json[2]['name'], 'only start, in future (null)')
+
+    def testSweepStatus(self):
+        challenge = Challenge().findOne({'name': 'both, in future'})
+        self.assertEqual(challenge['status'], 'upcoming')
+
+        # Nothing is due now
+        self.assertEqual(sweepStatus(Challenge()), 0)
+
+        # The status follows the dates as time passes
+        later = challenge['nextTransition'] + datetime.timedelta(seconds=1)
+        self.assertEqual(sweepStatus(Challenge(), now=later), 6)
+        challenge = Challenge().load(challenge['_id'], force=True)
+        self.assertEqual(challenge['status'], 'active')
+        self.assertEqual(challenge['nextTransition'], challenge['endDate'])
+
+        later = challenge['nextTransition'] + datetime.timedelta(seconds=1)
+        sweepStatus(Challenge(), now=later)
+        challenge = Challenge().load(challenge['_id'], force=True)
+        self.assertEqual(challenge['status'], 'closed')
+        self.assertIsNone(challenge['nextTransition'])
+
+    def testPhaseActivation(self):
+        challenge = Challenge().findOne({'name': 'both, active'})
+        now = datetime.datetime.utcnow()
+        phase = Phase().createPhase(
+            'phase', challenge, creator=self.user, ordinal=1,
+            startDate=now + datetime.timedelta(1), endDate=now + datetime.timedelta(2))
+        self.assertEqual(phase['status'], 'upcoming')
+        self.assertFalse(phase['active'])
+
+        scheduler = PhaseActivationScheduler(300)
+        scheduler.load()
+        self.assertIn((phase['nextTransition'], phase['_id']), scheduler._heap)
+
+        # The phase opens at its start date
+        startDate = phase['nextTransition']
+        scheduler._transition(phase['_id'], startDate)
+        phase = Phase().load(phase['_id'], force=True)
+        self.assertEqual(phase['status'], 'active')
+        self.assertTrue(phase['active'])
+        self.assertEqual(phase['nextTransition'], phase['endDate'])
+
+        # Stale entries are ignored
+        scheduler._transition(phase['_id'], startDate)
+        self.assertEqual(Phase().load(phase['_id'], force=True)['status'], 'active')
+
+        # The phase closes at its end date
+        scheduler._transition(phase['_id'], phase['nextTransition'])
+        phase = Phase().load(phase['_id'], force=True)
+        self.assertEqual(phase['status'], 'closed')
+        self.assertFalse(phase['active'])
+
+    def testLateSubmission(self):
+        challenge = Challenge().findOne({'name': 'both, active'})
+        now = datetime.datetime.utcnow()
+        phase = Phase().createPhase(
+            'phase', challenge, creator=self.user, ordinal=1, active=True,
+            startDate=now - datetime.timedelta(2), endDate=now + datetime.timedelta(1))
+        folder = Folder().createFolder(
+            self.user, 'submission', parentType='user', creator=self.user)
+
+        # Submissions are refused after the end date, even before the phase is closed
+        Phase().update({'_id': phase['_id']}, {'$set': {
+            'endDate': now - datetime.timedelta(1)}})
+        phase = Phase().load(phase['_id'], force=True)
+        self.assertEqual(phase['status'], 'active')
+        self.assertFalse(submissionsOpen(phase))
+        resp = self.request(
+            path='/covalic_submission', method='POST', user=self.user,
+            params={'phaseId': phase['_id'], 'folderId': folder['_id'], 'title': 'late'})
+        self.assertStatus(resp, 400)
+
+        # A save that crosses the end date closes the phase
+        phase = Phase().save(phase)
+        self.assertEqual(phase['status'], 'closed')
+        self.assertFalse(phase['active'])
+
+        # Admins may reopen a closed phase
+        phase['active'] = True
+        phase = Phase().save(phase)
+        self.assertTrue(Phase().load(phase['_id'], force=True)['active'])
+        self.assertTrue(submissionsOpen(phase))
+
+    def testPhaseDatesMoved(self):
+        challenge = Challenge().findOne({'name': 'both, active'})
+        now = datetime.datetime.utcnow()
+        phase = Phase().createPhase(
+            'phase', challenge, creator=self.user, ordinal=1,
+            startDate=now + datetime.timedelta(1), endDate=now + datetime.timedelta(2))
+        self.assertFalse(phase['active'])
+
+        # Moving the start date into the past opens the phase
+        phase['startDate'] = now - datetime.timedelta(1)
+        phase = Phase().save(phase)
+        self.assertEqual(phase['status'], 'active')
+        self.assertTrue(phase['active'])
+
+        # Admins may close an open phase early
+        phase['active'] = False
+        Phase().save(phase)
+        self.assertFalse(submissionsOpen(Phase().load(phase['_id'], force=True)))
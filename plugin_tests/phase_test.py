@@ -20,19 +20,30 @@
 import datetime
 import dateutil.parser
 import dateutil.tz
+import io
 import json
 import mock
 
 from girder.models.folder import Folder
+from girder.models.item import Item
 from girder.models.setting import Setting
+from girder.models.upload import Upload
 from girder.models.user import User
+from girder_jobs.constants import JobStatus
 from girder_jobs.models.job import Job
 from tests import base
 
+from covalic import jobs
 from covalic.constants import PluginSettings as CovalicSettings
 from covalic.models.challenge import Challenge
+from covalic.models.leaderboard import Leaderboard
 from covalic.models.phase import Phase
+from covalic.models.phase_lock import PhaseLock
+from covalic.models.score_cache import ScoreCache
+from covalic.models.stats_member import StatsMember
 from covalic.models.submission import Submission
+from covalic.scheduler import scoringScheduler
+from covalic.stats import invalidateStats
 
 
 def setUpModule():
@@ -370,9 +381,56 @@ class PhaseTestCase(base.TestCase):
             creator=self.user,
             ordinal=0)
 
-        resp = self.request(path='/challenge_phase/%s' % phase['_id'],
-                            method='DELETE', user=self.user)
-        self.assertStatusOk(resp)
+        folder = Folder().createFolder(
+            self.user, 'submission', parentType='user', creator=self.user)
+        submission = Submission().createSubmission(
+            self.user, phase, folder, title='submission')
+        score = [{'dataset': 'dataset1', 'metrics': [{'name': 'accuracy', 'value': 0.9}]}]
+        submission['score'] = score
+        submission['scoringFingerprint'] = 'removed'
+        submission = Submission().save(submission)
+        ScoreCache().setScore('removed', score)
+        ScoreCache().setScore('kept', score)
+
+        # State derived from the phase and its submissions
+        scoringJob = Job().createJob(
+            title='score', type='covalic_score', handler='worker_handler', user=self.user)
+        scoringScheduler.enqueue(scoringJob, phase, dispatch=False)
+        with PhaseLock().lock(phase['_id']):
+            pass
+        self.assertEqual(Leaderboard().find({'phaseId': phase['_id']}).count(), 1)
+        self.assertEqual(StatsMember().find({'parentId': phase['_id']}).count(), 1)
+
+        with mock.patch.object(Job, 'scheduleJob'):
+            resp = self.request(path='/challenge_phase/%s' % phase['_id'],
+                                method='DELETE', user=self.user)
+            self.assertStatusOk(resp)
+            self.assertEqual(resp.json['type'], 'covalic_delete')
+
+            # The phase is removed by the deletion job
+            job = Job().load(resp.json['_id'], force=True)
+            jobs.cascadeDelete(job)
+
+        job = Job().load(job['_id'], force=True)
+        self.assertEqual(job['status'], JobStatus.SUCCESS)
+        self.assertEqual(job['progress']['current'], 2)
+        self.assertIsNone(Phase().load(phase['_id'], force=True))
+        self.assertIsNone(Submission().load(submission['_id']))
+        self.assertIsNone(Folder().load(folder['_id'], force=True))
+        self.assertIsNotNone(Challenge().load(self.challenge['_id'], force=True))
+
+        # The derived state is cleaned up along with the phase
+        self.assertEqual(Leaderboard().find({'phaseId': phase['_id']}).count(), 0)
+        self.assertEqual(StatsMember().find({'parentId': phase['_id']}).count(), 0)
+        self.assertIsNone(PhaseLock().findOne({'_id': phase['_id']}))
+        self.assertIsNone(ScoreCache().getScore('removed'))
+        self.assertIsNotNone(ScoreCache().getScore('kept'))
+        scoringJob = Job().load(scoringJob['_id'], force=True)
+        self.assertIn(scoringJob['status'], (JobStatus.CANCELING, JobStatus.CANCELED))
+        self.assertNotIn('covalicQueued', scoringJob)
+
+        # Running the job again is harmless
+        jobs.cascadeDelete(job)
 
     def testPhaseDeletionInvalid(self):
         resp = self.request(path='/challenge_phase/1', method='DELETE',
@@ -437,8 +495,172 @@ class PhaseTestCase(base.TestCase):
         self.assertNotIn('jobId', submission)
         with mock.patch.object(Job, 'scheduleJob'):
             resp = self.request(path='/challenge_phase/%s/rescore' % phase['_id'], method='POST',
-                                user=self.admin)
+                                user=self.admin, params={'chunkSize': 1})
             self.assertStatusOk(resp)
+            self.assertEqual(resp.json['type'], 'covalic_rescore_phase')
+
+            # The scoring jobs are created by the rescoring job, which waits for them
+            job = Job().load(resp.json['_id'], force=True)
+
+            def finishScoringJobs(seconds):
+                self.assertEqual(Job().load(job['_id'], force=True)['status'],
+                                 JobStatus.RUNNING)
+                Job().update({'covalicParentJobId': job['_id']}, {'$set': {
+                    'status': JobStatus.ERROR}})
+
+            with mock.patch.object(jobs.time, 'sleep', side_effect=finishScoringJobs) as sleep:
+                jobs.rescorePhase(job)
+            self.assertEqual(sleep.call_count, 1)
+
+        job = Job().load(job['_id'], force=True)
+        self.assertEqual(job['status'], JobStatus.SUCCESS)
+        self.assertEqual(job['progress']['current'], 1)
+        self.assertIn('1 new scoring jobs, 1 of which failed', job['log'][-1])
 
         submission = Submission().load(submission['_id'])
         self.assertIn('jobId', submission)
+        self.assertIn('score', submission)
+        scoreJob = Job().load(submission['jobId'], force=True)
+        self.assertEqual(scoreJob['covalicParentJobId'], job['_id'])
+        self.assertTrue(scoreJob['rescoring'])
+
+    def testGroundtruthItems(self):
+        phase = Phase().createPhase(
+            'phase 1', self.challenge, creator=self.user, ordinal=1)
+        groundTruth = Folder().load(phase['groundTruthFolderId'], force=True)
+        for name in ('b.nii', 'a.nii', 'c.nii'):
+            Upload().uploadFromFile(
+                io.BytesIO(b'truth'), 5, name, parentType='folder', parent=groundTruth,
+                user=self.user)
+
+        # Listings are paged
+        resp = self.request(
+            path='/challenge_phase/%s/groundtruth/item' % phase['_id'], user=self.admin,
+            params={'limit': 2, 'offset': 1})
+        self.assertStatusOk(resp)
+        self.assertEqual([item['name'] for item in resp.json], ['b.nii', 'c.nii'])
+        etag = resp.headers['ETag']
+
+        # Only item names are exposed
+        self.assertEqual(set(resp.json[0]), {'_id', 'name'})
+        resp = self.request(
+            path='/challenge_phase/%s/groundtruth/item' % phase['_id'], user=self.admin,
+            params={'sort': 'size'})
+        self.assertStatus(resp, 400)
+
+        # The manifest is reused until the ground truth changes
+        resp = self.request(
+            path='/challenge_phase/%s/groundtruth/item' % phase['_id'], user=self.admin,
+            additionalHeaders=[('If-None-Match', etag)], isJson=False)
+        self.assertStatus(resp, 304)
+
+        item = Item().findOne({'folderId': groundTruth['_id'], 'name': 'c.nii'})
+        Item().remove(item)
+        resp = self.request(
+            path='/challenge_phase/%s/groundtruth/item' % phase['_id'], user=self.admin,
+            additionalHeaders=[('If-None-Match', etag)])
+        self.assertStatusOk(resp)
+        self.assertEqual([item['name'] for item in resp.json], ['a.nii', 'b.nii'])
+
+        # Submission folders are checked against the manifest
+        folder = Folder().createFolder(
+            self.user, 'submission', parentType='user', creator=self.user)
+        for name in ('a.nrrd', 'd.nrrd'):
+            Upload().uploadFromFile(
+                io.BytesIO(b'result'), 6, name, parentType='folder', parent=folder,
+                user=self.user)
+        resp = self.request(
+            path='/challenge_phase/%s/groundtruth/validate' % phase['_id'], method='POST',
+            user=self.user, params={'folderId': folder['_id']})
+        self.assertStatusOk(resp)
+        self.assertFalse(resp.json['ok'])
+        self.assertEqual(resp.json['matched'], ['a'])
+        self.assertEqual(resp.json['unmatchedGroundtruths'], ['b'])
+        self.assertEqual(resp.json['unmatchedInputs'], ['d'])
+
+        # So are the names of files that are about to be uploaded
+        resp = self.request(
+            path='/challenge_phase/%s/groundtruth/validate' % phase['_id'], method='POST',
+            user=self.user, params={'names': json.dumps(['a.nrrd', 'b.nrrd'])})
+        self.assertStatusOk(resp)
+        self.assertTrue(resp.json['ok'])
+        self.assertEqual(resp.json['matched'], ['a', 'b'])
+
+        resp = self.request(
+            path='/challenge_phase/%s/groundtruth/validate' % phase['_id'], method='POST',
+            user=self.user)
+        self.assertStatus(resp, 400)
+
+    def testPhaseStats(self):
+        phase1 = Phase().createPhase(
+            'phase 1', self.challenge, creator=self.user, ordinal=1)
+        phase2 = Phase().createPhase(
+            'phase 2', self.challenge, creator=self.user, ordinal=2)
+
+        def getStats(path):
+            resp = self.request(path=path, user=self.user)
+            self.assertStatusOk(resp)
+            return resp.json
+
+        phasePath = '/challenge_phase/%s/stats' % phase1['_id']
+        challengePath = '/challenge/%s/stats' % self.challenge['_id']
+        self.assertEqual(getStats(phasePath), {
+            'submissionCount': 0,
+            'participantCount': 1,
+            'submittingParticipantCount': 0,
+            'lastSubmission': None
+        })
+        self.assertEqual(getStats(challengePath)['participantCount'], 1)
+
+        # Joining phases updates the counters
+        for phase in (phase1, phase2):
+            resp = self.request(
+                path='/challenge_phase/%s/participant' % phase['_id'], method='POST',
+                user=self.admin)
+            self.assertStatusOk(resp)
+        self.assertEqual(getStats(phasePath)['participantCount'], 2)
+        self.assertEqual(getStats(challengePath)['participantCount'], 2)
+
+        # Latest submissions update the counters, superseded and unscored ones do not
+        submissions = []
+        for user, phase, scored in ((self.user, phase1, True), (self.user, phase1, True),
+                                    (self.admin, phase2, True), (self.admin, phase1, False)):
+            folder = Folder().createFolder(
+                user, 'submission', parentType='user', creator=user, allowRename=True)
+            submission = Submission().createSubmission(user, phase, folder, title='submission')
+            if scored:
+                submission['score'] = [{
+                    'dataset': 'dataset1',
+                    'metrics': [{'name': 'accuracy', 'value': 0.9}]
+                }]
+                submission = Submission().save(submission)
+            submissions.append(submission)
+        stats = getStats(phasePath)
+        self.assertEqual(stats['submissionCount'], 1)
+        self.assertEqual(stats['submittingParticipantCount'], 1)
+        self.assertIsNotNone(stats['lastSubmission'])
+        stats = getStats(challengePath)
+        self.assertEqual(stats['submissionCount'], 2)
+        self.assertEqual(stats['submittingParticipantCount'], 2)
+
+        # The counters agree with statistics computed in full
+        for model, doc, path in ((Phase(), phase1, phasePath),
+                                 (Challenge(), self.challenge, challengePath)):
+            counted = getStats(path)
+            invalidateStats(model, doc['_id'])
+            self.assertEqual(getStats(path), counted)
+
+        # Removing a superseded submission changes nothing
+        Submission().remove(submissions[0])
+        self.assertEqual(getStats(phasePath)['submissionCount'], 1)
+        Submission().remove(submissions[1])
+        stats = getStats(phasePath)
+        self.assertEqual(stats['submissionCount'], 0)
+        self.assertEqual(stats['submittingParticipantCount'], 0)
+        stats = getStats(challengePath)
+        self.assertEqual(stats['submissionCount'], 1)
+        self.assertEqual(stats['submittingParticipantCount'], 1)
+
+        # Counters are not overwritten by stale documents
+        Phase().save(phase1)
+        self.assertEqual(getStats(phasePath)['submissionCount'], 0)
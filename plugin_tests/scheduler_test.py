@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import datetime
+import mock
+
+from girder.models.model_base import ValidationException
+from girder.models.setting import Setting
+from girder.models.user import User
+from girder_jobs.constants import JobStatus
+from girder_jobs.models.job import Job
+from tests import base
+
+from covalic.constants import PluginSettings, SCORING_MAX_CONCURRENT, \
+    SCORING_PHASE_MAX_CONCURRENT, SCORING_USER_MAX_CONCURRENT
+from covalic.models.challenge import Challenge
+from covalic.models.phase import Phase
+from covalic.models.scheduler_lease import SchedulerLease
+from covalic.scheduler import scoringScheduler
+
+
+def setUpModule():
+    base.enabledPlugins.append('covalic')
+    base.startServer()
+
+
+def tearDownModule():
+    base.stopServer()
+
+
+class FakeWorker(object):
+    """Stands in for Girder Worker, running scoring jobs only when told to."""
+
+    def __init__(self):
+        self.scheduled = []
+
+    def schedule(self, job):
+        self.scheduled.append(job['_id'])
+        Job().updateJob(job, status=JobStatus.QUEUED)
+
+    def finish(self, jobId):
+        job = Job().load(jobId, force=True)
+        job = Job().updateJob(job, status=JobStatus.RUNNING)
+        Job().updateJob(job, status=JobStatus.SUCCESS)
+
+
+class ScoringSchedulerTestCase(base.TestCase):
+    def setUp(self):
+        super(ScoringSchedulerTestCase, self).setUp()
+
+        self.users = [User().createUser(
+            email='user%d@email.com' % i, login='user%d' % i, firstName='User',
+            lastName=str(i), password='password', admin=i == 0
+        ) for i in range(3)]
+        self.phases = []
+        for name in ('a', 'b'):
+            challenge = Challenge().createChallenge(
+                name='challenge %s' % name, creator=self.users[0], public=False)
+            self.phases.append(Phase().createPhase(
+                'phase %s' % name, challenge, creator=self.users[0], ordinal=1))
+
+        self.worker = FakeWorker()
+        for patch in (
+                mock.patch.object(scoringScheduler, 'schedule', self.worker.schedule),
+                mock.patch.object(scoringScheduler, 'maxConcurrent', 2),
+                mock.patch.object(scoringScheduler, 'phaseMaxConcurrent', 2),
+                mock.patch.object(scoringScheduler, 'userMaxConcurrent', 1)):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def enqueue(self, phase, user, rescoring=False):
+        otherFields = {'rescoring': True} if rescoring else {}
+        job = Job().createJob(
+            title='score', type='covalic_score', handler='worker_handler', user=user,
+            otherFields=otherFields)
+        return scoringScheduler.enqueue(job, phase, dispatch=False)['_id']
+
+    def testFairShareDispatch(self):
+        phaseA, phaseB = self.phases
+        rescoreA = self.enqueue(phaseA, self.users[0], rescoring=True)
+        newA1 = self.enqueue(phaseA, self.users[1])
+        newA2 = self.enqueue(phaseA, self.users[0])
+        newB = self.enqueue(phaseB, self.users[2])
+
+        # New submissions go first, and challenges take turns
+        self.assertEqual(scoringScheduler.dispatch(), 2)
+        self.assertEqual(self.worker.scheduled, [newA1, newB])
+
+        # A finished job frees a slot
+        self.worker.finish(newA1)
+        self.assertEqual(self.worker.scheduled, [newA1, newB, newA2])
+
+        # The rescoring job waits for its user's other job
+        self.worker.finish(newB)
+        self.assertEqual(self.worker.scheduled, [newA1, newB, newA2])
+        self.worker.finish(newA2)
+        self.assertEqual(self.worker.scheduled, [newA1, newB, newA2, rescoreA])
+
+        self.worker.finish(rescoreA)
+        self.assertEqual(scoringScheduler.dispatch(), 0)
+        self.assertEqual(Job().find({'covalicActive': True}).count(), 0)
+
+    def testCanceledWhileQueued(self):
+        phaseA, phaseB = self.phases
+        canceled = self.enqueue(phaseA, self.users[1])
+        queued = self.enqueue(phaseB, self.users[2])
+
+        # Jobs canceled before dispatch are skipped and leave the queue
+        Job().cancelJob(Job().load(canceled, force=True))
+        scoringScheduler.dispatch()
+        self.assertEqual(self.worker.scheduled, [queued])
+        self.assertNotIn('covalicQueued', Job().load(canceled, force=True))
+
+    def testLostJobs(self):
+        phaseA, phaseB = self.phases
+        lost = self.enqueue(phaseA, self.users[1])
+        unscheduled = self.enqueue(phaseB, self.users[2])
+        waiting = self.enqueue(phaseA, self.users[0])
+        self.assertEqual(scoringScheduler.dispatch(), 2)
+        self.assertEqual(self.worker.scheduled, [lost, unscheduled])
+
+        # A job whose worker stopped updating it fails and releases its slot
+        longAgo = datetime.datetime.utcnow() - datetime.timedelta(days=1)
+        Job().update({'_id': lost}, {'$set': {'updated': longAgo}})
+        # A job claimed by a process that died before scheduling it is queued again
+        Job().update({'_id': unscheduled}, {'$set': {
+            'status': JobStatus.INACTIVE, 'covalicDispatchedAt': longAgo}})
+
+        self.assertEqual(scoringScheduler.dispatch(), 2)
+        self.assertEqual(Job().load(lost, force=True)['status'], JobStatus.ERROR)
+        self.assertEqual(self.worker.scheduled, [lost, unscheduled, waiting, unscheduled])
+
+    def testDispatchLease(self):
+        phaseA, phaseB = self.phases
+        queued = self.enqueue(phaseA, self.users[1])
+
+        # While another process dispatches, it is asked to dispatch again instead
+        self.assertTrue(SchedulerLease().acquire('scoring', 'other'))
+        self.assertEqual(scoringScheduler.dispatch(), 0)
+        self.assertEqual(self.worker.scheduled, [])
+        self.assertTrue(SchedulerLease().release('scoring', 'other'))
+        self.assertFalse(SchedulerLease().release('scoring', 'other'))
+
+        self.assertEqual(scoringScheduler.dispatch(), 1)
+        self.assertEqual(self.worker.scheduled, [queued])
+
+    def testLimitsFromSettings(self):
+        self.assertEqual(scoringScheduler.limits(), (2, 2, 1))
+
+        for attr in ('maxConcurrent', 'phaseMaxConcurrent', 'userMaxConcurrent'):
+            patch = mock.patch.object(scoringScheduler, attr, None)
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.assertEqual(scoringScheduler.limits(), (
+            SCORING_MAX_CONCURRENT, SCORING_PHASE_MAX_CONCURRENT, SCORING_USER_MAX_CONCURRENT))
+
+        Setting().set(PluginSettings.SCORING_MAX_CONCURRENT, '30')
+        Setting().set(PluginSettings.SCORING_PHASE_MAX_CONCURRENT, 5)
+        Setting().set(PluginSettings.SCORING_USER_MAX_CONCURRENT, 1)
+        self.assertEqual(scoringScheduler.limits(), (30, 5, 1))
+
+        with self.assertRaises(ValidationException):
+            Setting().set(PluginSettings.SCORING_USER_MAX_CONCURRENT, 0)
+        with self.assertRaises(ValidationException):
+            Setting().set(PluginSettings.SCORING_USER_MAX_CONCURRENT, 'many')
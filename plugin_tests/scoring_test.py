@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+
+import copy
+import mock
+import unittest
+
+from covalic import scoring
+
+
+def makeScore(rows):
+    return [{
+        'dataset': 'dataset%d' % i,
+        'metrics': [
+            {'name': name, 'value': value}
+            for name, value in row
+        ]
+    } for i, row in enumerate(rows)]
+
+
+class ScoringTestCase(unittest.TestCase):
+    def setUp(self):
+        self.score = makeScore([
+            [('accuracy', 0.1), ('error', 0.9), ('dice', '0.5')],
+            [('accuracy', 0.3), ('error', None)],
+            [('error', 0.7), ('accuracy', 1.0 / 3.0), ('dice', None)],
+            [('hausdorff', None)]
+        ])
+        self.phase = {
+            'metrics': {
+                'accuracy': {'weight': 0.3},
+                'error': {'weight': 0.7},
+                'unused': {}
+            }
+        }
+
+    def _computeBoth(self, score):
+        results = []
+        for engine in (scoring.numpy, None):
+            with mock.patch.object(scoring, 'numpy', engine):
+                s = copy.deepcopy(score)
+                scoring.computeAverageScores(s)
+                results.append((s, scoring.computeOverallScore({'score': s}, self.phase)))
+        return results
+
+    def testAverageScores(self):
+        scoring.computeAverageScores(self.score)
+        self.assertEqual(self.score[0]['dataset'], 'Average')
+        self.assertEqual(self.score[0]['metrics'], [{
+            'name': 'accuracy',
+            'value': (0.1 + 0.3 + 1.0 / 3.0) / 3.0
+        }, {
+            'name': 'dice',
+            'value': 0.5
+        }, {
+            'name': 'error',
+            'value': (0.9 + 0.7) / 2.0
+        }])
+        self.assertEqual(len(self.score), 5)
+
+    @unittest.skipIf(scoring.numpy is None, 'numpy is not installed')
+    def testEnginesAgree(self):
+        (numpyScore, numpyOverall), (pythonScore, pythonOverall) = self._computeBoth(self.score)
+        self.assertEqual(numpyScore, pythonScore)
+        self.assertEqual(numpyOverall, pythonOverall)
+
+        # Empty scores and duplicated metrics fall back gracefully
+        (numpyScore, numpyOverall), (pythonScore, pythonOverall) = self._computeBoth([])
+        self.assertEqual(numpyScore, pythonScore)
+        self.assertEqual(numpyOverall, pythonOverall)
+
+        score = makeScore([[('accuracy', 1.0), ('accuracy', 2.0)]])
+        (numpyScore, numpyOverall), (pythonScore, pythonOverall) = self._computeBoth(score)
+        self.assertEqual(numpyScore, pythonScore)
+        self.assertEqual(numpyOverall, pythonOverall)
+
+    @unittest.skipIf(scoring.numpy is None, 'numpy is not installed')
+    def testScoreMatrix(self):
+        names, values, present = scoring.scoreMatrix(self.score)
+        self.assertEqual(names, ['accuracy', 'dice', 'error', 'hausdorff'])
+        self.assertEqual(values.shape, (4, 4))
+        self.assertEqual(present.tolist(), [
+            [True, True, True, False],
+            [True, False, False, False],
+            [True, False, True, False],
+            [False, False, False, False]
+        ])
+        self.assertEqual(values[0, 1], 0.5)
@@ -17,13 +17,16 @@
 #  limitations under the License.
 ###############################################################################
 
+import mock
 import six
 
 from girder.constants import AccessType
 from girder.models.folder import Folder
 from girder.models.user import User
+from girder_jobs.models.job import Job
 from tests import base
 
+from covalic import jobs
 from covalic.models.challenge import Challenge
 from covalic.models.phase import Phase
 from covalic.models.submission import Submission
@@ -191,3 +194,38 @@ class SubmissionFolderAccessTestCase(base.TestCase):
         # submission folder has been deleted
         Folder().remove(submissionFolder)
         Phase().setUserAccess(phase, phaseAdmin1, None, save=True)
+
+    def testSubmissionFolderAccessUnchanged(self):
+        admin = User().createUser(
+            email='admin@email.com', login='admin',
+            firstName='Phase', lastName='Admin', password='passwd')
+        user = User().createUser(
+            email='user@email.com', login='user',
+            firstName='User', lastName='1', password='passwd')
+        challenge = Challenge().createChallenge(
+            name='challenge 1', creator=admin, public=False)
+        phase = Phase().createPhase(
+            name='phase 1', challenge=challenge, creator=admin, ordinal=1)
+        folder = Folder().createFolder(
+            parent=user, name='submission 1', parentType='user', creator=user)
+        Submission().createSubmission(creator=user, phase=phase, folder=folder)
+
+        # Saving a phase without changing its admins does not touch folders
+        phase = Phase().load(phase['_id'], force=True)
+        phase['description'] = 'new description'
+        with mock.patch.object(Folder, 'update') as update:
+            Phase().save(phase)
+        update.assert_not_called()
+
+        # Large phases are synchronized in a background job
+        with mock.patch('covalic.FOLDER_ACCESS_JOB_THRESHOLD', 0), \
+                mock.patch('covalic.scheduleSyncFolderAccess') as schedule:
+            Phase().setUserAccess(phase, user, AccessType.WRITE, save=True)
+        self.assertEqual(schedule.call_count, 1)
+
+        jobs.syncFolderAccess(Job().createLocalJob(
+            module='covalic.jobs', function='syncFolderAccess', title='sync',
+            type='covalic_sync_folder_access', user=admin,
+            kwargs={'phaseId': str(phase['_id'])}))
+        phase = Phase().load(phase['_id'], force=True)
+        self.assertFalse(Submission().folderAccessChanged(phase))
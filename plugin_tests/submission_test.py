@@ -17,21 +17,39 @@
 #  limitations under the License.
 ###############################################################################
 
+import csv
+import datetime
+import io
 import json
 import mock
+import threading
+import time
+import zipfile
 
+from girder.constants import AccessType
 from girder.models.folder import Folder
+from girder.models.file import File
 from girder.models.group import Group
 from girder.models.setting import Setting
+from girder.models.token import Token
+from girder.models.upload import Upload
 from girder.models.user import User
+from girder_jobs.constants import JobStatus
 from girder_jobs.models.job import Job
 from girder_worker.girder_plugin.constants import PluginSettings as WorkerSettings
 from tests import base
 
+from covalic import jobs, notifications
 from covalic.constants import PluginSettings as CovalicSettings
 from covalic.models.challenge import Challenge
+from covalic.models.leaderboard import Leaderboard
+from covalic.models.notification import Notification
 from covalic.models.phase import Phase
+from covalic.models.phase_lock import PhaseLock
+from covalic.models.score_cache import ScoreCache
 from covalic.models.submission import Submission
+from covalic.notifications import notificationDispatcher
+from covalic.utility.cache import leaderboardCache
 
 
 def setUpModule():
@@ -134,6 +152,10 @@ class SubmissionBase(base.TestCase):
             submission['score'] = scoreDict
         return Submission().save(submission)
 
+    def jobToken(self, jobId):
+        job = Job().load(jobId, force=True)
+        return job['kwargs']['outputs']['_stdout']['headers']['Girder-Token']
+
     def generateSubmissionList(self, userApproaches=None, adminApproaches=None):
         userApproaches = userApproaches or [None, None, None]
         adminApproaches = adminApproaches or [None, None, None]
@@ -217,6 +239,21 @@ class SubmissionModelTest(SubmissionBase):
             self.phase1, latest=True))
         self.assertEqual(len(submissions), 2)
 
+    def testListBatchSize(self):
+        self.generateSubmissionList()
+        cursors = []
+        find = Submission.find
+
+        def recordFind(model, *args, **kwargs):
+            cursors.append(find(model, *args, **kwargs))
+            return cursors[-1]
+
+        with mock.patch.object(Submission, 'find', autospec=True, side_effect=recordFind):
+            submissions = list(Submission().list(
+                self.phase1, limit=0, latest=False, batchSize=2))
+        self.assertEqual(len(submissions), 6)
+        self.assertEqual(cursors[0]._batch_size, 2)
+
     def testListByApproach(self):
         userApproaches = ['A', 'C', 'B']
         adminApproaches = ['A', 'default', 'D']
@@ -329,12 +366,235 @@ class SubmissionModelTest(SubmissionBase):
             'error': {'weight': 0.7}
         }
         Phase().save(self.phase1)
-        Submission().recomputeOverallScores(self.phase1)
+        count = Submission().recomputeOverallScores(self.phase1, batchSize=4)
+        self.assertEqual(count, 6)
 
         submission = Submission().findOne(
             {'title': 'User submission 0 phase 1'})
         self.assertEqual(submission['overallScore'], 0.25 * 0.3 + 1.0 * 0.7)
 
+    def testRecomputeOverallScoresJob(self):
+        self.generateSubmissionList()
+
+        resp = self.request(
+            path='/challenge_phase/%s/metrics' % self.phase1['_id'], method='PUT',
+            user=self.admin, type='application/json', body=json.dumps({
+                'accuracy': {'weight': 0.3},
+                'error': {'weight': 0.7}
+            }))
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.json['type'], 'covalic_recompute_overall_scores')
+
+        # Scores are not recomputed until the job runs
+        submission = Submission().findOne(
+            {'title': 'User submission 0 phase 1'})
+        self.assertEqual(submission['overallScore'], (1.0 + 0.25) / 2.0)
+
+        job = Job().load(resp.json['_id'], force=True)
+        jobs.recomputeOverallScores(job)
+
+        job = Job().load(job['_id'], force=True)
+        self.assertEqual(job['status'], JobStatus.SUCCESS)
+        self.assertEqual(job['progress']['current'], 6)
+        self.assertEqual(job['covalicProcessed'], 6)
+        submission = Submission().findOne(
+            {'title': 'User submission 0 phase 1'})
+        self.assertEqual(submission['overallScore'], 0.25 * 0.3 + 1.0 * 0.7)
+
+        # Unchanged metrics do not schedule another job
+        resp = self.request(
+            path='/challenge_phase/%s/metrics' % self.phase1['_id'], method='PUT',
+            user=self.admin, type='application/json', body=json.dumps({
+                'accuracy': {'weight': 0.3},
+                'error': {'weight': 0.7}
+            }))
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.json['_id'], str(self.phase1['_id']))
+
+    def testResumeInterruptedJobs(self):
+        self.generateSubmissionList()
+        job = jobs.scheduleRecomputeOverallScores(self.phase1, self.admin)
+
+        # A job interrupted by a restart is scheduled again from its checkpoint
+        first = Submission().collection.find_one(
+            {'phaseId': self.phase1['_id']}, sort=[('_id', 1)])
+        Job().update({'_id': job['_id']}, {'$set': {
+            'status': JobStatus.RUNNING,
+            'covalicLastId': first['_id'],
+            'covalicProcessed': 1
+        }})
+        Job.scheduleJob.reset_mock()
+
+        # Jobs of this process, and jobs of live processes elsewhere, are left alone
+        self.assertEqual(jobs.resumeInterruptedJobs(), 0)
+        self.assertEqual(jobs.heartbeatJobs(), 1)
+        Job().update({'_id': job['_id']}, {'$set': {
+            'covalicOwner': {'host': 'elsewhere', 'pid': 1, 'token': 'other'},
+            'covalicHeartbeat': datetime.datetime.utcnow()
+        }})
+        self.assertEqual(jobs.resumeInterruptedJobs(), 0)
+        self.assertEqual(jobs.heartbeatJobs(), 0)
+
+        # A job whose process stopped sending heartbeats is resumed
+        Job().update({'_id': job['_id']}, {'$set': {
+            'covalicHeartbeat': datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+        }})
+        self.assertEqual(jobs.resumeInterruptedJobs(), 1)
+        self.assertEqual(Job.scheduleJob.call_count, 1)
+
+        job = Job().load(job['_id'], force=True)
+        self.assertEqual(job['status'], JobStatus.INACTIVE)
+        self.assertEqual(job['covalicOwner'], jobs._owner)
+        jobs.recomputeOverallScores(job)
+        job = Job().load(job['_id'], force=True)
+        self.assertEqual(job['status'], JobStatus.SUCCESS)
+        self.assertEqual(job['covalicProcessed'], 6)
+
+        # Finished jobs are left alone
+        self.assertEqual(jobs.resumeInterruptedJobs(), 0)
+
+    def testLeaderboard(self):
+        def ranks():
+            phase = Phase().load(self.phase1['_id'], force=True)
+            return sorted((row['rank'], row['creatorId'], row['approach'])
+                          for row in Leaderboard().list(phase))
+
+        Submission().rebuildRanks(self.phase1)
+
+        self.createSubmission(self.phase1, self.user, 'user 1', score=[0.2, 0.2])
+        self.createSubmission(self.phase1, self.admin, 'admin 1', score=[0.8, 0.8])
+        self.assertEqual(ranks(), [
+            (1, self.admin['_id'], 'default'),
+            (2, self.user['_id'], 'default')
+        ])
+
+        # A new latest submission replaces the participant's row
+        latest = self.createSubmission(self.phase1, self.user, 'user 2', score=[1.0, 1.0])
+        self.createSubmission(
+            self.phase1, self.admin, 'admin B', score=[0.0, 0.0], approach='B')
+        self.assertEqual(ranks(), [
+            (1, self.user['_id'], 'default'),
+            (2, self.admin['_id'], 'default'),
+            (3, self.admin['_id'], 'B')
+        ])
+        row = Leaderboard().findOne({'submissionId': latest['_id']})
+        self.assertEqual(row['title'], 'user 2')
+        self.assertEqual(row['overallScore'], 1.0)
+        self.assertEqual(row['averages'], latest['score'][0]['metrics'])
+
+        # Disqualified submissions leave the leaderboard
+        latest['latest'] = False
+        Submission().save(latest)
+        self.assertEqual(ranks(), [
+            (1, self.admin['_id'], 'default'),
+            (2, self.admin['_id'], 'B')
+        ])
+
+        # Incremental maintenance agrees with a full rebuild
+        self.createSubmission(
+            self.phase1, self.user, 'user C', score=[0.8, 0.8], approach='C')
+        incremental = ranks()
+        Submission().rebuildRanks(self.phase1)
+        self.assertEqual(ranks(), incremental)
+        self.assertEqual([rank for rank, _, _ in incremental], [1, 1, 2])
+
+    def testSubmissionRanks(self):
+        def ranks():
+            return {
+                doc['title']: (doc.get('rank'), doc.get('approachRank'))
+                for doc in Submission().find({'phaseId': self.phase1['_id']})
+            }
+
+        self.createSubmission(self.phase1, self.user, 'user 1', score=[0.5, 0.5])
+        self.createSubmission(self.phase1, self.admin, 'admin 1', score=[0.5, 0.5])
+        self.createSubmission(
+            self.phase1, self.admin, 'admin B', score=[0.2, 0.2], approach='B')
+        self.assertEqual(ranks(), {
+            'user 1': (1, 1),
+            'admin 1': (1, 1),
+            'admin B': (2, 1)
+        })
+
+        # Superseded submissions lose their rank, and ties are dense
+        self.createSubmission(self.phase1, self.user, 'user 2', score=[0.8, 0.8])
+        self.assertEqual(ranks(), {
+            'user 1': (None, None),
+            'user 2': (1, 1),
+            'admin 1': (2, 2),
+            'admin B': (3, 1)
+        })
+
+        # Moving a submission to another approach updates both approaches
+        submission = Submission().findOne({'title': 'admin 1'})
+        submission['approach'] = 'B'
+        Submission().save(submission)
+        self.assertEqual(ranks(), {
+            'user 1': (None, None),
+            'user 2': (1, 1),
+            'admin 1': (2, 1),
+            'admin B': (3, 2)
+        })
+
+        # Removed submissions leave the ranking
+        Submission().remove(Submission().findOne({'title': 'user 2'}))
+        incremental = ranks()
+        self.assertEqual(incremental, {
+            'user 1': (None, None),
+            'admin 1': (1, 1),
+            'admin B': (2, 2)
+        })
+        Submission().rebuildRanks(self.phase1)
+        self.assertEqual(ranks(), incremental)
+
+    def testSubmissionRanksInterleaved(self):
+        def ranks():
+            return {
+                doc['title']: (doc.get('rank'), doc.get('approachRank'))
+                for doc in Submission().find({'phaseId': self.phase1['_id']})
+            }
+
+        self.createSubmission(self.phase1, self.admin, 'admin 1', score=[0.5, 0.5])
+
+        # Concurrent saves wait for the phase lock instead of interleaving
+        threads = [
+            threading.Thread(target=self.createSubmission, args=(
+                self.phase1, user, title), kwargs={'score': score})
+            for user, title, score in [
+                (self.user, 'user 1', [0.8, 0.8]),
+                (self.user, 'user 2', [0.5, 0.5]),
+                (self.admin, 'admin 2', [0.2, 0.2])
+            ]
+        ]
+        with PhaseLock().lock(self.phase1['_id']):
+            for thread in threads:
+                thread.start()
+            time.sleep(0.5)
+            self.assertTrue(all(thread.is_alive() for thread in threads))
+            self.assertEqual(list(ranks()), ['admin 1'])
+        for thread in threads:
+            thread.join()
+
+        incremental = ranks()
+        self.assertEqual(len(incremental), 4)
+        Submission().rebuildRanks(self.phase1)
+        self.assertEqual(ranks(), incremental)
+
+    def testUserRename(self):
+        submission = self.createSubmission(self.phase1, self.user, 'user 1', score=[0.5, 0.5])
+        version = Phase().load(self.phase1['_id'], force=True)['version']
+
+        # Saves that leave the user's identity alone leave the phase alone
+        self.user['emailVerified'] = True
+        User().save(self.user)
+        self.assertEqual(Phase().load(self.phase1['_id'], force=True)['version'], version)
+
+        self.user['lastName'] = 'Renamed'
+        User().save(self.user)
+        self.assertNotEqual(Phase().load(self.phase1['_id'], force=True)['version'], version)
+        self.assertEqual(Submission().load(submission['_id'])['creatorName'], 'First Renamed')
+        row = Leaderboard().findOne({'submissionId': submission['_id']})
+        self.assertEqual(row['creatorName'], 'First Renamed')
+
     def testCreateUnscored(self):
         self.generateSubmissionList()
         submission = self.createSubmission(self.phase1, self.user, 'no score')
@@ -532,6 +792,138 @@ class SubmissionRestTest(SubmissionBase):
         self.assertStatusOk(resp)
         self.assertEqual(len(resp.json), 3)
 
+    def testListSubmissionsWithCursor(self):
+        self.generateSubmissionList()
+        params = {
+            'phaseId': self.phase1['_id'],
+            'latest': False,
+            'limit': 4
+        }
+
+        # All submissions tie on overallScore, so paging relies on the _id tiebreaker
+        ids = []
+        resp = self.request(path='/covalic_submission', user=self.user, params=params)
+        self.assertStatusOk(resp)
+        ids.extend(s['_id'] for s in resp.json)
+        self.assertIn('Covalic-Next-Cursor', resp.headers)
+
+        params['cursor'] = resp.headers['Covalic-Next-Cursor']
+        resp = self.request(path='/covalic_submission', user=self.user, params=params)
+        self.assertStatusOk(resp)
+        ids.extend(s['_id'] for s in resp.json)
+        self.assertNotIn('Covalic-Next-Cursor', resp.headers)
+
+        self.assertEqual(len(ids), 6)
+        self.assertEqual(len(set(ids)), 6)
+
+        # Offset paging returns the same order
+        del params['cursor']
+        params['limit'] = 0
+        resp = self.request(path='/covalic_submission', user=self.user, params=params)
+        self.assertStatusOk(resp)
+        self.assertEqual([s['_id'] for s in resp.json], ids)
+
+        # Malformed cursors are rejected
+        params['cursor'] = 'invalid'
+        resp = self.request(path='/covalic_submission', user=self.user, params=params)
+        self.assertStatus(resp, 400)
+
+    def testListSubmissionsWithCursorUnscored(self):
+        for title, score in (('a', [0.9, 0.9]), ('b', [0.5, 0.5]), ('c', [0.1, 0.1]),
+                             ('d', None), ('e', None)):
+            self.createSubmission(self.phase1, self.user, title, score=score)
+        params = {
+            'phaseId': self.phase1['_id'],
+            'latest': False,
+            'sort': 'overallScore',
+            'sortdir': -1,
+            'limit': 2
+        }
+
+        # Unscored submissions sort last, and are not dropped across page boundaries
+        titles = []
+        while True:
+            resp = self.request(path='/covalic_submission', user=self.user, params=params)
+            self.assertStatusOk(resp)
+            titles.extend(s['title'] for s in resp.json)
+            if 'Covalic-Next-Cursor' not in resp.headers:
+                break
+            params['cursor'] = resp.headers['Covalic-Next-Cursor']
+
+        self.assertEqual(titles[:3], ['a', 'b', 'c'])
+        self.assertEqual(sorted(titles[3:]), ['d', 'e'])
+
+    def testListSubmissionsConditional(self):
+        self.generateSubmissionList()
+        params = {'phaseId': self.phase1['_id']}
+
+        resp = self.request(path='/covalic_submission', user=self.user, params=params)
+        self.assertStatusOk(resp)
+        etag = resp.headers['ETag']
+
+        resp = self.request(
+            path='/covalic_submission', user=self.user, params=params, isJson=False,
+            additionalHeaders=[('If-None-Match', etag)])
+        self.assertStatus(resp, 304)
+
+        # Admins see hidden scores, so they get a different representation
+        Phase().update({'_id': self.phase1['_id']}, {'$set': {'hideScores': True}})
+        resp = self.request(
+            path='/covalic_submission', user=self.admin, params=params,
+            additionalHeaders=[('If-None-Match', etag)])
+        self.assertStatusOk(resp)
+        self.assertNotEqual(resp.headers['ETag'], etag)
+        Phase().update({'_id': self.phase1['_id']}, {'$set': {'hideScores': False}})
+
+        # A new submission changes the ETag
+        self.createSubmission(self.phase1, self.user, 'new', score=[1.0, 1.0])
+        resp = self.request(
+            path='/covalic_submission', user=self.user, params=params,
+            additionalHeaders=[('If-None-Match', etag)])
+        self.assertStatusOk(resp)
+        self.assertNotEqual(resp.headers['ETag'], etag)
+
+        # The phase document is versioned too
+        resp = self.request(path='/challenge_phase/%s' % self.phase1['_id'], user=self.user)
+        self.assertStatusOk(resp)
+        etag = resp.headers['ETag']
+        resp = self.request(
+            path='/challenge_phase/%s' % self.phase1['_id'], user=self.user, isJson=False,
+            additionalHeaders=[('If-None-Match', etag)])
+        self.assertStatus(resp, 304)
+
+        Phase().save(Phase().load(self.phase1['_id'], force=True))
+        resp = self.request(
+            path='/challenge_phase/%s' % self.phase1['_id'], user=self.user,
+            additionalHeaders=[('If-None-Match', etag)])
+        self.assertStatusOk(resp)
+
+    def testListSubmissionsCache(self):
+        self.generateSubmissionList()
+        leaderboardCache.invalidate()
+        params = {'phaseId': self.phase1['_id']}
+
+        hits = leaderboardCache.stats()['hits']
+        resp = self.request(path='/covalic_submission', user=self.user, params=params)
+        self.assertStatusOk(resp)
+        resp = self.request(path='/covalic_submission', user=self.user, params=params)
+        self.assertStatusOk(resp)
+        self.assertEqual(len(resp.json), 2)
+        self.assertEqual(leaderboardCache.stats()['hits'], hits + 1)
+
+        # Saving a submission invalidates the phase's entries
+        self.createSubmission(self.phase1, self.user, 'new', score=[1.0, 1.0])
+        self.assertEqual(leaderboardCache.stats()['size'], 0)
+        resp = self.request(path='/covalic_submission', user=self.user, params=params)
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.json[0]['title'], 'new')
+
+        resp = self.request(path='/covalic_submission/cache', user=self.user)
+        self.assertStatus(resp, 403)
+        resp = self.request(path='/covalic_submission/cache', user=self.admin)
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.json['hits'], hits + 1)
+
     def testListUserApproaches(self):
         userApproaches = ['A', 'c', 'b']
         adminApproaches = ['A', 'default', 'd']
@@ -703,6 +1095,318 @@ class SubmissionRestTest(SubmissionBase):
         )
         self.assertStatus(resp, 403)
 
+    def testScoringTokens(self):
+        submission1 = self.createSubmission(self.phase1, self.user, 'submission1')
+        submission2 = self.createSubmission(self.phase1, self.admin, 'submission2')
+
+        # Each scoring job gets its own token
+        context = Submission().getScoringContext(self.phase1)
+        jobIds = Submission().scoreSubmissions(
+            [submission1, submission2], context, 'http://127.0.0.1/api/v1', force=True)
+        tokens = [self.jobToken(jobId) for jobId in jobIds]
+        self.assertEqual(len(set(tokens)), 2)
+
+        # Posting one score does not revoke the token of the other job
+        score = json.dumps([{
+            'dataset': 'dataset1',
+            'metrics': [{'name': 'accuracy', 'value': 0.1}, {'name': 'error', 'value': 0.9}]
+        }])
+        for submission, token in zip([submission1, submission2], tokens):
+            resp = self.request(
+                path='/covalic_submission/%s/score' % submission['_id'], method='POST',
+                token=token, body=score, type='application/json')
+            self.assertStatusOk(resp)
+            self.assertIsNone(Token().load(token, force=True, objectId=False))
+
+    def testScoreNotifications(self):
+        notificationDispatcher.stop()
+        self.addCleanup(notificationDispatcher.start)
+
+        score = json.dumps([{
+            'dataset': 'dataset1',
+            'metrics': [{'name': 'accuracy', 'value': 0.1}, {'name': 'error', 'value': 0.9}]
+        }])
+        submissions = [
+            self.createSubmission(self.phase1, self.user, 'submission %d' % i)
+            for i in range(3)]
+        for submission in submissions:
+            resp = self.request(
+                path='/covalic_submission/%s/score' % submission['_id'],
+                method='POST', user=self.admin, body=score, type='application/json')
+            self.assertStatusOk(resp)
+
+        # Mails are queued, and admin mails are coalesced into one digest
+        self.assertEqual(Notification().find({'recipients': 'user'}).count(), 3)
+        digest = Notification().findOne({'recipients': 'phaseAdmins'})
+        self.assertEqual(digest['submissionIds'], [s['_id'] for s in submissions])
+        self.assertEqual(Notification().find({'recipients': 'phaseAdmins'}).count(), 1)
+
+        # The digest is only sent once it is due
+        with mock.patch('girder.utility.mail_utils.sendMail') as sendMail:
+            self.assertEqual(notifications.dispatchPending(), 3)
+            self.assertEqual(sendMail.call_count, 3)
+            Notification().update({}, {'$set': {'sendAfter': datetime.datetime.utcnow()}})
+            self.assertEqual(notifications.dispatchPending(), 1)
+        self.assertEqual(sendMail.call_args[0][0], '3 submissions have been scored')
+        self.assertEqual(sendMail.call_args[0][2], ['admin@email.com'])
+        self.assertEqual(Notification().find().count(), 0)
+
+    def testScoreCache(self):
+        submission = self.createSubmission(self.phase1, self.user, 'submission')
+        submission = Submission().scoreSubmission(submission, 'http://127.0.0.1/api/v1')
+        jobId = submission['jobId']
+        self.assertIn('scoringFingerprint', submission)
+
+        score = [{
+            'dataset': 'dataset1',
+            'metrics': [{'name': 'accuracy', 'value': 0.1}, {'name': 'error', 'value': 0.9}]
+        }]
+        resp = self.request(
+            path='/covalic_submission/%s/score' % submission['_id'], method='POST',
+            token=self.jobToken(jobId), body=json.dumps(score), type='application/json')
+        self.assertStatusOk(resp)
+
+        # Unchanged inputs reuse the stored score without a job
+        resp = self.request(
+            path='/covalic_submission/%s/rescore' % submission['_id'], method='POST',
+            user=self.admin)
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.json['jobId'], str(jobId))
+        self.assertEqual(resp.json['overallScore'], 0.5)
+        self.assertEqual(resp.json['score'][1], score[0])
+
+        # Changing the scoring task changes the fingerprint
+        self.phase1['scoreTask'] = {'dockerImage': 'metrics:2'}
+        Phase().save(self.phase1)
+        rescored = Submission().scoreSubmission(
+            Submission().load(submission['_id']), 'http://127.0.0.1/api/v1')
+        self.assertNotEqual(rescored['jobId'], jobId)
+
+        # The force flag bypasses the cache
+        resp = self.request(
+            path='/covalic_submission/%s/score' % submission['_id'], method='POST',
+            user=self.admin, body=json.dumps(score), type='application/json')
+        self.assertStatusOk(resp)
+        resp = self.request(
+            path='/covalic_submission/%s/rescore' % submission['_id'], method='POST',
+            user=self.admin, params={'force': True})
+        self.assertStatusOk(resp)
+        self.assertNotEqual(resp.json['jobId'], str(rescored['jobId']))
+
+    def testScoreCacheStaleJob(self):
+        submission = self.createSubmission(self.phase1, self.user, 'submission')
+        submission = Submission().scoreSubmission(submission, 'http://127.0.0.1/api/v1')
+        oldJobId, oldFingerprint = submission['jobId'], submission['scoringFingerprint']
+
+        # A rescore with other inputs is queued while the first job runs
+        self.phase1['scoreTask'] = {'dockerImage': 'metrics:2'}
+        Phase().save(self.phase1)
+        submission = Submission().scoreSubmission(
+            Submission().load(submission['_id']), 'http://127.0.0.1/api/v1')
+        self.assertNotEqual(submission['scoringFingerprint'], oldFingerprint)
+
+        # The score of the first job is cached under the inputs of that job
+        score = [{
+            'dataset': 'dataset1',
+            'metrics': [{'name': 'accuracy', 'value': 0.1}, {'name': 'error', 'value': 0.9}]
+        }]
+        resp = self.request(
+            path='/covalic_submission/%s/score' % submission['_id'], method='POST',
+            token=self.jobToken(oldJobId), body=json.dumps(score), type='application/json')
+        self.assertStatusOk(resp)
+        self.assertIsNotNone(ScoreCache().getScore(oldFingerprint))
+        self.assertIsNone(ScoreCache().getScore(submission['scoringFingerprint']))
+
+    def testPostSubmissionMismatch(self):
+        groundTruth = Folder().load(self.phase1['groundTruthFolderId'], force=True)
+        for name in ('case1.nii', 'case2.nii'):
+            Upload().uploadFromFile(
+                io.BytesIO(b'truth'), 5, name, parentType='folder', parent=groundTruth,
+                user=self.admin)
+        folder = Folder().createFolder(
+            self.user, 'submission', parentType='user', creator=self.user)
+        for name in ('case1.nrrd', 'case3.nrrd'):
+            Upload().uploadFromFile(
+                io.BytesIO(b'result'), 6, name, parentType='folder', parent=folder,
+                user=self.user)
+        params = {
+            'phaseId': self.phase1['_id'],
+            'folderId': folder['_id'],
+            'title': 'submission'
+        }
+
+        # Mismatched submissions are rejected without creating a submission
+        resp = self.request(
+            path='/covalic_submission', method='POST', user=self.user, params=params)
+        self.assertStatus(resp, 400)
+        self.assertEqual(
+            resp.json['message'],
+            'The submission does not match the ground truth (missing: case2; unexpected: case3).')
+        self.assertEqual(Submission().find({'phaseId': self.phase1['_id']}).count(), 0)
+
+        # Matching is not enforced if the phase does not require it
+        self.phase1['matchSubmissions'] = False
+        Phase().save(self.phase1)
+        resp = self.request(
+            path='/covalic_submission', method='POST', user=self.user, params=params)
+        self.assertStatusOk(resp)
+
+    def testGroundTruthArchive(self):
+        groundTruth = Folder().load(self.phase1['groundTruthFolderId'], force=True)
+        Upload().uploadFromFile(
+            io.BytesIO(b'truth'), 5, 'truth.txt', parentType='folder', parent=groundTruth,
+            user=self.admin)
+
+        submission = self.createSubmission(self.phase1, self.user, 'submission')
+        submission = Submission().scoreSubmission(submission, 'http://127.0.0.1/api/v1')
+        job = Job().load(submission['jobId'], force=True)
+        spec = job['kwargs']['inputs']['groundtruth']
+        self.assertEqual(spec['resource_type'], 'file')
+
+        # The scoring jobs download the stored archive of the ground truth
+        archive = File().load(spec['id'], force=True)
+        with File().open(archive) as stream:
+            names = zipfile.ZipFile(io.BytesIO(stream.read())).namelist()
+        self.assertEqual(names, ['Ground truth/truth.txt'])
+
+        # The archive is reused while the ground truth is unchanged
+        context = Submission().getScoringContext(self.phase1)
+        self.assertEqual(context['groundTruthArchive']['_id'], archive['_id'])
+
+        # Changing the ground truth replaces the archive
+        Upload().uploadFromFile(
+            io.BytesIO(b'more'), 4, 'more.txt', parentType='folder', parent=groundTruth,
+            user=self.admin)
+        context = Submission().getScoringContext(self.phase1)
+        self.assertNotEqual(context['groundTruthArchive']['_id'], archive['_id'])
+        self.assertIsNone(File().load(archive['_id'], force=True))
+        archive = context['groundTruthArchive']
+
+        # A stale archive that another caller is building is waited for
+        Upload().uploadFromFile(
+            io.BytesIO(b'last'), 4, 'last.txt', parentType='folder', parent=groundTruth,
+            user=self.admin)
+        Phase().update({'_id': self.phase1['_id']}, {'$set': {'groundTruthArchiveBuild': {
+            'hash': 'other', 'expires': datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+        }}})
+
+        def finishBuild(seconds):
+            Phase().update({'_id': self.phase1['_id']}, {
+                '$unset': {'groundTruthArchiveBuild': ''}})
+
+        with mock.patch('covalic.models.phase.time.sleep', side_effect=finishBuild) as sleep:
+            with mock.patch.object(
+                    Phase, '_buildGroundTruthArchive', autospec=True,
+                    side_effect=Phase._buildGroundTruthArchive) as build:
+                context = Submission().getScoringContext(self.phase1)
+        self.assertEqual(sleep.call_count, 1)
+        self.assertEqual(build.call_count, 1)
+        self.assertNotEqual(context['groundTruthArchive']['_id'], archive['_id'])
+        stored = Phase().load(self.phase1['_id'], force=True)
+        self.assertNotIn('groundTruthArchiveBuild', stored)
+
+    def testGetSubmissionRank(self):
+        self.createSubmission(self.phase1, self.admin, 'admin 1', score=[0.8, 0.8])
+        submission1 = self.createSubmission(self.phase1, self.user, 'user 1', score=[0.5, 0.5])
+        submission2 = self.createSubmission(
+            self.phase1, self.user, 'user 2', score=[0.2, 0.2], approach='B')
+
+        resp = self.request(
+            path='/covalic_submission/%s/rank' % submission2['_id'], user=self.user)
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.json, {'rank': 3, 'approachRank': 1})
+
+        # Submissions that are not latest are not ranked
+        submission1['latest'] = False
+        Submission().save(submission1)
+        resp = self.request(
+            path='/covalic_submission/%s/rank' % submission1['_id'], user=self.user)
+        self.assertStatus(resp, 400)
+
+        # Unscored submissions are not ranked
+        unscored = self.createSubmission(self.phase1, self.user, 'user 3', approach='C')
+        resp = self.request(
+            path='/covalic_submission/%s/rank' % unscored['_id'], user=self.user)
+        self.assertStatus(resp, 400)
+
+        # Ranks are hidden along with scores
+        self.phase1['hideScores'] = True
+        Phase().save(self.phase1)
+        resp = self.request(
+            path='/covalic_submission/%s/rank' % submission2['_id'], user=self.user)
+        self.assertStatus(resp, 403)
+        resp = self.request(
+            path='/covalic_submission/%s/rank' % submission2['_id'], user=self.admin)
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.json, {'rank': 2, 'approachRank': 1})
+
+        # Users who may see hidden scores may see ranks too
+        Phase().setUserAccess(self.phase1, self.user, level=AccessType.WRITE, save=True)
+        resp = self.request(
+            path='/covalic_submission/%s/rank' % submission2['_id'], user=self.user)
+        self.assertStatusOk(resp)
+
+    def testListLeaderboard(self):
+        self.createSubmission(self.phase1, self.user, 'user 1', score=[0.2, 0.2])
+        self.createSubmission(self.phase1, self.admin, 'admin 1', score=[0.8, 0.8])
+        path = '/challenge_phase/%s/leaderboard' % self.phase1['_id']
+
+        # Rows are sorted by rank by default
+        resp = self.request(path=path, user=self.user)
+        self.assertStatusOk(resp)
+        self.assertEqual([(row['title'], row['rank']) for row in resp.json], [
+            ('admin 1', 1), ('user 1', 2)])
+
+        # If scores are hidden, rows are sorted by creation date by default
+        self.phase1['hideScores'] = True
+        Phase().save(self.phase1)
+        resp = self.request(path=path, user=self.user)
+        self.assertStatusOk(resp)
+        self.assertEqual([row['title'] for row in resp.json], ['user 1', 'admin 1'])
+        self.assertNotIn('rank', resp.json[0])
+        self.assertNotIn('overallScore', resp.json[0])
+
+        resp = self.request(path=path, user=self.user, params={'sort': 'rank'})
+        self.assertStatus(resp, 403)
+
+        # Users who may see hidden scores still get the ranking
+        resp = self.request(path=path, user=self.admin)
+        self.assertStatusOk(resp)
+        self.assertEqual([row['title'] for row in resp.json], ['admin 1', 'user 1'])
+
+    def testExportSubmissions(self):
+        self.createSubmission(self.phase1, self.user, 'user 1', score=[0.2, 0.4])
+        self.createSubmission(self.phase1, self.admin, 'admin 1', score=[0.8, 0.6])
+        path = '/challenge_phase/%s/submissions/export' % self.phase1['_id']
+
+        resp = self.request(path=path, user=self.user, params={'format': 'ndjson'},
+                            isJson=False)
+        self.assertStatusOk(resp)
+        docs = [json.loads(line) for line in self.getBody(resp).splitlines()]
+        self.assertEqual([doc['title'] for doc in docs], ['admin 1', 'user 1'])
+        self.assertEqual(docs[0]['score'][0]['metrics'][0], {'name': 'accuracy', 'value': 0.8})
+
+        resp = self.request(path=path, user=self.user, isJson=False)
+        self.assertStatusOk(resp)
+        rows = list(csv.reader(self.getBody(resp).splitlines()))
+        header = rows[0]
+        self.assertEqual(header[-3:], ['dataset', 'metric', 'value'])
+        # One row per metric of each dataset, including the averages
+        self.assertEqual(len(rows), 1 + 2 * 2 * 2)
+        self.assertEqual(rows[1][header.index('title')], 'admin 1')
+
+        # Hidden scores are not exported
+        self.phase1['hideScores'] = True
+        Phase().save(self.phase1)
+        resp = self.request(path=path, user=self.user, params={'format': 'ndjson'},
+                            isJson=False)
+        self.assertStatusOk(resp)
+        docs = [json.loads(line) for line in self.getBody(resp).splitlines()]
+        self.assertEqual(len(docs), 2)
+        for doc in docs:
+            self.assertNotIn('score', doc)
+            self.assertNotIn('overallScore', doc)
+
     def testSubmissionWithMetadata(self):
         folder = Folder().createFolder(
             self.admin, 'submission phase 1', parentType='user', creator=self.user
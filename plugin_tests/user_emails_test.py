@@ -17,6 +17,8 @@
 #  limitations under the License.
 ###############################################################################
 
+import mock
+
 from girder.constants import AccessType
 from girder.models.user import User
 from tests import base
@@ -275,3 +277,43 @@ class EmailUtilityTestCase(base.TestCase):
         self.assertIn('user1@email.com', emails)
         self.assertIn('user5@email.com', emails)
         self.assertEqual(len(emails), 2)
+
+    def testGetPhaseUserEmailsCached(self):
+        challenge = Challenge().createChallenge(
+            name='challenge 1',
+            creator=self.user1,
+            public=False)
+        phase = Phase().createPhase(
+            challenge=challenge,
+            name='phase 1',
+            creator=self.user2,
+            ordinal=0)
+
+        # Users of the phase and challenge are resolved with a single query
+        with mock.patch.object(User, 'find', wraps=User().find) as find:
+            emails = getPhaseUserEmails(phase, AccessType.ADMIN)
+            self.assertEqual(sorted(emails), ['user1@email.com', 'user2@email.com'])
+            self.assertEqual(find.call_count, 1)
+
+            # Identical access lists are not resolved again
+            getPhaseUserEmails(phase, AccessType.ADMIN)
+            self.assertEqual(find.call_count, 1)
+
+            # Changing an access list changes the result
+            Phase().setUserAccess(phase, self.user3, level=AccessType.ADMIN, save=True)
+            emails = getPhaseUserEmails(phase, AccessType.ADMIN)
+            self.assertIn('user3@email.com', emails)
+            self.assertEqual(find.call_count, 2)
+
+        # Saving a user without changing their identity keeps the cache
+        with mock.patch.object(User, 'find', wraps=User().find) as find:
+            self.user3['emailVerified'] = True
+            User().save(self.user3)
+            getPhaseUserEmails(phase, AccessType.ADMIN)
+            self.assertEqual(find.call_count, 0)
+
+        # Changing an email address invalidates the cache
+        self.user3['email'] = 'new3@email.com'
+        User().save(self.user3)
+        emails = getPhaseUserEmails(phase, AccessType.ADMIN)
+        self.assertIn('new3@email.com', emails)
@@ -49,6 +49,9 @@ setup(
         'girder-thumbnails',
         'girder-jobs'
     ],
+    extras_require={
+        'numpy': ['numpy']
+    },
     entry_points={
         'girder.plugin': [
             'covalic = covalic:CovalicPlugin'